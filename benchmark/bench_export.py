@@ -0,0 +1,88 @@
+"""
+    Description: Columnar export of a synthetic portfolio (the database of benchmark/bench_indexes.py, 300k issues over 5 projects by default):
+    time of the full export, of an export without changes and of an export after one partition changed, and time to read one year of issues with
+    their status, type, sprint and version names and split labels/components from the database (joins and CSV split) or from the Parquet dataset
+    Run from the repository root: python3 -m benchmark.bench_export [number_of_issues]   (pyarrow and numpy are required)
+"""
+
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from benchmark import bench_indexes
+from src import export
+from src import multi_thread as mt
+
+YEAR_START = "2022-01-01"
+YEAR_END = "2023-01-01"
+
+
+def read_year_from_db(path):
+    """
+        Description: Issues created in the year with their dimension names and link lists, as a BI job reads them from jira.db
+    """
+
+    connection = sqlite3.Connection(path)
+    rows = connection.execute("Select i.id, i.key, s.name, t.name, i.creation_date, i.story_points, i.labels, i.components, "
+                              "(Select group_concat(sp.name) from issue_sprints l join sprint sp on sp.id = l.sprint_id where l.issue_id = i.id), "
+                              "(Select group_concat(v.name) from issue_fix_version l join version v on v.id = l.version_id where l.issue_id = i.id) "
+                              "from issue i left join status s on s.id = i.status_id left join type t on t.id = i.type_id "
+                              "where i.creation_date >= ? and i.creation_date < ?", (YEAR_START, YEAR_END)).fetchall()
+    issues = [(row[0], row[1], row[2], row[3], row[4], float(row[5]) if row[5] else None, export.split_list(row[6]), export.split_list(row[7]),
+               export.split_list(row[8]), export.split_list(row[9])) for row in rows]
+    connection.close()
+    return len(issues)
+
+
+def read_year_from_export(output_dir):
+    dataset = ds.dataset(output_dir, partitioning="hive")
+    created = ds.field("created")
+    start, end = [pa.scalar(datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc), pa.timestamp("ms", tz="UTC")) for day in (YEAR_START, YEAR_END)]
+    table = dataset.to_table(columns=["id", "key", "status", "type", "created", "story_points", "labels", "components", "sprints", "fix_versions"],
+                             filter=(created >= start) & (created < end))
+    return table.num_rows
+
+
+def measure(label, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    print("{0:<32} {1:8.3f}s  {2}".format(label, time.perf_counter() - start, result))
+    return result
+
+
+def main():
+    number_of_issues = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+
+    logging.basicConfig(level=logging.WARNING)
+    mt.log = logging.getLogger(mt.__name__)
+    mt.RAW_STORAGE = "off"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "portfolio.db")
+        output_dir = os.path.join(tmp_dir, "export")
+        bench_indexes.load(path, True, number_of_issues, mt.WRITER_BATCH_SIZE)
+
+        connection = sqlite3.Connection(path)
+        measure("full export", export.export_dataset, connection, output_dir)
+        measure("export without changes", export.export_dataset, connection, output_dir)
+        connection.execute("UPDATE issue set content_hash = 'changed' where id in (Select issue_id from issue_fix_version "
+                           "where version_id = (Select id from version where name = 'ABC 7'))")
+        connection.commit()
+        measure("export after one version changed", export.export_dataset, connection, output_dir)
+        connection.close()
+        print("{0:<32} {1:8.1f} MB".format("export size", sum(os.path.getsize(os.path.join(directory, name)) for directory, _, names in os.walk(output_dir)
+                                                                for name in names) / 1024.0 / 1024.0))
+
+        measure("read a year from the database", read_year_from_db, path)
+        measure("read a year from the export", read_year_from_export, output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+    Description: End-to-end benchmark of the extraction (main.py populate_db) against the local stub JIRA server of benchmark/stub_jira_server.py
+    Every scenario runs main.py in a fresh working directory (manifest, credentials, mapper and an empty database from db/jira_schema.sql) and reports
+    the issues/second, the peak RSS of the largest process (main, worker or writer), the database size and the requests per endpoint served by the stub
+    The synthetic catalogue only depends on the scenario settings and every scenario is repeated (median reported), the results of two commits
+    can be compared with --output and --compare
+    Run from the repository root: python3 -m benchmark.bench_extraction [--scenario NAME ...] [--repeats 3] [--scale 1.0] [--output results.json] [--compare previous.json]
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark import stub_jira_server
+from src import shards
+
+SCHEMA_FILE = "db/jira_schema.sql"
+MIGRATIONS_DIR = "db/migrations"
+MANIFEST_FILE = "manifest.json"
+MAPPER_FILE = "json/mapper/fields.json"
+PORT = 8095
+
+# stub: stub_jira_server settings, projects: manifest project codes, args: main.py arguments, runs: extractions on the same database (the last one is measured)
+SCENARIOS = {
+    "process": {"stub": {"versions": 10, "issues_per_version": 2000, "sprints": 6, "latency_ms": 0}, "projects": ["ABC", "DEF"],
+                "args": ["--engine", "process"], "runs": 1},
+    "process_latency": {"stub": {"versions": 5, "issues_per_version": 1000, "sprints": 6, "latency_ms": 50}, "projects": ["ABC"],
+                        "args": ["--engine", "process"], "runs": 1},
+    "async_latency": {"stub": {"versions": 5, "issues_per_version": 1000, "sprints": 6, "latency_ms": 50}, "projects": ["ABC"],
+                      "args": ["--engine", "async"], "runs": 1},
+    "resync_unchanged": {"stub": {"versions": 10, "issues_per_version": 2000, "sprints": 6, "latency_ms": 0}, "projects": ["ABC", "DEF"],
+                    "args": ["--engine", "process", "--full-resync"], "runs": 2},
+    "sharded": {"stub": {"versions": 10, "issues_per_version": 2000, "sprints": 6, "latency_ms": 0}, "projects": ["ABC", "DEF"],
+                "args": ["--engine", "process", "--storage", "sharded"], "runs": 1},
+    "changelog": {"stub": {"versions": 5, "issues_per_version": 1000, "sprints": 6, "latency_ms": 0}, "projects": ["ABC"],
+                  "args": ["--engine", "process", "--changelog"], "runs": 1},
+}
+# metric, format, True when higher is better
+METRICS = [("issues_per_second", "{0:10.1f}", True), ("seconds", "{0:8.2f}", False), ("peak_rss_mb", "{0:8.1f}", False), ("db_mb", "{0:7.1f}", False),
+           ("requests", "{0:8.0f}", False)]
+
+
+def prepare_workdir(work_dir, scenario, port):
+    """
+        Description: Working directory of main.py: manifest.json with the scenario projects, credentials pointing to the stub, the field mapper and an empty database
+    """
+
+    with open(MANIFEST_FILE) as _file:
+        manifest = json.load(_file)
+    project_template = next(iter(manifest["extract_for"].values()))
+    manifest["extract_for"] = {}
+    for project_code in scenario["projects"]:
+        project = json.loads(json.dumps(project_template))
+        project["settings"].update({"project_code": [project_code], "regex_version": "", "sprint_board_ids": []})
+        manifest["extract_for"][project_code] = project
+    manifest["access"] = "json/connect/credentials.json"
+    manifest["database"] = "db/jira.db"
+
+    os.makedirs(os.path.join(work_dir, "json", "connect"))
+    os.makedirs(os.path.join(work_dir, "json", "mapper"))
+    with open(os.path.join(work_dir, MANIFEST_FILE), "w") as _file:
+        json.dump(manifest, _file, indent=4)
+    with open(os.path.join(work_dir, manifest["access"]), "w") as _file:
+        json.dump({"username": "bench", "password": "bench", "server_url": "http://127.0.0.1:{0}".format(port)}, _file)
+    shutil.copy(MAPPER_FILE, os.path.join(work_dir, MAPPER_FILE))
+    shutil.copytree(MIGRATIONS_DIR, os.path.join(work_dir, MIGRATIONS_DIR))
+    # new shards are created from the schema file
+    shutil.copy(SCHEMA_FILE, os.path.join(work_dir, SCHEMA_FILE))
+
+    connection = sqlite3.Connection(os.path.join(work_dir, manifest["database"]))
+    with open(SCHEMA_FILE) as _file:
+        connection.executescript(_file.read())
+    connection.close()
+    return os.path.join(work_dir, manifest["database"])
+
+
+def run_extraction(work_dir, args):
+    """
+        Description: Run main.py in work_dir, returns the wall seconds and the peak RSS in MB of the largest process of the run
+        (wait4 reports the maximum resident set of the child and of the worker and writer processes it waited for)
+    """
+
+    with open(os.path.join(work_dir, "main_output.txt"), "a") as output:
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.abspath("main.py")] + args, cwd=work_dir, stdout=output, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError("main.py failed with exit code {0}, see {1}".format(process.returncode, os.path.join(work_dir, "main_output.txt")))
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    peak_rss = usage.ru_maxrss / 1024.0 / 1024.0 if sys.platform == "darwin" else usage.ru_maxrss / 1024.0
+    return seconds, peak_rss
+
+
+def latest_run_report(work_dir):
+    reports = sorted(glob.glob(os.path.join(work_dir, "logs", "run_report_*.json")))
+    if len(reports) == 0:
+        return {}
+    with open(reports[-1]) as _file:
+        return json.load(_file)
+
+
+def run_scenario(name, scenario, port):
+    """
+        Description: Start the stub with the scenario settings, run the extractions of the scenario and measure the last one
+        A run that stored no issue or left failed tasks is an error, not a result
+    """
+
+    stub_jira_server.settings.update(scenario["stub"])
+    with tempfile.TemporaryDirectory(prefix="bench_" + name + "_") as work_dir:
+        db_path = prepare_workdir(work_dir, scenario, port)
+        for run in range(scenario["runs"]):
+            for report_path in glob.glob(os.path.join(work_dir, "logs", "run_report_*.json")):
+                os.remove(report_path)
+            stub_jira_server.reset_stats()
+            seconds, peak_rss = run_extraction(work_dir, scenario["args"])
+
+        report = latest_run_report(work_dir)
+        connection = shards.connect(db_path, "sharded" in scenario["args"])
+        stored_issues = connection.execute("Select count(*) from issue").fetchone()[0]
+        connection.close()
+        failed_tasks = report.get("counters", {}).get("task.failed", 0)
+        if stored_issues == 0 or failed_tasks > 0:
+            raise RuntimeError("scenario {0}: {1} issues stored, {2} failed tasks, see {3}".format(name, stored_issues, failed_tasks,
+                                                                                                  os.path.join(work_dir, "main_output.txt")))
+        db_size = sum(os.path.getsize(path) for path in glob.glob(db_path + "*") + glob.glob(os.path.join(os.path.dirname(db_path), shards.SHARD_DIR, "*")))
+        # the issues of the measured run: mapped by the extraction (unchanged issues included), the stored issues when the run report is missing
+        issues = report.get("counters", {}).get("map.issues", stored_issues)
+        requests = dict(stub_jira_server.request_counts)
+        return {"issues": issues, "stored_issues": stored_issues, "seconds": seconds, "issues_per_second": issues / seconds if seconds > 0 else 0.0,
+                "peak_rss_mb": peak_rss, "db_mb": db_size / 1024.0 / 1024.0, "requests": sum(requests.values()), "requests_per_endpoint": requests,
+                "response_mb": sum(stub_jira_server.response_bytes.values()) / 1024.0 / 1024.0}
+
+
+def median_result(results):
+    """
+        Description: Median of every numeric metric of the repeats, the request counts of the first repeat (they do not change between repeats)
+    """
+
+    median = dict(results[0])
+    for key, value in results[0].items():
+        if isinstance(value, (int, float)):
+            median[key] = statistics.median(result[key] for result in results)
+    median["issues_per_second_spread"] = (max(result["issues_per_second"] for result in results) - min(result["issues_per_second"] for result in results)) \
+        / median["issues_per_second"] if median["issues_per_second"] > 0 else 0.0
+    return median
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def scaled(scenario, scale):
+    scenario = json.loads(json.dumps(scenario))
+    scenario["stub"]["issues_per_version"] = max(1, int(scenario["stub"]["issues_per_version"] * scale))
+    return scenario
+
+
+def print_results(results, previous):
+    print("{0:<18} {1:>8} {2:>10} {3:>8} {4:>8} {5:>7} {6:>8}  {7}".format("scenario", "issues", "issues/s", "seconds", "rss MB", "db MB", "requests", "spread"))
+    for name, result in results.items():
+        line = "{0:<18} {1:>8d} ".format(name, int(result["issues"])) + " ".join(_format.format(result[metric]) for metric, _format, _ in METRICS)
+        line += "  {0:5.1%}".format(result["issues_per_second_spread"])
+        print(line)
+        if name in previous:
+            changes = []
+            for metric, _, higher_is_better in METRICS:
+                before = previous[name][metric]
+                if before:
+                    change = (result[metric] - before) / before
+                    changes.append("{0} {1:+.1%}{2}".format(metric, change, "" if abs(change) < 0.05 else (" better" if (change > 0) == higher_is_better else " worse")))
+            print("{0:<18} vs previous: {1}".format("", ", ".join(changes)))
+        print("{0:<18} requests per endpoint: {1}".format("", ", ".join("{0}={1}".format(key, value) for key, value in sorted(result["requests_per_endpoint"].items()))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end extraction benchmark against the stub JIRA server")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="scenario to run, can be repeated, default all")
+    parser.add_argument("--repeats", type=int, default=3, help="runs of every scenario, the median is reported")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the issues per version of every scenario")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of a previous --output to compare with")
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare is not None:
+        with open(args.compare) as _file:
+            previous_results = json.load(_file)
+        previous = previous_results["scenarios"]
+        print("Compared with revision {0} ({1})".format(previous_results.get("revision"), args.compare))
+
+    server = stub_jira_server.start_server(args.port, {})
+    results = {}
+    try:
+        for name in args.scenario or list(SCENARIOS):
+            scenario = scaled(SCENARIOS[name], args.scale)
+            results[name] = median_result([run_scenario(name, scenario, args.port) for repeat in range(args.repeats)])
+    finally:
+        server.shutdown()
+
+    print_results(results, previous)
+    if args.output is not None:
+        with open(args.output, "w") as _file:
+            json.dump({"revision": git_revision(), "repeats": args.repeats, "scale": args.scale, "scenarios": results}, _file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
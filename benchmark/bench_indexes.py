@@ -0,0 +1,137 @@
+"""
+    Description: Load a synthetic database (200k issues by default) with and without the indexes of db/migrations/006_query_indexes.sql
+    and report the ingestion time (writer path, write_batch) and the latency of representative KPI queries on both databases
+    Run from the repository root: python3 -m benchmark.bench_indexes [number_of_issues] [query_repeats]
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from src import multi_thread as mt
+
+SCHEMA_FILE = "db/jira_schema.sql"
+INDEX_MIGRATION_FILE = "db/migrations/006_query_indexes.sql"
+PROJECTS = ["ABC", "DEF", "GHI", "JKL", "MNO"]
+VERSIONS_PER_PROJECT = 40
+SPRINTS = 400
+STATUSES = ["Open", "In Progress", "In Review", "Done", "Closed"]
+TYPES = ["Story", "Bug", "Task", "Epic", "Sub-task"]
+
+# label, query, parameters
+KPI_QUERIES = [
+    ("version issues by status", "Select s.name, count(*) from issue_fix_version f join issue i on i.id = f.issue_id join status s on s.id = i.status_id "
+                                 "where f.version_id = (Select id from version where name = ?) group by s.name", ("ABC 7",)),
+    ("sprint velocity", "Select sum(cast(i.story_points as real)) from issue_sprints f join issue i on i.id = f.issue_id "
+                        "where f.sprint_id = (Select id from sprint where sprint_id = ?)", ("42",)),
+    ("defect trend", "Select substr(creation_date, 1, 7), count(*) from issue where project_id = (Select id from project where project_id = ?) "
+                     "and type_id = (Select id from type where name = 'Bug') group by 1", ("DEF",)),
+    ("open bugs", "Select count(*) from issue where project_id = (Select id from project where project_id = ?) and type_id = (Select id from type where name = 'Bug') "
+                  "and resolution_id = (Select id from resolution where name = '')", ("ABC",)),
+    ("resolved per month", "Select substr(resolution_date, 1, 7), type_id, count(*) from issue where project_id = (Select id from project where project_id = ?) "
+                           "and resolution_date >= ? group by 1, 2", ("GHI", "2023-06-01")),
+    ("bug age", "Select avg(julianday(substr(resolution_date, 1, 10)) - julianday(substr(creation_date, 1, 10))) from issue "
+                "where project_id = (Select id from project where project_id = ?) and type_id = (Select id from type where name = 'Bug') and resolution_date <> ''", ("JKL",)),
+]
+
+
+def index_names():
+    with open(INDEX_MIGRATION_FILE) as _file:
+        return re.findall(r"create (?:unique )?index if not exists (\w+)", _file.read())
+
+
+def create_db(path, with_query_indexes):
+    connection = sqlite3.Connection(path)
+    with open(SCHEMA_FILE) as _file:
+        connection.executescript(_file.read())
+    if not with_query_indexes:
+        for name in index_names():
+            connection.execute("DROP INDEX " + name)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA wal_autocheckpoint={0}".format(mt.WRITER_WAL_AUTOCHECKPOINT))
+    versions = [(str(p * VERSIONS_PER_PROJECT + v), "{0} {1}".format(project, v)) for p, project in enumerate(PROJECTS) for v in range(VERSIONS_PER_PROJECT)]
+    connection.executemany("INSERT INTO version(version_id, name) values(?,?)", versions)
+    connection.commit()
+    return connection
+
+
+def generate_record(i):
+    # the project changes with every issue, the other values with every round of projects so that all combinations exist
+    project = PROJECTS[i % len(PROJECTS)]
+    n = i // len(PROJECTS)
+    created_day = i % 730
+    resolved = i % 3 != 0
+    populated = {"key": "{0}-{1}".format(project, i), "summary": "summary {0}".format(i), "epic_name": "", "labels": "a,b",
+                 "created_date": "{0}-{1:02d}-{2:02d}T10:00:00.000+0000".format(2022 + created_day // 365, created_day % 365 // 31 + 1, created_day % 28 + 1),
+                 "resolution_date": "{0}-{1:02d}-{2:02d}T10:00:00.000+0000".format(2023, (created_day + 40) % 12 + 1, created_day % 28 + 1) if resolved else "",
+                 "updated_date": "2024-01-01T10:00:00.000+0000", "start_date": "", "due_date": "", "priority": "High", "assignee": "Assignee", "reporter": "Reporter",
+                 "components": "c1", "epic_links": "", "story_points": str(i % 8), "tshirt_size": "", "linked_theme": "",
+                 "fix_version": "{0} {1}".format(project, n % VERSIONS_PER_PROJECT), "affects_version": "{0} {1}".format(project, (n + 1) % VERSIONS_PER_PROJECT),
+                 "resolution": "Done" if resolved else "", "status": STATUSES[n % len(STATUSES)], "type": TYPES[n // 3 % len(TYPES)], "sprints": str(i % SPRINTS),
+                 "project_code": project}
+    sprint = {"id": i % SPRINTS, "name": "Sprint {0}".format(i % SPRINTS), "sequence": i % SPRINTS, "state": "CLOSED", "goal": "", "startDate": "", "endDate": "", "completeDate": ""}
+    return mt.build_issue_record(populated, {"key": populated["key"]}, [sprint])
+
+
+def load(path, with_query_indexes, number_of_issues, batch_size):
+    """
+        Description: Ingest the synthetic issues with the writer path, returns the seconds spent in write_batch (record generation excluded)
+    """
+
+    mt.DB_CONNECTION = create_db(path, with_query_indexes)
+    mt.DIMENSION_CACHE = {}
+    mt.warm_dimension_cache()
+    elapsed = 0.0
+    for index in range(0, number_of_issues, batch_size):
+        records = [generate_record(i) for i in range(index, min(number_of_issues, index + batch_size))]
+        start = time.perf_counter()
+        mt.write_batch(records)
+        elapsed += time.perf_counter() - start
+    mt.DB_CONNECTION.execute("ANALYZE")
+    mt.disconnect_from_db()
+    return elapsed
+
+
+def query_latency(path, query, parameters, repeats):
+    connection = sqlite3.Connection(path)
+    timings = []
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        connection.execute(query, parameters).fetchall()
+        timings.append(time.perf_counter() - start)
+    plan = " | ".join(row[3] for row in connection.execute("EXPLAIN QUERY PLAN " + query, parameters))
+    connection.close()
+    return statistics.median(timings), plan
+
+
+def main():
+    number_of_issues = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    logging.basicConfig(level=logging.WARNING)
+    mt.log = logging.getLogger(mt.__name__)
+    mt.RAW_STORAGE = "off"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = {}
+        for label, with_query_indexes in (("before", False), ("after", True)):
+            paths[label] = os.path.join(tmp_dir, label + ".db")
+            elapsed = load(paths[label], with_query_indexes, number_of_issues, mt.WRITER_BATCH_SIZE)
+            print("{0:<7} ingestion of {1} issues in {2:8.2f}s -> {3:10.1f} issues/s, db {4:.1f} MB".format(label, number_of_issues, elapsed, number_of_issues / elapsed,
+                                                                                                         os.path.getsize(paths[label]) / 1024.0 / 1024.0))
+
+        print("{0:<26} {1:>12} {2:>12}".format("query (median)", "before ms", "after ms"))
+        for label, query, parameters in KPI_QUERIES:
+            before, _ = query_latency(paths["before"], query, parameters, repeats)
+            after, plan = query_latency(paths["after"], query, parameters, repeats)
+            print("{0:<26} {1:>12.2f} {2:>12.2f}   {3}".format(label, before * 1000, after * 1000, plan))
+
+
+if __name__ == "__main__":
+    main()
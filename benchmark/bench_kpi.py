@@ -0,0 +1,67 @@
+"""
+    Description: Score a synthetic portfolio (the database of benchmark/bench_indexes.py, 300k issues over 5 projects by default) with every KPI of src/kpi.py
+    and report the time spent loading the column arrays and computing each KPI for all projects
+    Run from the repository root: python3 -m benchmark.bench_kpi [number_of_issues]
+"""
+
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmark import bench_indexes
+from src import kpi
+from src import multi_thread as mt
+
+
+def add_dates(path):
+    """
+        Description: Give the synthetic sprints two weeks windows (greenhopper date format) and the versions a start date
+    """
+
+    connection = sqlite3.Connection(path)
+    sprint_rows = []
+    for (sprint_id,) in connection.execute("Select sprint_id from sprint").fetchall():
+        sprint_start = datetime(2022, 1, 3, 9) + timedelta(days=int(sprint_id) * 14 % 730)
+        sprint_rows.append((sprint_start.strftime(kpi.SPRINT_DATE_FORMATS[0]), (sprint_start + timedelta(days=14)).strftime(kpi.SPRINT_DATE_FORMATS[0]), sprint_id))
+    connection.executemany("UPDATE sprint set state='CLOSED', start_date=?, complete_date=? WHERE sprint_id=?", sprint_rows)
+    connection.execute("UPDATE version set start_date=date('2022-01-01', '+' || (id * 13 % 700) || ' days')")
+    connection.commit()
+    connection.close()
+
+
+def main():
+    number_of_issues = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+
+    logging.basicConfig(level=logging.WARNING)
+    mt.log = logging.getLogger(mt.__name__)
+    mt.RAW_STORAGE = "off"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "portfolio.db")
+        bench_indexes.load(path, True, number_of_issues, mt.WRITER_BATCH_SIZE)
+        add_dates(path)
+
+        connection = sqlite3.Connection(path)
+        start = time.perf_counter()
+        tables = kpi.load_tables(connection)
+        print("{0:<24} {1:8.3f}s ({2} issues, {3} sprints, {4} versions)".format("load tables", time.perf_counter() - start, len(tables["issue"]["id"]),
+                                                                           len(tables["sprint"]["id"]), len(tables["version"]["id"])))
+        connection.close()
+
+        total = 0.0
+        for name, function in kpi.KPI_FUNCTIONS.items():
+            start = time.perf_counter()
+            for project in bench_indexes.PROJECTS:
+                function(tables, kpi.project_mask(tables, [project]))
+            elapsed = time.perf_counter() - start
+            total += elapsed
+            print("{0:<24} {1:8.3f}s for {2} projects".format(name, elapsed, len(bench_indexes.PROJECTS)))
+        print("{0:<24} {1:8.3f}s".format("all kpis", total))
+
+
+if __name__ == "__main__":
+    main()
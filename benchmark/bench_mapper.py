@@ -0,0 +1,91 @@
+"""
+    Description: Measure the issues/second of the mapping stage alone (jira issue payload -> populated dictionary), compiled mapper (map_issue) against the previous getJiraValue path
+    The recorded issue payloads of benchmark/fixtures/issues.json are mapped with json/mapper/fields.json
+    Run from the repository root: python3 -m benchmark.bench_mapper [number_of_issues]
+"""
+
+import json
+import logging
+import re
+import sys
+import time
+
+from src import multi_thread as mt
+
+FIXTURE_FILE = "benchmark/fixtures/issues.json"
+MAPPER_FILE = "json/mapper/fields.json"
+
+
+def get_jira_value(dict, element_list, key):
+    """
+        Description: The previous getJiraValue, kept here only as the benchmark reference (numeric values are converted with str, the previous code raised TypeError for them)
+    """
+
+    value = None
+    try:
+        if (len(element_list) == 1):
+            value = dict[element_list[0]]
+        else:
+            temp_dict = dict[element_list[0]]
+            for item in element_list[1:-1]:
+                temp_dict = temp_dict[item]
+            if (element_list[-1][-2:] == "[]"):
+                value_array = []
+                for item in temp_dict:
+                    value_array.append(item[element_list[-1][:-2]])
+                value = ",".join(value_array)
+            else:
+                value = temp_dict[element_list[-1]]
+                if key == "sprints" and value is not None:
+                    value = re.findall(r"id=([\d*]*)", "|".join(value))
+    except KeyError as ke:
+        value = ""
+        mt.log.warning("KeyError unable to extract value for Key: {0}, error recived: {1}".format(key, ke))
+    except Exception as e:
+        value = ""
+        mt.log.error("Exception unable to extract value for Key: {0}, error recived: {1}".format(key, e))
+    if (isinstance(value, str)):
+        return value
+    if (value is None):
+        return ""
+    if (isinstance(value, list)):
+        return ",".join(value)
+    return str(value)
+
+
+def map_previous(issue_dict):
+    populated_dict = {}
+    for key, value in mt.FIELDS_JSON_DICT.items():
+        populated_dict[key] = get_jira_value(issue_dict, value.split("."), key)
+    return populated_dict
+
+
+def measure(label, function, issues):
+    start = time.perf_counter()
+    for issue_dict in issues:
+        function(issue_dict)
+    elapsed = time.perf_counter() - start
+    print("{0:<12} {1:>8} issues in {2:8.3f}s -> {3:10.1f} issues/s".format(label, len(issues), elapsed, len(issues) / elapsed))
+
+
+def main():
+    number_of_issues = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    logging.basicConfig(level=logging.CRITICAL)
+    mt.log = logging.getLogger(mt.__name__)
+
+    with open(MAPPER_FILE) as _file:
+        mt.FIELDS_JSON_DICT = json.load(_file)["issue"]
+    mt.COMPILED_MAPPER = mt.compile_field_mapper(mt.FIELDS_JSON_DICT)
+    with open(FIXTURE_FILE) as _file:
+        fixture = json.load(_file)
+    issues = [fixture[i % len(fixture)] for i in range(number_of_issues)]
+
+    for issue_dict in fixture:
+        print("{0}: {1}".format(issue_dict["key"], mt.map_issue(issue_dict)))
+    measure("previous", map_previous, issues)
+    measure("compiled", mt.map_issue, issues)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+    Description: Compare the raw payload storage options (RAW_STORAGE / RAW_STORAGE_TABLE / RAW_STORAGE_KEYS) on a sample database:
+    database size, encoding issues/second (worker side) and write issues/second of a first load and of a second load of the same unchanged issues
+    The sample issues replay benchmark/fixtures/issues.json with unique keys
+    Run from the repository root: python3 -m benchmark.bench_raw_storage [number_of_issues]
+"""
+
+import copy
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from benchmark.bench_upsert import create_db
+from src import multi_thread as mt
+
+FIXTURE_FILE = "benchmark/fixtures/issues.json"
+VERSIONS_FILE = "benchmark/fixtures/versions.json"
+MAPPER_FILE = "json/mapper/fields.json"
+
+# label, RAW_STORAGE, RAW_STORAGE_TABLE, RAW_STORAGE_KEYS
+OPTIONS = [("repr (previous)", "repr", "issue", []),
+           ("json", "json", "issue", []),
+           ("compressed", "compressed", "issue", []),
+           ("json side table", "json", "issue_raw", []),
+           ("compressed side", "compressed", "issue_raw", []),
+           ("compressed keys", "compressed", "issue_raw", ["key", "fields.status", "fields.created", "fields.updated", "fields.resolutiondate"]),
+           ("off", "off", "issue_raw", [])]
+
+
+def sample_issues(number_of_issues):
+    with open(FIXTURE_FILE) as _file:
+        fixture = json.load(_file)
+    issues = []
+    for i in range(number_of_issues):
+        issue_dict = copy.deepcopy(fixture[i % len(fixture)])
+        issue_dict["id"] = str(i + 1)
+        issue_dict["key"] = "ABC-{0}".format(i + 1)
+        issues.append(issue_dict)
+    return issues
+
+
+def load(issues, populated, batch_size):
+    """
+        Description: Encode the issues like the workers do and write them like the writer process does, returns (encoding seconds, writing seconds)
+    """
+
+    start = time.perf_counter()
+    records = [mt.build_issue_record(populated_dict, issue_dict, []) for populated_dict, issue_dict in zip(populated, issues)]
+    encoded = time.perf_counter()
+    for index in range(0, len(records), batch_size):
+        mt.write_batch(records[index:index + batch_size])
+    return encoded - start, time.perf_counter() - encoded
+
+
+def main():
+    number_of_issues = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    logging.basicConfig(level=logging.WARNING)
+    mt.log = logging.getLogger(mt.__name__)
+
+    with open(MAPPER_FILE) as _file:
+        mt.FIELDS_JSON_DICT = json.load(_file)["issue"]
+    mt.COMPILED_MAPPER = mt.compile_field_mapper(mt.FIELDS_JSON_DICT)
+    issues = sample_issues(number_of_issues)
+    populated = [mt.map_issue(issue_dict) for issue_dict in issues]
+    with open(VERSIONS_FILE) as _file:
+        versions = json.load(_file)
+
+    print("{0:<16} {1:>10} {2:>12} {3:>14} {4:>14}".format("option", "db MB", "encode/s", "first write/s", "same write/s"))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for label, storage, table, keys in OPTIONS:
+            mt.RAW_STORAGE, mt.RAW_STORAGE_TABLE, mt.RAW_STORAGE_KEYS = storage, table, keys
+            path = os.path.join(tmp_dir, label.replace(" ", "_").replace("(", "").replace(")", "") + ".db")
+            mt.DB_CONNECTION = create_db(path, True)
+            mt.DB_CONNECTION.executemany("INSERT INTO version(version_id, name) values(?,?) ON CONFLICT DO NOTHING", [(version["id"], version["name"]) for version in versions])
+            mt.DB_CONNECTION.commit()
+            encode_seconds, first_seconds = load(issues, populated, mt.WRITER_BATCH_SIZE)
+            _, second_seconds = load(issues, populated, mt.WRITER_BATCH_SIZE)
+            mt.DB_CONNECTION.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            mt.disconnect_from_db()
+            print("{0:<16} {1:>10.2f} {2:>12.1f} {3:>14.1f} {4:>14.1f}".format(label, os.path.getsize(path) / 1024.0 / 1024.0, number_of_issues / encode_seconds,
+                                                                              number_of_issues / first_seconds, number_of_issues / second_seconds))
+
+
+if __name__ == "__main__":
+    main()
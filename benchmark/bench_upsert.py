@@ -0,0 +1,161 @@
+"""
+    Description: Compare the rows/second of the bulk upsert path (store_issues_bulk) against the previous per-row path
+    (select, insert or update, select and a commit for every issue, sprint and relation row)
+    Run from the repository root: python3 -m benchmark.bench_upsert [number_of_issues] [page_size]
+"""
+
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from src import multi_thread as mt
+
+SCHEMA_FILE = "db/jira_schema.sql"
+
+
+def create_db(path, with_unique_indexes):
+    """
+        Description: Create an empty database, the previous schema had no unique indexes
+    """
+
+    with open(SCHEMA_FILE) as _file:
+        schema = _file.read()
+    if not with_unique_indexes:
+        schema = "\n".join(line for line in schema.split("\n") if not line.startswith("create unique index"))
+    connection = sqlite3.Connection(path)
+    connection.executescript(schema)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executemany("INSERT INTO version(version_id, name) values(?,?) ON CONFLICT DO NOTHING", [(str(v), "V{0}".format(v)) for v in range(20)])
+    connection.commit()
+    return connection
+
+
+def generate_records(number_of_issues, revision=0):
+    """
+        Description: Generate issue records with the same shape as the ones pushed by store_issue_in_db, a new revision changes the summary of every issue
+    """
+
+    records = []
+    for i in range(number_of_issues):
+        populated = {"key": "ABC-{0}".format(i), "summary": "summary {0} r{1}".format(i, revision), "epic_name": "", "labels": "a,b", "created_date": "2023-01-01T10:00:00.000+0000",
+                     "resolution_date": "", "updated_date": "2023-02-01T10:00:00.000+0000", "start_date": "", "due_date": "", "priority": "High",
+                     "assignee": "Assignee", "reporter": "Reporter", "components": "c1", "epic_links": "", "story_points": str(i % 8), "tshirt_size": "",
+                     "linked_theme": "", "fix_version": "V{0}".format(i % 20), "affects_version": "V{0}".format((i + 1) % 20), "resolution": ["Done", ""][i % 2],
+                     "status": ["Open", "In Progress", "Done"][i % 3], "type": ["Bug", "Story"][i % 2], "sprints": str(i % 50), "project_code": "ABC"}
+        sprint = {"id": i % 50, "name": "Sprint {0}".format(i % 50), "sequence": i % 50, "state": "CLOSED", "goal": "", "startDate": "", "endDate": "", "completeDate": ""}
+        record = mt.build_issue_record(populated, {"key": populated["key"]}, [sprint])
+        # the previous path stored str(raw)
+        record["raw"] = {"key": populated["key"]}
+        records.append(record)
+    return records
+
+
+def store_per_row(connection, record):
+    """
+        Description: The previous per-row path, kept here only as the benchmark reference
+    """
+
+    cur = connection.cursor()
+    sprint_db_ids = []
+    for sprint_dict in record["sprints"]:
+        cur.execute("Select * from sprint where sprint_id = ?", (sprint_dict["id"],))
+        if len(cur.fetchall()) == 0:
+            cur.execute("INSERT INTO sprint(sprint_id, name, sequence, state, goal, start_date, end_date, complete_date) values(?,?,?,?,?,?,?,?)",
+                        (sprint_dict["id"], sprint_dict["name"], sprint_dict["sequence"], sprint_dict["state"], sprint_dict["goal"], sprint_dict["startDate"], sprint_dict["endDate"], sprint_dict["completeDate"]))
+            connection.commit()
+            sprint_db_ids.append(cur.lastrowid)
+        else:
+            cur.execute("UPDATE sprint  set name=?, sequence=?, state=?, goal=?, start_date=?, end_date=?, complete_date=? WHERE sprint_id=?",
+                        (sprint_dict["name"], sprint_dict["sequence"], sprint_dict["state"], sprint_dict["goal"], sprint_dict["startDate"], sprint_dict["endDate"], sprint_dict["completeDate"], sprint_dict["id"]))
+            connection.commit()
+            cur.execute("Select id from sprint where sprint_id = ?", (sprint_dict["id"],))
+            sprint_db_ids.append(cur.fetchall()[0][0])
+
+    populated = record["populated"]
+    dimension_ids = []
+    for table, column, value in (("project", "project_id", populated["project_code"]), ("resolution", "name", populated["resolution"]),
+                                 ("status", "name", populated["status"]), ("type", "name", populated["type"])):
+        cur.execute("Select id from " + table + " where " + column + " = ?", (value,))
+        rows = cur.fetchall()
+        if len(rows) == 0:
+            cur.execute("INSERT INTO " + table + " (" + column + ") values(?)", (value,))
+            connection.commit()
+            dimension_ids.append(cur.lastrowid)
+        else:
+            dimension_ids.append(rows[0][0])
+
+    columns = [column for column, field in mt.ISSUE_FIELD_COLUMNS]
+    values = [populated[field] for column, field in mt.ISSUE_FIELD_COLUMNS]
+    cur.execute("Select id from issue where key = ?", (populated["key"],))
+    if len(cur.fetchall()) == 0:
+        cur.execute("INSERT INTO issue(" + ", ".join(columns) + ", resolution_id, status_id, type_id, project_id, raw_value) values(" + ",".join(["?"] * (len(columns) + 5)) + ")",
+                    values + dimension_ids[1:] + dimension_ids[:1] + [str(record["raw"])])
+        connection.commit()
+        issue_id = cur.lastrowid
+    else:
+        cur.execute("UPDATE issue set " + ", ".join(column + "=?" for column in columns[1:]) + ", resolution_id=?, status_id=?, type_id=?, project_id=?, raw_value=? WHERE key = ?",
+                    values[1:] + dimension_ids[1:] + dimension_ids[:1] + [str(record["raw"]), populated["key"]])
+        connection.commit()
+        cur.execute("Select id from issue where key = ?", (populated["key"],))
+        issue_id = cur.fetchall()[0][0]
+
+    for sprint_id in sprint_db_ids:
+        cur.execute("Select * from issue_sprints where issue_id = ? and sprint_id=?", (issue_id, sprint_id))
+        if len(cur.fetchall()) == 0:
+            cur.execute("INSERT INTO issue_sprints (issue_id, sprint_id) values(?,?)", (issue_id, sprint_id))
+            connection.commit()
+    for table, field in (("issue_fix_version", "fix_version"), ("issue_affects_version", "affects_version")):
+        for name in mt.split_csv(populated[field]):
+            cur.execute("Select id from version where name = ?", (name,))
+            rows = cur.fetchall()
+            if len(rows) > 0:
+                cur.execute("Select * from " + table + " where issue_id = ? and version_id=?", (issue_id, rows[0][0]))
+                if len(cur.fetchall()) == 0:
+                    cur.execute("INSERT INTO " + table + " (issue_id, version_id) values(?,?)", (issue_id, rows[0][0]))
+                    connection.commit()
+
+
+def run_per_row(path, records):
+    connection = create_db(path, False)
+    start = time.perf_counter()
+    for record in records:
+        store_per_row(connection, record)
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return elapsed
+
+
+def run_bulk(path, records, page_size):
+    mt.DB_CONNECTION = create_db(path, True)
+    start = time.perf_counter()
+    for index in range(0, len(records), page_size):
+        mt.write_batch(records[index:index + page_size])
+    elapsed = time.perf_counter() - start
+    mt.disconnect_from_db()
+    return elapsed
+
+
+def main():
+    number_of_issues = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else mt.WRITER_BATCH_SIZE
+
+    logging.basicConfig(level=logging.WARNING)
+    mt.log = logging.getLogger(mt.__name__)
+
+    records = generate_records(number_of_issues)
+    changed_records = generate_records(number_of_issues, 1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for label, run in (("per-row", lambda: run_per_row(os.path.join(tmp_dir, "per_row.db"), records)),
+                           ("bulk", lambda: run_bulk(os.path.join(tmp_dir, "bulk.db"), records, page_size)),
+                           ("bulk unchanged", lambda: run_bulk(os.path.join(tmp_dir, "bulk.db"), records, page_size)),
+                           ("bulk changed", lambda: run_bulk(os.path.join(tmp_dir, "bulk.db"), changed_records, page_size))):
+            elapsed = run()
+            print("{0:<15} {1:>8} issues in {2:8.3f}s -> {3:10.1f} issues/s".format(label, number_of_issues, elapsed, number_of_issues / elapsed))
+
+
+if __name__ == "__main__":
+    main()
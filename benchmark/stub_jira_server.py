@@ -0,0 +1,346 @@
+"""
+    Description: Local stub JIRA server replaying the recorded responses of benchmark/fixtures (issues.json, sprints.json, versions.json)
+    Serves the REST endpoints used by the extraction (server info, fields, project, project versions, board sprints, search, sprint info and issue changelog),
+    with an optional latency per request and an optional 429 (Retry-After) every N requests, the project versions are answered with an ETag (304 when unchanged)
+    Any project key is answered: with --versions N every project gets N synthetic versions (the recorded versions otherwise) and with --sprints N
+    the issues of a version are spread over N synthetic sprints (the recorded sprints otherwise), the catalogue only depends on the settings
+    Run from the repository root: python3 -m benchmark.stub_jira_server --port 8089 --versions 10 --issues-per-version 1000 --sprints 5 --latency-ms 50
+    and point json/connect/credentials.json "server_url" to http://localhost:8089
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = "benchmark/fixtures"
+
+# routes answered with an ETag, a request with a matching If-None-Match gets a 304 without body
+ETAG_ROUTES = ["project_versions"]
+
+# histories embedded in a search result with expand=changelog, like jira cloud the rest is only served by the issue changelog endpoint
+EMBEDDED_HISTORIES = 100
+
+SPRINT_FIELD = "customfield_10021"
+SPRINT_VALUE = ("com.atlassian.greenhopper.service.sprint.Sprint@5d1a2c3f[id={0},rapidViewId=42,state={1},name=Sprint {0},startDate={2}T09:00:00.000+02:00,"
+                "endDate={3}T09:00:00.000+02:00,completeDate={3}T10:12:00.000+02:00,sequence={0},goal=]")
+# first day of the synthetic versions, each version lasts VERSION_DAYS and its sprints share them
+CATALOGUE_START = date(2021, 1, 4)
+VERSION_DAYS = 84
+
+# server state, set by start_server
+# versions: synthetic versions per project (0: the recorded ones), sprints: synthetic sprints per version (0: the recorded sprint values of the issues)
+settings = {"issues_per_version": 1000, "versions": 0, "sprints": 0, "latency_ms": 0, "throttle_every": 0, "retry_after": 1}
+recorded_issues = []
+# JSON text of the recorded issues, decoding it is several times faster than a deepcopy and keeps the stub from being the bottleneck of a benchmark
+recorded_issue_texts = []
+recorded_sprints = {}
+recorded_versions = []
+request_counts = {}
+response_bytes = {}
+stats_lock = threading.Lock()
+
+
+def load_fixtures(fixtures_dir):
+    global recorded_issues
+    global recorded_issue_texts
+    global recorded_sprints
+    global recorded_versions
+
+    with open(fixtures_dir + "/issues.json") as _file:
+        recorded_issues = json.load(_file)
+    recorded_issue_texts = [json.dumps(issue_dict) for issue_dict in recorded_issues]
+    with open(fixtures_dir + "/sprints.json") as _file:
+        recorded_sprints = json.load(_file)
+    with open(fixtures_dir + "/versions.json") as _file:
+        recorded_versions = json.load(_file)
+
+
+def reset_stats():
+    with stats_lock:
+        request_counts.clear()
+        response_bytes.clear()
+
+
+def project_number(project_key):
+    # stable id of a project key, the same key gets the same ids on every run
+    return zlib.crc32(project_key.encode("utf-8")) % 90000 + 10000
+
+
+def project_versions(project_key):
+    """
+        Description: Versions of a project: the recorded ones, or settings["versions"] synthetic versions of VERSION_DAYS days, all released but the last one
+    """
+
+    if settings["versions"] <= 0:
+        return recorded_versions
+    versions = []
+    for index in range(settings["versions"]):
+        start = CATALOGUE_START + timedelta(days=index * VERSION_DAYS)
+        version_id = str(project_number(project_key) * 1000 + index)
+        versions.append({"self": "http://localhost/rest/api/2/version/" + version_id, "id": version_id, "description": "",
+                         "name": "{0} {1}.{2}".format(project_key, start.year, index + 1), "archived": False, "released": index < settings["versions"] - 1,
+                         "startDate": start.isoformat(), "releaseDate": (start + timedelta(days=VERSION_DAYS - 1)).isoformat(),
+                         "overdue": False, "projectId": project_number(project_key)})
+    return versions
+
+
+def version_count():
+    return settings["versions"] if settings["versions"] > 0 else len(recorded_versions)
+
+
+def version_sprints(version_index):
+    """
+        Description: (id, state, start date, end date) of the synthetic sprints of a version, the sprint ids are shared by all projects like a common board
+    """
+
+    sprint_days = VERSION_DAYS // settings["sprints"]
+    sprints = []
+    for index in range(settings["sprints"]):
+        start = CATALOGUE_START + timedelta(days=version_index * VERSION_DAYS + index * sprint_days)
+        is_last_version = version_index == version_count() - 1
+        state = "ACTIVE" if is_last_version and index == settings["sprints"] - 1 else "CLOSED"
+        sprints.append((version_index * settings["sprints"] + index + 1, state, start.isoformat(), (start + timedelta(days=sprint_days)).isoformat()))
+    return sprints
+
+
+def version_issue(project_key, version_index, version, index):
+    """
+        Description: Replay a recorded issue as issue number index of a version, with a unique key, the project, the version as fix version and its synthetic sprint
+    """
+
+    issue_dict = json.loads(recorded_issue_texts[index % len(recorded_issue_texts)])
+    number = version_index * 1000000 + index + 1
+    issue_dict["id"] = str(number)
+    issue_dict["key"] = "{0}-{1}".format(project_key, number)
+    fields = issue_dict["fields"]
+    fields["project"] = {"id": str(project_number(project_key)), "key": project_key, "name": project_key, "projectTypeKey": "software"}
+    fields["fixVersions"] = [version]
+    if settings["sprints"] > 0:
+        fields[SPRINT_FIELD] = [SPRINT_VALUE.format(*version_sprints(version_index)[index % settings["sprints"]])]
+    return issue_dict
+
+
+def issue_by_key(key):
+    # <project>-<version index * 1000000 + index + 1>, as numbered by version_issue
+    project_key, number = key.rsplit("-", 1)
+    version_index, index = divmod(int(number) - 1, 1000000)
+    return version_issue(project_key, version_index, project_versions(project_key)[version_index], index)
+
+
+def issue_histories(issue_dict):
+    """
+        Description: Changelog histories of a replayed issue: Open -> In Progress the day it was created, then -> its current status when it is resolved
+    """
+
+    fields = issue_dict["fields"]
+    histories = [{"id": "1", "created": fields["created"], "items": [{"field": "status", "fieldtype": "jira", "fromString": "Open", "toString": "In Progress"}]}]
+    if fields.get("resolutiondate"):
+        histories.append({"id": "2", "created": fields["resolutiondate"],
+                          "items": [{"field": "resolution", "fieldtype": "jira", "fromString": None, "toString": "Done"},
+                                    {"field": "status", "fieldtype": "jira", "fromString": "In Progress", "toString": fields["status"]["name"]}]})
+    return histories
+
+
+def issue_changelog(key, params):
+    histories = issue_histories(issue_by_key(key))
+    start_at = int(params.get("startAt", 0))
+    max_results = min(int(params.get("maxResults", 100)), 100)
+    return {"startAt": start_at, "maxResults": max_results, "total": len(histories), "isLast": start_at + max_results >= len(histories),
+            "values": histories[start_at:start_at + max_results]}
+
+
+def search(params):
+    """
+        Description: Answer a search with the issues of the version named in the JQL (project = KEY or project in (KEY,...) and fixVersion = "name"),
+        paginated with startAt/maxResults, the issues of a version are in the first project of the JQL
+        A JQL "key in (...)" answers the listed issues, with their changelog when expand=changelog is requested
+    """
+
+    jql = params.get("jql", "")
+    start_at = int(params.get("startAt", 0))
+    max_results = min(int(params.get("maxResults", 50)), 100)
+    match = re.search(r'fixVersion = "([^"]*)"', jql)
+
+    keys = re.search(r"key in \(([^)]*)\)", jql)
+    if keys is not None:
+        issues = [issue_by_key(key.strip()) for key in keys.group(1).split(",")][start_at:start_at + max_results]
+        if "changelog" in params.get("expand", ""):
+            for issue_dict in issues:
+                histories = issue_histories(issue_dict)
+                issue_dict["changelog"] = {"startAt": 0, "maxResults": EMBEDDED_HISTORIES, "total": len(histories), "histories": histories[:EMBEDDED_HISTORIES]}
+        return {"expand": "schema,names", "startAt": start_at, "maxResults": max_results, "total": len(keys.group(1).split(",")), "issues": issues}
+
+    project = re.search(r"project\s+(?:=\s*|in\s*\()\s*([^\s,)]+)", jql)
+    project_key = project.group(1) if project is not None else "ABC"
+    total = 0
+    issues = []
+    for version_index, version in enumerate(project_versions(project_key)):
+        if match is not None and version["name"] == match.group(1):
+            total = settings["issues_per_version"]
+            if max_results > 0:
+                issues = [version_issue(project_key, version_index, version, index) for index in range(start_at, min(total, start_at + max_results))]
+    return {"expand": "schema,names", "startAt": start_at, "maxResults": max_results, "total": total, "issues": issues}
+
+
+def greenhopper_date(iso_date, time_of_day):
+    # 4/Jan/21 9:00 AM
+    day = date.fromisoformat(iso_date)
+    return "{0}/{1} {2}".format(day.day, day.strftime("%b/%y"), time_of_day)
+
+
+def sprint(sprint_id):
+    if sprint_id in recorded_sprints and settings["sprints"] <= 0:
+        return recorded_sprints[sprint_id]
+    # sprints that were not recorded are replayed from the first recorded one
+    sprint_dict = copy.deepcopy(next(iter(recorded_sprints.values())))
+    sprint_dict["sprint"]["id"] = int(sprint_id)
+    sprint_dict["sprint"]["name"] = "Sprint {0}".format(sprint_id)
+    sprint_dict["sprint"]["sequence"] = int(sprint_id)
+    if settings["sprints"] > 0:
+        _, state, start, end = version_sprints((int(sprint_id) - 1) // settings["sprints"])[(int(sprint_id) - 1) % settings["sprints"]]
+        sprint_dict["sprint"].update({"state": state, "startDate": greenhopper_date(start, "9:00 AM"), "endDate": greenhopper_date(end, "9:00 AM"),
+                                      "completeDate": greenhopper_date(end, "10:12 AM") if state == "CLOSED" else "",
+                                      "isoStartDate": start + "T09:00:00+0200", "isoEndDate": end + "T09:00:00+0200",
+                                      "isoCompleteDate": end + "T10:12:00+0200" if state == "CLOSED" else ""})
+    return sprint_dict
+
+
+def agile_sprint(sprint_id):
+    # agile API format of a sprint (/rest/agile/1.0/sprint/{id}, called by sprint_info of jira 3.x, and the board sprints)
+    sprint_dict = sprint(sprint_id)["sprint"]
+    return {"id": sprint_dict["id"], "self": "http://localhost/rest/agile/1.0/sprint/{0}".format(sprint_dict["id"]), "state": sprint_dict["state"].lower(),
+            "name": sprint_dict["name"], "startDate": sprint_dict["isoStartDate"], "endDate": sprint_dict["isoEndDate"],
+            "completeDate": sprint_dict["isoCompleteDate"], "originBoardId": 42, "goal": sprint_dict["goal"]}
+
+
+def board_sprints():
+    sprint_ids = [str(sprint_id) for version_index in range(version_count()) for sprint_id, _, _, _ in version_sprints(version_index)] if settings["sprints"] > 0 \
+        else list(recorded_sprints)
+    return {"maxResults": 50, "startAt": 0, "isLast": True, "values": [agile_sprint(sprint_id) for sprint_id in sprint_ids]}
+
+
+def fields():
+    """
+        Description: Field list of /rest/api/2/field (jira 3.x search_issues translates the requested field names with it): the fields of the recorded issues
+    """
+
+    names = sorted({name for issue_dict in recorded_issues for name in issue_dict.get("fields", {})})
+    return [{"id": name, "key": name, "name": "Sprint" if name == SPRINT_FIELD else name, "custom": name.startswith("customfield_"), "orderable": True,
+             "navigable": True, "searchable": True, "clauseNames": [name]} for name in names]
+
+
+ROUTES = [
+    (re.compile(r"^/rest/api/2/serverInfo$"), "server_info", lambda match, params: {"baseUrl": "http://localhost", "version": "8.20.0", "versionNumbers": [8, 20, 0], "deploymentType": "Server"}),
+    (re.compile(r"^/rest/api/2/field$"), "field", lambda match, params: fields()),
+    (re.compile(r"^/rest/api/2/project/([^/]+)/versions$"), "project_versions", lambda match, params: project_versions(match.group(1))),
+    (re.compile(r"^/rest/api/2/project/([^/]+)$"), "project", lambda match, params: {"id": str(project_number(match.group(1))), "key": match.group(1), "name": match.group(1)}),
+    (re.compile(r"^/rest/api/2/search$"), "search", lambda match, params: search(params)),
+    (re.compile(r"^/rest/api/2/issue/([^/]+)/changelog$"), "issue_changelog", lambda match, params: issue_changelog(match.group(1), params)),
+    (re.compile(r"^/rest/greenhopper/1.0/sprint/(\d+)/edit/model$"), "sprint_info", lambda match, params: sprint(match.group(1))),
+    (re.compile(r"^/rest/agile/1.0/sprint/(\d+)$"), "sprint_info", lambda match, params: agile_sprint(match.group(1))),
+    (re.compile(r"^/rest/agile/1.0/board/(\d+)/sprint$"), "board_sprints", lambda match, params: board_sprints()),
+    (re.compile(r"^/stub/stats$"), "stats", lambda match, params: {"requests": request_counts, "bytes": response_bytes}),
+]
+
+
+class StubJiraHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.answer(url.path, {key: values[0] for key, values in parse_qs(url.query).items()})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.answer(urlparse(self.path).path, body)
+
+    def answer(self, path, params):
+        for pattern, name, handler in ROUTES:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            with stats_lock:
+                request_counts[name] = request_counts.get(name, 0) + 1
+                request_number = sum(request_counts.values())
+            if name != "stats" and settings["throttle_every"] > 0 and request_number % settings["throttle_every"] == 0:
+                self.send_json(429, {"errorMessages": ["Rate limit exceeded"]}, {"Retry-After": str(settings["retry_after"])})
+                return
+            if name != "stats" and settings["latency_ms"] > 0:
+                time.sleep(settings["latency_ms"] / 1000.0)
+            value = handler(match, params)
+            if name in ETAG_ROUTES:
+                etag = '"' + hashlib.sha1(json.dumps(value).encode("utf-8")).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                size = self.send_json(200, value, {"ETag": etag})
+            else:
+                size = self.send_json(200, value)
+            with stats_lock:
+                response_bytes[name] = response_bytes.get(name, 0) + size
+            return
+        self.send_json(404, {"errorMessages": ["Unknown path: " + path]})
+
+    def send_json(self, status, value, headers={}):
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        for key, header_value in headers.items():
+            self.send_header(key, header_value)
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port, _settings, fixtures_dir=FIXTURES_DIR):
+    """
+        Description: Start the stub server on a background thread and return it (server.shutdown() stops it)
+    """
+
+    settings.update(_settings)
+    load_fixtures(fixtures_dir)
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubJiraHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub JIRA server replaying recorded responses")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--issues-per-version", type=int, default=settings["issues_per_version"])
+    parser.add_argument("--versions", type=int, default=settings["versions"], help="synthetic versions per project, 0 serves the recorded versions")
+    parser.add_argument("--sprints", type=int, default=settings["sprints"], help="synthetic sprints per version, 0 keeps the recorded sprints of the issues")
+    parser.add_argument("--latency-ms", type=int, default=settings["latency_ms"])
+    parser.add_argument("--throttle-every", type=int, default=settings["throttle_every"], help="answer every N-th request with 429, 0 disables it")
+    parser.add_argument("--retry-after", type=int, default=settings["retry_after"])
+    args = parser.parse_args()
+
+    server = start_server(args.port, {"issues_per_version": args.issues_per_version, "versions": args.versions, "sprints": args.sprints, "latency_ms": args.latency_ms,
+                                      "throttle_every": args.throttle_every, "retry_after": args.retry_after})
+    print("Stub JIRA server listening on http://127.0.0.1:{0}".format(args.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
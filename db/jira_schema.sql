@@ -64,6 +64,9 @@ create table if not exists issue (
     type_id INTEGER,
     project_id INTEGER,
     raw_value TEXT,
+    raw_hash TEXT,
+    content_hash TEXT,
+    changelog_updated TEXT,
     FOREIGN KEY (resolution_id) REFERENCES resolution(id),
     FOREIGN KEY (status_id) REFERENCES status(id),
     FOREIGN KEY (type_id) REFERENCES type(id),
@@ -89,4 +92,111 @@ create table if not exists issue_affects_version (
     version_id INTEGER NOT NULL,
     FOREIGN KEY (issue_id) REFERENCES issue(id),
     FOREIGN KEY (version_id) REFERENCES version(id)
-);
\ No newline at end of file
+);
+
+create unique index if not exists ux_issue_key on issue(key);
+create unique index if not exists ux_sprint_sprint_id on sprint(sprint_id);
+create unique index if not exists ux_version_version_id on version(version_id);
+create unique index if not exists ux_issue_sprints on issue_sprints(issue_id, sprint_id);
+create unique index if not exists ux_issue_fix_version on issue_fix_version(issue_id, version_id);
+create unique index if not exists ux_issue_affects_version on issue_affects_version(issue_id, version_id);
+create unique index if not exists ux_project_project_id on project(project_id);
+create unique index if not exists ux_type_name on type(name);
+create unique index if not exists ux_status_name on status(name);
+create unique index if not exists ux_resolution_name on resolution(name);
+create index if not exists ix_version_name on version(name);
+create index if not exists ix_issue_sprints_sprint on issue_sprints(sprint_id, issue_id);
+create index if not exists ix_issue_fix_version_version on issue_fix_version(version_id, issue_id);
+create index if not exists ix_issue_affects_version_version on issue_affects_version(version_id, issue_id);
+create index if not exists ix_issue_project_type on issue(project_id, type_id, resolution_id, status_id, creation_date, resolution_date);
+create index if not exists ix_issue_project_resolution_date on issue(project_id, resolution_date, type_id, status_id);
+
+create table if not exists sync_watermark (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    updated_date TEXT NOT NULL,
+    PRIMARY KEY (project, version)
+);
+
+create table if not exists issue_raw (
+    issue_id INTEGER PRIMARY KEY,
+    raw_hash TEXT NOT NULL,
+    raw_value BLOB,
+    FOREIGN KEY (issue_id) REFERENCES issue(id)
+);
+
+create table if not exists kpi_cache (
+    project TEXT NOT NULL,
+    kpi TEXT NOT NULL,
+    state_hash TEXT NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (project, kpi)
+);
+
+create table if not exists daily_snapshot (
+    project_id INTEGER NOT NULL,
+    version_id INTEGER NOT NULL,
+    type_id INTEGER NOT NULL,
+    status_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    created INTEGER NOT NULL,
+    resolved INTEGER NOT NULL,
+    PRIMARY KEY (project_id, version_id, type_id, status_id, day)
+);
+
+create table if not exists issue_transition (
+    issue_id INTEGER NOT NULL,
+    from_status_id INTEGER,
+    to_status_id INTEGER NOT NULL,
+    transition_date TEXT NOT NULL,
+    FOREIGN KEY (issue_id) REFERENCES issue(id),
+    FOREIGN KEY (from_status_id) REFERENCES status(id),
+    FOREIGN KEY (to_status_id) REFERENCES status(id)
+);
+create index if not exists ix_issue_transition_issue on issue_transition(issue_id, transition_date);
+
+create table if not exists version_catalogue (
+    project_code TEXT PRIMARY KEY,
+    etag TEXT,
+    fetched_at TEXT NOT NULL,
+    versions TEXT NOT NULL
+);
+
+create table if not exists shard (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project TEXT NOT NULL,
+    file TEXT NOT NULL
+);
+create unique index if not exists ux_shard_project on shard(project);
+
+create table if not exists export_state (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    state_hash TEXT NOT NULL,
+    issues INTEGER NOT NULL,
+    exported_at TEXT NOT NULL,
+    PRIMARY KEY (project, version)
+);
+
+create table if not exists extraction_run (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    status TEXT NOT NULL
+);
+
+create table if not exists run_task (
+    run_id INTEGER NOT NULL,
+    task_key TEXT NOT NULL,
+    task TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_start_at INTEGER NOT NULL,
+    max_updated TEXT,
+    error TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (run_id, task_key)
+);
+
+-- the schema above includes all migrations of db/migrations up to this number
+pragma user_version = 14;
@@ -0,0 +1,38 @@
+-- Unique constraints used by the bulk upsert (INSERT ... ON CONFLICT) path.
+-- Older databases may hold duplicated rows (created by concurrent writers), they are merged into the row with the lowest id first.
+begin transaction;
+
+-- issue.key
+update issue_sprints set issue_id = (select min(i2.id) from issue i1 join issue i2 on i1.key = i2.key where i1.id = issue_sprints.issue_id)
+    where issue_id in (select id from issue);
+update issue_fix_version set issue_id = (select min(i2.id) from issue i1 join issue i2 on i1.key = i2.key where i1.id = issue_fix_version.issue_id)
+    where issue_id in (select id from issue);
+update issue_affects_version set issue_id = (select min(i2.id) from issue i1 join issue i2 on i1.key = i2.key where i1.id = issue_affects_version.issue_id)
+    where issue_id in (select id from issue);
+delete from issue where id not in (select min(id) from issue group by key);
+
+-- sprint.sprint_id
+update issue_sprints set sprint_id = (select min(s2.id) from sprint s1 join sprint s2 on s1.sprint_id = s2.sprint_id where s1.id = issue_sprints.sprint_id)
+    where sprint_id in (select id from sprint);
+delete from sprint where id not in (select min(id) from sprint group by sprint_id);
+
+-- version.version_id
+update issue_fix_version set version_id = (select min(v2.id) from version v1 join version v2 on v1.version_id = v2.version_id where v1.id = issue_fix_version.version_id)
+    where version_id in (select id from version);
+update issue_affects_version set version_id = (select min(v2.id) from version v1 join version v2 on v1.version_id = v2.version_id where v1.id = issue_affects_version.version_id)
+    where version_id in (select id from version);
+delete from version where id not in (select min(id) from version group by version_id);
+
+-- relation tables
+delete from issue_sprints where rowid not in (select min(rowid) from issue_sprints group by issue_id, sprint_id);
+delete from issue_fix_version where rowid not in (select min(rowid) from issue_fix_version group by issue_id, version_id);
+delete from issue_affects_version where rowid not in (select min(rowid) from issue_affects_version group by issue_id, version_id);
+
+create unique index if not exists ux_issue_key on issue(key);
+create unique index if not exists ux_sprint_sprint_id on sprint(sprint_id);
+create unique index if not exists ux_version_version_id on version(version_id);
+create unique index if not exists ux_issue_sprints on issue_sprints(issue_id, sprint_id);
+create unique index if not exists ux_issue_fix_version on issue_fix_version(issue_id, version_id);
+create unique index if not exists ux_issue_affects_version on issue_affects_version(issue_id, version_id);
+
+commit;
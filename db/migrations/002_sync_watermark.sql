@@ -0,0 +1,7 @@
+-- Incremental sync: latest issue updated date stored per manifest project and version
+create table if not exists sync_watermark (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    updated_date TEXT NOT NULL,
+    PRIMARY KEY (project, version)
+);
@@ -0,0 +1,9 @@
+-- Raw issue payloads: hash of the stored payload, and the issue_raw side table (see RAW_STORAGE in src/multi_thread.py)
+alter table issue add column raw_hash TEXT;
+
+create table if not exists issue_raw (
+    issue_id INTEGER PRIMARY KEY,
+    raw_hash TEXT NOT NULL,
+    raw_value BLOB,
+    FOREIGN KEY (issue_id) REFERENCES issue(id)
+);
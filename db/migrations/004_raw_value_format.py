@@ -0,0 +1,47 @@
+"""
+    Description: Re-encode the raw payloads stored by the previous versions (python repr of the issue in issue.raw_value) with the raw storage
+    settings of the run (RAW_STORAGE, RAW_STORAGE_TABLE and RAW_STORAGE_KEYS of src/multi_thread.py). Issues are converted in batches and every
+    batch is committed, an interrupted migration starts again with the issues not converted yet
+    The file does not shrink by itself: run "sqlite3 jira.db VACUUM" afterwards to give the freed pages back
+"""
+
+from src import multi_thread as mt
+
+BATCH_SIZE = 1000
+
+
+def migrate(connection):
+    last_id = 0
+    converted = 0
+    failed = 0
+    while True:
+        rows = connection.execute("Select id, raw_value from issue where id > ? and raw_value is not null and raw_hash is null order by id limit ?",
+                                  (last_id, BATCH_SIZE)).fetchall()
+        if len(rows) == 0:
+            break
+
+        issue_rows = []
+        raw_rows = []
+        for id, raw_value in rows:
+            last_id = id
+            try:
+                issue_dict = mt.decode_raw_payload(raw_value)
+            except (ValueError, SyntaxError) as er:
+                failed += 1
+                mt.log.warning("Unable to convert the raw value of issue id: {0}, error received: {1}".format(id, er))
+                continue
+            value, raw_hash = mt.encode_raw_payload(issue_dict)
+            if (mt.RAW_STORAGE_TABLE == "issue"):
+                issue_rows.append((value, raw_hash, id))
+            else:
+                issue_rows.append((None, None, id))
+                if (mt.RAW_STORAGE != "off"):
+                    raw_rows.append((id, raw_hash, value))
+
+        connection.executemany("UPDATE issue set raw_value=?, raw_hash=? WHERE id=?", issue_rows)
+        connection.executemany("INSERT INTO issue_raw(issue_id, raw_hash, raw_value) values(?,?,?) "
+                               "ON CONFLICT(issue_id) DO UPDATE SET raw_hash=excluded.raw_hash, raw_value=excluded.raw_value", raw_rows)
+        connection.commit()
+        converted += len(issue_rows)
+
+    mt.log.info("Converted the raw value of {0} issues to the {1} format ({2} failed)".format(converted, mt.RAW_STORAGE, failed))
@@ -0,0 +1,2 @@
+-- Hash of the mapped fields and link sets of an issue, unchanged issues are not written again
+alter table issue add column content_hash TEXT;
@@ -0,0 +1,33 @@
+-- Lookup indexes of the ingestion path and covering indexes of the KPI queries (by project, version, sprint, status, type and resolution date).
+-- Older databases may hold duplicated dimension rows (created by concurrent writers), they are merged into the row with the lowest id first.
+begin transaction;
+
+update issue set project_id = (select min(p2.id) from project p1 join project p2 on p1.project_id = p2.project_id where p1.id = issue.project_id)
+    where project_id in (select id from project);
+delete from project where id not in (select min(id) from project group by project_id);
+update issue set type_id = (select min(t2.id) from type t1 join type t2 on t1.name = t2.name where t1.id = issue.type_id)
+    where type_id in (select id from type);
+delete from type where id not in (select min(id) from type group by name);
+update issue set status_id = (select min(s2.id) from status s1 join status s2 on s1.name = s2.name where s1.id = issue.status_id)
+    where status_id in (select id from status);
+delete from status where id not in (select min(id) from status group by name);
+update issue set resolution_id = (select min(r2.id) from resolution r1 join resolution r2 on r1.name = r2.name where r1.id = issue.resolution_id)
+    where resolution_id in (select id from resolution);
+delete from resolution where id not in (select min(id) from resolution group by name);
+
+create unique index if not exists ux_project_project_id on project(project_id);
+create unique index if not exists ux_type_name on type(name);
+create unique index if not exists ux_status_name on status(name);
+create unique index if not exists ux_resolution_name on resolution(name);
+create index if not exists ix_version_name on version(name);
+
+-- issues of a sprint or of a version without reading the link tables in full
+create index if not exists ix_issue_sprints_sprint on issue_sprints(sprint_id, issue_id);
+create index if not exists ix_issue_fix_version_version on issue_fix_version(version_id, issue_id);
+create index if not exists ix_issue_affects_version_version on issue_affects_version(version_id, issue_id);
+
+-- KPI queries filtered by project and type (open/closed, defect trend, bug age) and by project and resolution date (resolved per period)
+create index if not exists ix_issue_project_type on issue(project_id, type_id, resolution_id, status_id, creation_date, resolution_date);
+create index if not exists ix_issue_project_resolution_date on issue(project_id, resolution_date, type_id, status_id);
+
+commit;
@@ -0,0 +1,8 @@
+-- KPI results of src/charts.py, with the hash of the data state they were computed from
+create table if not exists kpi_cache (
+    project TEXT NOT NULL,
+    kpi TEXT NOT NULL,
+    state_hash TEXT NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (project, kpi)
+);
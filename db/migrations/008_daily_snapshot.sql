@@ -0,0 +1,11 @@
+-- Issues created and resolved per project, fix version (0: all versions), type, current status and day, maintained by the writer process
+create table if not exists daily_snapshot (
+    project_id INTEGER NOT NULL,
+    version_id INTEGER NOT NULL,
+    type_id INTEGER NOT NULL,
+    status_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    created INTEGER NOT NULL,
+    resolved INTEGER NOT NULL,
+    PRIMARY KEY (project_id, version_id, type_id, status_id, day)
+);
@@ -0,0 +1,9 @@
+"""
+    Description: Fill the daily_snapshot table created by 008_daily_snapshot.sql from the issues already stored
+"""
+
+from src import multi_thread as mt
+
+
+def migrate(connection):
+    mt.rebuild_daily_snapshot(connection)
@@ -0,0 +1,12 @@
+-- Status transitions of the issues from their jira changelog (extraction "changelog": true), changelog_updated is the issue updated date of the stored changelog
+alter table issue add column changelog_updated TEXT;
+create table if not exists issue_transition (
+    issue_id INTEGER NOT NULL,
+    from_status_id INTEGER,
+    to_status_id INTEGER NOT NULL,
+    transition_date TEXT NOT NULL,
+    FOREIGN KEY (issue_id) REFERENCES issue(id),
+    FOREIGN KEY (from_status_id) REFERENCES status(id),
+    FOREIGN KEY (to_status_id) REFERENCES status(id)
+);
+create index if not exists ix_issue_transition_issue on issue_transition(issue_id, transition_date);
@@ -0,0 +1,7 @@
+-- Version list of each project as last received from jira, with its ETag, reused by the version discovery while it is younger than the cache TTL
+create table if not exists version_catalogue (
+    project_code TEXT PRIMARY KEY,
+    etag TEXT,
+    fetched_at TEXT NOT NULL,
+    versions TEXT NOT NULL
+);
@@ -0,0 +1,8 @@
+-- Sharded storage (manifest extraction "storage": "sharded"): shard database of each manifest project, registered in the main database
+-- file is relative to the directory of the main database, the issue ids of a shard start at id * shards.SHARD_ID_SPAN
+create table if not exists shard (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project TEXT NOT NULL,
+    file TEXT NOT NULL
+);
+create unique index if not exists ux_shard_project on shard(project);
@@ -0,0 +1,9 @@
+-- Columnar export (src/export.py): state hash of every exported project/version partition, a partition is only written again when its state changed
+create table if not exists export_state (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    state_hash TEXT NOT NULL,
+    issues INTEGER NOT NULL,
+    exported_at TEXT NOT NULL,
+    PRIMARY KEY (project, version)
+);
@@ -0,0 +1,22 @@
+-- Resumable extraction (main.py --resume): every run and the state of its version tasks
+-- status of a run: running, completed or incomplete (tasks not done, continued by the next --resume)
+create table if not exists extraction_run (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    status TEXT NOT NULL
+);
+-- written by the writer with the issues of every page: status pending, in_progress, done or failed, next_start_at is the first issue of the task
+-- not committed yet and max_updated the latest updated date committed by the task
+create table if not exists run_task (
+    run_id INTEGER NOT NULL,
+    task_key TEXT NOT NULL,
+    task TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_start_at INTEGER NOT NULL,
+    max_updated TEXT,
+    error TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (run_id, task_key)
+);
@@ -1,9 +1,38 @@
 from src import multi_thread as mt
+import argparse
 import logging
 import os
+import sys
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract JIRA data into the sqlite db")
+    parser.add_argument("--full-resync", action="store_true", help="extract all issues instead of the ones updated since the last run")
+    parser.add_argument("--engine", choices=["process", "async"], help="extraction engine, overrides manifest.json")
+    parser.add_argument("--workers", type=int, help="number of worker processes (async engine: see async_engine.concurrency), with --auto-tune the maximum")
+    parser.add_argument("--page-size", type=int, help="issues requested per search request")
+    parser.add_argument("--batch-size", type=int, help="issues committed per writer transaction")
+    parser.add_argument("--batch-timeout-ms", type=int, help="maximum time between two writer commits")
+    parser.add_argument("--chunk-size", type=int, help="versions with more issues are split in page range tasks")
+    parser.add_argument("--auto-tune", action="store_true", default=None, help="ramp up the concurrency while jira answers fast, back off when it throttles")
+    parser.add_argument("--raw-storage", choices=["compressed", "json", "repr", "off"], help="format of the stored raw issue payloads")
+    parser.add_argument("--changelog", action="store_true", default=None, help="store the status transitions of the issues updated since their changelog was stored")
+    parser.add_argument("--profile-worker", choices=["cprofile", "pyinstrument"], help="profile the first worker process (async engine: the extraction), written to logs/profile_*")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="level of logs/log_data.log, DEBUG adds sampled and truncated issue payloads")
+    parser.add_argument("--storage", choices=["single", "sharded"], help="one database, or one database per manifest project (see src/shards.py)")
+    parser.add_argument("--export", action="store_true", default=None, help="write the Parquet export of the issues after the extraction (see src/export.py)")
+    parser.add_argument("--resume", action="store_true", help="continue the last extraction run that did not complete, from the checkpoints of its tasks")
+    parser.add_argument("--rebuild-snapshot", action="store_true", help="build the daily_snapshot table again from the stored issues before the extraction")
+    args = parser.parse_args()
+
+    settings = {"engine": args.engine, "workers": args.workers, "page_size": args.page_size, "writer_batch_size": args.batch_size,
+                "writer_batch_timeout_ms": args.batch_timeout_ms, "task_chunk_size": args.chunk_size, "auto_tune": args.auto_tune,
+                "raw_storage": args.raw_storage, "changelog": args.changelog, "profile_worker": args.profile_worker, "log_level": args.log_level,
+                "storage": args.storage, "export": args.export}
+
     print("### START ###")
-    mt.populate_db()
-    print("###  DONE  ###")
\ No newline at end of file
+    completed = mt.populate_db(full_resync=args.full_resync, settings=settings, rebuild_snapshot=args.rebuild_snapshot, resume=args.resume)
+    print("###  DONE  ###")
+    # failed or unfinished tasks, continued by python3 main.py --resume
+    if not completed:
+        sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,451 @@
+"""
+    Description: asyncio extraction engine, alternative to the worker processes of multi_thread.py (manifest.json "engine": "async")
+    A single process keeps up to "concurrency" search and sprint requests in flight over one pooled http session (with auto tune the
+    number of requests in flight starts low and follows multi_thread.next_concurrency_level). It honours the
+    Retry-After header of 429/503 responses and a global requests per second limit. Extracted issues go to the same writer process
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src import instrumentation
+from src import multi_thread as mt
+
+log = logging.getLogger(__name__)
+
+SEARCH_PATH = "/rest/api/2/search"
+CHANGELOG_PATH = "/rest/api/2/" + mt.CHANGELOG_PATH
+# agile API, the endpoint of jira_connector.sprint_info (jira 3.x) used by the process engine, both are mapped by mt.compact_sprint
+SPRINT_PATH = "/rest/agile/1.0/sprint/{0}"
+DEFAULT_SETTINGS = {"concurrency": 32, "requests_per_second": 20, "max_retries": 5, "timeout_seconds": 60}
+MAX_BACKOFF_SECONDS = 60
+
+# engine state, created by run_async_extraction
+settings = {}
+session = None
+http_executor = None
+put_executor = None
+slot_condition = None
+in_flight = 0
+concurrency_limit = 0
+rate_lock = None
+next_request_time = 0.0
+throttled_until = 0.0
+sprint_cache = {}
+sprint_requests = {}
+request_stats = {"requests": 0, "throttled": 0, "retries": 0, "sprint_hits": 0, "sprint_requests": 0}
+# requests, errors and latency seconds since the last auto tune interval
+tune_window = {"requests": 0, "errors": 0, "latency": 0.0}
+
+
+def run_async_extraction(version_tasks, _write_queue, _sprint_cache, _settings):
+    """
+        Description: Extract all issues of the version tasks (as built by multithread_collect_data) and push them to the write queue
+        version_tasks is any iterable, a generator (the version discovery) is consumed on a thread and each version starts as soon as it is yielded
+        _sprint_cache is the {jira sprint id: sprint data} dictionary prepared by the main process, _settings the manifest "async_engine" block
+    """
+
+    global settings
+    global session
+    global http_executor
+    global put_executor
+    global sprint_cache
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(_settings)
+    sprint_cache = _sprint_cache
+
+    session = requests.Session()
+    session.auth = (mt.JIRA_USER, mt.JIRA_PASSWORD)
+    session.headers.update({"Accept": "application/json"})
+    # retries are handled by request_json, the adapter only keeps the connections alive
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings["concurrency"], max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # requests is blocking: the http calls run on a thread pool sized like the connection pool, the writer queue gets its own thread
+    http_executor = ThreadPoolExecutor(max_workers=settings["concurrency"])
+    put_executor = ThreadPoolExecutor(max_workers=1)
+
+    log.info("Async extraction with settings: {0}".format(settings))
+    try:
+        asyncio.run(extract_all(version_tasks, _write_queue))
+    finally:
+        http_executor.shutdown()
+        put_executor.shutdown()
+        session.close()
+    log.info("Async extraction finished, request stats: {0}".format(request_stats))
+    print("Async extraction finished, request stats: {0}".format(request_stats))
+
+
+async def extract_all(version_tasks, _write_queue):
+    """
+        Description: Extract all versions concurrently, a failed version is logged and does not stop the others
+    """
+
+    global slot_condition
+    global concurrency_limit
+    global rate_lock
+
+    slot_condition = asyncio.Condition()
+    rate_lock = asyncio.Lock()
+    concurrency_limit = settings["concurrency"]
+    if (mt.AUTO_TUNE):
+        concurrency_limit = min(mt.AUTO_TUNE_START_WORKERS, settings["concurrency"])
+        tuner = asyncio.ensure_future(auto_tune())
+
+    # the next task may need jira requests (version discovery), it is taken on the default executor while the started versions go on
+    started_tasks = []
+    extractions = []
+    iterator = iter(version_tasks)
+    loop = asyncio.get_running_loop()
+    while True:
+        data = await loop.run_in_executor(None, next, iterator, None)
+        if data is None:
+            break
+        started_tasks.append(data)
+        extractions.append(asyncio.ensure_future(extract_task(data, _write_queue)))
+    log.info("Async extraction of {0} versions".format(len(started_tasks)))
+
+    results = await asyncio.gather(*extractions, return_exceptions=True)
+    if (mt.AUTO_TUNE):
+        tuner.cancel()
+    for data, result in zip(started_tasks, results):
+        if isinstance(result, Exception):
+            log.error("Unable to extract version: {0} of project: {1}, error received: {2}".format(data["version_name"], data["manifest_project_name"], result))
+
+
+async def extract_task(data, _write_queue):
+    """
+        Description: Extract a version task with the retry policy of mt.extract_task: a failed attempt is retried after mt.task_retry_delay(attempt) seconds
+        from the first issue not extracted yet, after mt.TASK_MAX_ATTEMPTS the task is recorded as failed and left to main.py --resume. Returns True when the task is done
+    """
+
+    _write_queue = mt.task_write_queue(data, _write_queue)
+    error = None
+    for attempt in range(1, mt.TASK_MAX_ATTEMPTS + 1):
+        if (attempt > 1):
+            instrumentation.count("task.retries")
+            await asyncio.sleep(mt.task_retry_delay(attempt))
+        await put_record(_write_queue, mt.checkpoint_record(data, "in_progress", 1))
+        try:
+            await extract_version(data, _write_queue)
+            return True
+        except Exception as e:
+            error = e
+            log.error("Attempt {0} of {1} failed for version: {2} of project: {3} at issue {4}, error received: {5}".format(
+                attempt, mt.TASK_MAX_ATTEMPTS, data["version_name"], data["manifest_project_name"], data.get("start_at", 0), e))
+    instrumentation.count("task.failed")
+    await put_record(_write_queue, mt.checkpoint_record(data, "failed", error=str(error)))
+    return False
+
+
+async def extract_version(data, _write_queue):
+    """
+        Description: Extract the pages of a version task from data["start_at"], the first page gives the total and the remaining pages are requested concurrently
+        The version watermark is queued only after all pages were queued, _write_queue is the queue of the task (see mt.task_write_queue)
+        The pages complete in any order: after each page its records are followed by a task checkpoint at the first issue of the pages not stored yet
+    """
+
+    jql = mt.build_version_jql(data["project_code"], data["special_filters"], data["version_name"], data["watermark"]) + " ORDER BY key ASC"
+    log.debug("Async collect version issues for: %s", jql)
+    # a task of a resumed run may be a chunk of the version (see mt.split_version_tasks)
+    start_at = data.setdefault("start_at", 0)
+    end_at = data.get("end_at")
+    # a task continued from a checkpoint keeps the latest updated date of its committed pages
+    max_updated = data.get("max_updated")
+    # {page start: page end} of the stored pages after data["start_at"]
+    stored_pages = {}
+
+    async def page_stored(page_start, page_end, page_updated):
+        nonlocal max_updated
+        if (page_updated is not None and (max_updated is None or page_updated > max_updated)):
+            max_updated = page_updated
+        stored_pages[page_start] = page_end
+        while data["start_at"] in stored_pages:
+            data["start_at"] = stored_pages.pop(data["start_at"])
+        data["max_updated"] = max_updated
+        await put_record(_write_queue, mt.checkpoint_record(data, "in_progress"))
+
+    async def extract_page(page_start, page_end):
+        await page_stored(page_start, page_end, await fetch_and_store_page(jql, page_start, page_end - page_start, _write_queue))
+
+    first_page = await search_page(jql, start_at, mt.ISSUE_PAGE_SIZE if end_at is None else max(min(mt.ISSUE_PAGE_SIZE, end_at - start_at), 0))
+    # the server may return less than the requested page size
+    page_size = max(len(first_page["issues"]), 1)
+    last = first_page["total"] if end_at is None else min(end_at, first_page["total"])
+    await page_stored(start_at, max(min(start_at + page_size, last), start_at), await store_page(first_page["issues"], _write_queue))
+
+    pages = [asyncio.ensure_future(extract_page(page_start, min(page_start + page_size, last))) for page_start in range(start_at + page_size, last, page_size)]
+    try:
+        await asyncio.gather(*pages)
+    except Exception:
+        # the pages still in flight are stopped, the next attempt starts at data["start_at"]
+        for page in pages:
+            page.cancel()
+        await asyncio.gather(*pages, return_exceptions=True)
+        raise
+    log.info("version: {0} has {1} issues".format(data["version_name"], first_page["total"]))
+
+    data["start_at"] = max(last, data["start_at"])
+    await put_record(_write_queue, {"watermark": (data["manifest_project_name"], data["version_name"], max_updated), "chunk": data["chunk"]})
+    await put_record(_write_queue, mt.checkpoint_record(data, "done"))
+
+
+async def search_page(jql, start_at, page_size):
+    return await request_json(SEARCH_PATH, {"jql": jql, "startAt": start_at, "maxResults": page_size, "fields": mt.MAPPED_FIELDS})
+
+
+async def fetch_and_store_page(jql, start_at, page_size, _write_queue):
+    page = await search_page(jql, start_at, page_size)
+    return await store_page(page["issues"], _write_queue)
+
+
+async def store_page(issues, _write_queue):
+    """
+        Description: Map the issues of a page, collect their sprints (and changelogs) and push them to the write queue. Returns the latest updated date of the page
+    """
+
+    instrumentation.gauge("queue.write_depth", instrumentation.queue_size(_write_queue))
+    max_updated = None
+    for issue_dict in issues:
+        map_started = time.perf_counter()
+        populated_dict = mt.map_issue(issue_dict)
+        instrumentation.observe("map", time.perf_counter() - map_started)
+        instrumentation.count("map.issues")
+        if (mt.payload_sampled()):
+            log.debug("Raw issue value: %s, mapped values: %s", mt.LogPayload(issue_dict), mt.LogPayload(populated_dict))
+        sprints = await asyncio.gather(*[get_sprint(id) for id in mt.split_csv(populated_dict["sprints"])])
+
+        with instrumentation.timed("encode"):
+            record = mt.build_issue_record(populated_dict, issue_dict, [sprint_dict for sprint_dict in sprints if sprint_dict is not None])
+        await put_record(_write_queue, record)
+
+        updated = mt.issue_updated(issue_dict)
+        if (updated is not None and (max_updated is None or updated > max_updated)):
+            max_updated = updated
+    if (mt.CHANGELOG):
+        await collect_changelogs(issues, _write_queue)
+    return max_updated
+
+
+async def collect_changelogs(issues, _write_queue):
+    """
+        Description: Same as multi_thread.collect_changelogs: one search with expand=changelog for the page issues updated since their changelog was stored,
+        truncated changelogs are paged with the issue changelog endpoint
+    """
+
+    keys = mt.changelog_needed(issues)
+    if len(keys) == 0:
+        return
+    try:
+        result = await request_json(SEARCH_PATH, {"jql": mt.changelog_jql(keys), "maxResults": len(keys), "fields": "updated", "expand": "changelog"})
+    except Exception as e:
+        log.error("unable to collect the changelog of issues: {0}, error received: {1}".format(keys, e))
+        return
+
+    for issue_dict in result["issues"]:
+        transitions = mt.embedded_transitions(issue_dict)
+        try:
+            if transitions is None:
+                transitions = await page_changelog(issue_dict["key"])
+        except Exception as e:
+            log.error("unable to page the changelog of issue: {0}, error received: {1}".format(issue_dict["key"], e))
+            continue
+        await put_record(_write_queue, {"transitions": (issue_dict["key"], mt.issue_updated(issue_dict), transitions)})
+        mt.CHANGELOG_STATE[issue_dict["key"]] = mt.issue_updated(issue_dict)
+
+
+async def page_changelog(key):
+    transitions = []
+    start_at = 0
+    while True:
+        page = await request_json(CHANGELOG_PATH.format(key), {"startAt": start_at, "maxResults": mt.CHANGELOG_PAGE_SIZE})
+        values = page.get("values", [])
+        transitions += mt.parse_transitions(values)
+        start_at += len(values)
+        if len(values) == 0 or page.get("isLast", True) or start_at >= page.get("total", 0):
+            return transitions
+
+
+async def put_record(_write_queue, record):
+    # the write queue is bounded, a blocking put must not stop the event loop
+    with instrumentation.timed("queue.put_wait"):
+        await asyncio.get_running_loop().run_in_executor(put_executor, _write_queue.put, record)
+
+
+async def get_sprint(id):
+    """
+        Description: Return the sprint data from the sprint cache, only one request per sprint is sent even if many issues ask for it at the same time
+        None when the sprint lookup failed, it is not requested again during the run
+    """
+
+    if id in sprint_cache:
+        request_stats["sprint_hits"] += 1
+        return None if sprint_cache[id] == mt.SPRINT_LOOKUP_FAILED else sprint_cache[id]
+    if id not in sprint_requests:
+        request_stats["sprint_requests"] += 1
+        sprint_requests[id] = asyncio.ensure_future(fetch_sprint(id))
+    return await sprint_requests[id]
+
+
+async def fetch_sprint(id):
+    try:
+        sprint_dict = mt.compact_sprint(await request_json(SPRINT_PATH.format(id), None))
+        log.debug("Following sprint data was identified %s for sprint id: %s", mt.LogPayload(sprint_dict), id)
+        sprint_cache[id] = sprint_dict
+        return sprint_dict
+    except Exception as e:
+        log.error("Exception unable to extract sprint data for sprint id: {0} error received: {1}".format(id, e))
+        sprint_cache[id] = mt.SPRINT_LOOKUP_FAILED
+        return None
+    finally:
+        del sprint_requests[id]
+
+
+async def request_json(path, params):
+    """
+        Description: GET a jira REST path and return the JSON response
+        429/503 responses pause all requests for the Retry-After delay, connection errors and other 5xx responses are retried with exponential backoff
+    """
+
+    url = mt.JIRA_URL.rstrip("/") + path
+    loop = asyncio.get_running_loop()
+    last_error = None
+
+    for attempt in range(settings["max_retries"] + 1):
+        response = None
+        await acquire_slot()
+        try:
+            await wait_for_rate_limit()
+            request_stats["requests"] += 1
+            request_started = time.monotonic()
+            try:
+                response = await loop.run_in_executor(http_executor, partial(session.get, url, params=params, timeout=settings["timeout_seconds"]))
+            except requests.RequestException as er:
+                last_error = er
+            tune_window["requests"] += 1
+            tune_window["latency"] += time.monotonic() - request_started
+            failed = response is None or response.status_code in (429, 503) or response.status_code >= 500
+            if (failed):
+                tune_window["errors"] += 1
+            instrumentation.record_http(instrumentation.endpoint_name(url), time.monotonic() - request_started, failed or response.status_code >= 400,
+                                        None if response is None else len(response.content))
+        finally:
+            await release_slot()
+
+        if response is None:
+            delay = backoff_delay(attempt)
+            log.warning("Request to {0} failed: {1}, retry in {2}s".format(path, last_error, delay))
+        elif response.status_code in (429, 503):
+            delay = retry_after_delay(response, attempt)
+            throttle(delay)
+            request_stats["throttled"] += 1
+            log.warning("Request to {0} throttled with status {1}, all requests paused for {2}s".format(path, response.status_code, delay))
+        elif response.status_code >= 500:
+            delay = backoff_delay(attempt)
+            log.warning("Request to {0} failed with status {1}, retry in {2}s".format(path, response.status_code, delay))
+        else:
+            response.raise_for_status()
+            return response.json()
+
+        if response is not None:
+            last_error = requests.HTTPError("{0} {1}".format(response.status_code, response.reason), response=response)
+        if attempt < settings["max_retries"]:
+            request_stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    raise last_error
+
+
+async def acquire_slot():
+    # wait until less than concurrency_limit requests are in flight
+    global in_flight
+
+    async with slot_condition:
+        await slot_condition.wait_for(lambda: in_flight < concurrency_limit)
+        in_flight += 1
+
+
+async def release_slot():
+    global in_flight
+
+    async with slot_condition:
+        in_flight -= 1
+        slot_condition.notify_all()
+
+
+async def auto_tune():
+    """
+        Description: Every AUTO_TUNE_INTERVAL_SECONDS change the number of requests in flight (up to the concurrency setting) with multi_thread.next_concurrency_level
+    """
+
+    global concurrency_limit
+
+    best_latency = None
+    while True:
+        await asyncio.sleep(mt.AUTO_TUNE_INTERVAL_SECONDS)
+        requests_done, errors = tune_window["requests"], tune_window["errors"]
+        latency = tune_window["latency"] / requests_done if requests_done > 0 else 0
+        tune_window["requests"], tune_window["errors"], tune_window["latency"] = 0, 0, 0.0
+
+        level = mt.next_concurrency_level(concurrency_limit, settings["concurrency"], requests_done, errors, latency, best_latency)
+        if (requests_done > 0 and errors == 0 and (best_latency is None or latency < best_latency)):
+            best_latency = latency
+        async with slot_condition:
+            concurrency_limit = level
+            slot_condition.notify_all()
+        log.info("Auto tune: {0} requests, {1} errors, {2:.3f}s average latency (best {3}) -> {4} requests in flight".format(requests_done, errors, latency, best_latency, level))
+        print("Auto tune: {0} requests in flight ({1} requests, {2} errors, {3:.3f}s average latency)".format(level, requests_done, errors, latency))
+
+
+async def wait_for_rate_limit():
+    """
+        Description: Space the requests to stay below requests_per_second (0 disables the limit) and wait while the server is throttling
+    """
+
+    global next_request_time
+
+    async with rate_lock:
+        now = time.monotonic()
+        start = max(now, next_request_time, throttled_until)
+        if settings["requests_per_second"] > 0:
+            next_request_time = start + 1.0 / settings["requests_per_second"]
+        else:
+            next_request_time = start
+    if start > now:
+        await asyncio.sleep(start - now)
+
+
+def throttle(delay):
+    global throttled_until
+
+    throttled_until = max(throttled_until, time.monotonic() + delay)
+
+
+def backoff_delay(attempt):
+    return min(MAX_BACKOFF_SECONDS, 2 ** attempt)
+
+
+def retry_after_delay(response, attempt):
+    """
+        Description: Delay requested by the Retry-After header (seconds or HTTP date), exponential backoff if the header is missing
+    """
+
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is None:
+        return backoff_delay(attempt)
+    try:
+        return max(0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return backoff_delay(attempt)
@@ -0,0 +1,160 @@
+"""
+    Description: Render the KPI charts of every manifest project (one PNG per project and enabled KPI) with matplotlib Agg in a process pool
+    KPI results are cached in the kpi_cache table, keyed on the state of the data they depend on (issue count and latest updated date of the
+    project, sprint and version tables): only the KPIs whose state changed are computed again, and only their charts are rendered again
+    Run from the repository root: python3 -m src.charts [--output-dir charts] [--workers N] [--force]   (numpy and matplotlib are required)
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from src import kpi
+from src import shards
+
+log = logging.getLogger(__name__)
+
+CHARTS_DIR = "charts"
+# chart of each KPI: x axis key of the KPI result, plotted series keys, "bar" or "line"
+KPI_CHARTS = {"epic_changes": ("version", ["epics", "added_issues", "epics_with_added_issues"], "bar"),
+              "backlog_evolution": ("month", ["created", "resolved", "open"], "line"),
+              "agregated_velocity": ("sprint", ["committed", "completed"], "bar"),
+              "cycle_time": ("type", ["mean_days", "median_days", "p85_days"], "bar"),
+              "predictibility_score": ("sprint", ["score"], "line"),
+              "open_vs_closed": ("version", ["open", "closed"], "bar"),
+              "defect_trend": ("month", ["created", "resolved", "open"], "line"),
+              "average_bug_time": ("month", ["average_days"], "line"),
+              "reopened_bugs": ("version", ["reopened"], "bar"),
+              "bugs_found_per_release": ("version", ["issues"], "bar")}
+
+
+def data_state(connection, project_codes):
+    """
+        Description: Hash of the data a project KPI depends on: issue count, latest updated date, highest id and stored changelogs of the project issues,
+        the sprint and version tables, and the KPI settings
+    """
+
+    state = list(connection.execute("Select count(*), max(updated_date), max(id), count(changelog_updated), max(changelog_updated) from issue where project_id in "
+                                    "(Select id from project where project_id in (" + ",".join(["?"] * len(project_codes)) + "))", project_codes).fetchone())
+    state += list(connection.execute("Select count(*), max(start_date), max(complete_date), group_concat(state) from sprint").fetchone())
+    state += list(connection.execute("Select count(*), max(start_date), max(released_date), group_concat(released) from version").fetchone())
+    state += [project_codes, kpi.BUG_TYPES, kpi.REOPENED_STATUSES]
+    return hashlib.sha1(json.dumps(state).encode("utf-8")).hexdigest()
+
+
+def load_cache(connection):
+    # {(project, kpi): (state hash, result)}
+    return {(project, name): (state, json.loads(result)) for project, name, state, result in connection.execute("Select project, kpi, state_hash, result from kpi_cache")}
+
+
+def store_cache(connection, rows):
+    connection.executemany("INSERT INTO kpi_cache(project, kpi, state_hash, result) values(?,?,?,?) "
+                           "ON CONFLICT(project, kpi) DO UPDATE SET state_hash=excluded.state_hash, result=excluded.result", rows)
+    connection.commit()
+
+
+def chart_file(output_dir, project_name, kpi_name):
+    return os.path.join(output_dir, re.sub(r"[^\w.-]+", "_", project_name), kpi_name + ".png")
+
+
+def render_chart(path, title, kpi_name, result):
+    """
+        Description: Render one KPI chart to a PNG file, runs in the process pool (Agg backend, no display needed)
+    """
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    x_key, series, kind = KPI_CHARTS[kpi_name]
+    labels = [str(value) for value in result.get(x_key, [])]
+    figure, axes = plt.subplots(figsize=(max(6, len(labels) * 0.4), 4.5))
+    positions = range(len(labels))
+    width = 0.8 / len(series)
+    for index, name in enumerate(series):
+        values = [0 if value is None else value for value in result.get(name, [])]
+        if kind == "bar":
+            axes.bar([position + index * width - 0.4 + width / 2 for position in positions], values, width, label=name)
+        else:
+            axes.plot(list(positions), values, marker="o", label=name)
+    axes.set_xticks(list(positions))
+    axes.set_xticklabels(labels, rotation=45, ha="right", fontsize=8)
+    axes.set_title(title)
+    axes.legend()
+    figure.tight_layout()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    figure.savefig(path)
+    plt.close(figure)
+    return path
+
+
+def render_charts(connection, manifest, output_dir, workers=None, force=False):
+    """
+        Description: Bring the charts of all projects up to date: compute the KPIs whose data state changed (or whose cache entry or chart file is missing)
+        and render their charts in a process pool. Returns the list of rendered files
+    """
+
+    cache = {} if force else load_cache(connection)
+    stale = {}
+    jobs = []
+    for project_name, project in manifest["extract_for"].items():
+        project_codes = project["settings"]["project_code"]
+        state = data_state(connection, project_codes)
+        for kpi_name in kpi.enabled_kpis(project.get("kpis", {})):
+            path = chart_file(output_dir, project_name, kpi_name)
+            cached = cache.get((project_name, kpi_name))
+            if cached is None or cached[0] != state:
+                stale.setdefault(project_name, (project_codes, state, []))[2].append(kpi_name)
+            elif not os.path.exists(path):
+                jobs.append((path, project_name + " - " + kpi_name, kpi_name, cached[1]))
+
+    if len(stale) > 0:
+        # the tables are only loaded when at least one KPI has to be computed again
+        tables = kpi.load_tables(connection)
+        cache_rows = []
+        for project_name, (project_codes, state, kpi_names) in stale.items():
+            results = kpi.compute_project_kpis(tables, project_codes, kpi_names)
+            for kpi_name, result in results.items():
+                cache_rows.append((project_name, kpi_name, state, json.dumps(result)))
+                jobs.append((chart_file(output_dir, project_name, kpi_name), project_name + " - " + kpi_name, kpi_name, result))
+        store_cache(connection, cache_rows)
+        log.info("Computed {0} KPI results again".format(len(cache_rows)))
+
+    rendered = []
+    if len(jobs) > 0:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rendered = list(executor.map(render_chart, *zip(*jobs)))
+    log.info("Rendered {0} charts in {1}".format(len(rendered), output_dir))
+    return rendered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the KPI charts of the manifest projects")
+    parser.add_argument("--output-dir", default=CHARTS_DIR)
+    parser.add_argument("--workers", type=int, help="rendering processes, default one per cpu")
+    parser.add_argument("--force", action="store_true", help="compute all KPIs and render all charts again")
+    args = parser.parse_args()
+
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
+    logging.basicConfig(filename='logs/log_charts.log', level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    with open("manifest.json") as _file:
+        manifest = json.load(_file)
+    # with sharded storage the issue, sprint... tables are views over the attached shards
+    connection = shards.connect(manifest["database"], manifest.get("extraction", {}).get("storage") == "sharded")
+    start = time.monotonic()
+    try:
+        rendered = render_charts(connection, manifest, args.output_dir, args.workers, args.force)
+    finally:
+        connection.close()
+    print("{0} charts rendered in {1:.1f}s".format(len(rendered), time.monotonic() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+    Description: Columnar export of the issue dataset for downstream analytics: one denormalized, typed Parquet file per project and fix version
+    (hive partitioning EXPORT_DIR/project=<code>/version=<name>/issues.parquet), with parsed dates, numeric story points and list columns for
+    labels, components, sprints and versions. An issue is written once, in the partition of its first fix version ("empty" without fix version)
+    Every partition has a state hash (content hashes of its issues and the names of the joined tables) stored in the export_state table:
+    only the partitions whose state changed since the previous export, or whose file is missing, are written again
+    Read it with pyarrow.dataset.dataset(EXPORT_DIR, partitioning="hive")
+    Run from the repository root: python3 -m src.export [--output-dir export] [--force]   (pyarrow and numpy are required)
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src import kpi
+from src import shards
+
+log = logging.getLogger(__name__)
+
+EXPORT_DIR = "export"
+EXPORT_FILE = "issues.parquet"
+EXPORT_COMPRESSION = "zstd"
+# issues read per query when a partition is written
+EXPORT_CHUNK_SIZE = 500
+NO_VERSION = "empty"
+LIST_SEPARATOR = ","
+STRING_COLUMNS = ["key", "summary", "epic_name", "epic_link", "priority", "assignee", "reporter", "tshirt_size", "linked_theme", "status", "type", "resolution"]
+TIMESTAMP_COLUMNS = [("created", "creation_date"), ("updated", "updated_date"), ("resolved", "resolution_date")]
+DATE_COLUMNS = [("start_date", "start_date"), ("due_date", "due_date")]
+LIST_COLUMNS = ["labels", "components", "sprints", "fix_versions", "affects_versions"]
+SCHEMA = pa.schema([("id", pa.int64())] + [(name, pa.string()) for name in STRING_COLUMNS] +
+                   [(name, pa.timestamp("ms", tz="UTC")) for name, column in TIMESTAMP_COLUMNS] + [(name, pa.date32()) for name, column in DATE_COLUMNS] +
+                   [("story_points", pa.float64())] + [(name, pa.list_(pa.string())) for name in LIST_COLUMNS])
+# issue columns exported as strings, with the status, type and resolution names
+ISSUE_STRING_COLUMNS = ["i.key", "i.summary", "i.epic_name", "i.epic_link", "i.priority", "i.assignee", "i.reporter", "i.tshirt_size", "i.linked_theme",
+                        "s.name", "t.name", "r.name"]
+
+
+def epoch_ms(column):
+    # milliseconds since 1970 (UTC) of a jira timestamp ("2001-01-01T01:01:00.000+0200"), NULL when empty, the offset is optional
+    return ("cast(round((julianday(nullif(substr(" + column + ", 1, 23), '')) - " + str(kpi.UNIX_EPOCH_JULIANDAY) + ") * 86400000) as integer) - "
+            "(cast(substr(" + column + ", 25, 2) as integer) * 60 + cast(substr(" + column + ", 27, 2) as integer)) * "
+            "(case substr(" + column + ", 24, 1) when '-' then -60000 when '+' then 60000 else 0 end)")
+
+
+def issue_query(number_of_ids):
+    return ("Select i.id, " + ", ".join(ISSUE_STRING_COLUMNS) + ", " + ", ".join(epoch_ms("i." + column) for name, column in TIMESTAMP_COLUMNS) + ", "
+            + ", ".join(kpi.epoch_days("i." + column) for name, column in DATE_COLUMNS) + ", cast(nullif(i.story_points, '') as real), i.labels, i.components "
+            "from issue i left join status s on s.id = i.status_id left join type t on t.id = i.type_id left join resolution r on r.id = i.resolution_id "
+            "where i.id in (" + ",".join(["?"] * number_of_ids) + ")")
+
+
+def split_list(value):
+    if value == "" or value is None:
+        return []
+    return value.split(LIST_SEPARATOR)
+
+
+def partition_path(output_dir, project, version):
+    return os.path.join(output_dir, "project=" + quote(project, safe=""), "version=" + quote(version, safe=""), EXPORT_FILE)
+
+
+def load_partitions(connection):
+    """
+        Description: Return ({(project code, version name): [issue ids]}, {(project code, version name): state hash}, names)
+        names holds the {id: name} of the sprint and version tables, used for the list columns
+    """
+
+    names = {"sprint": dict(connection.execute("Select id, name from sprint")), "version": dict(connection.execute("Select id, name from version"))}
+    first_versions = dict(connection.execute("Select issue_id, min(version_id) from issue_fix_version group by issue_id"))
+    # renamed sprints, versions, statuses... change every partition, as does a change of the exported columns
+    common_state = json.dumps([sorted(names["sprint"].items()), sorted(names["version"].items())] +
+                              [sorted(connection.execute("Select id, name from " + table).fetchall()) for table in ("status", "type", "resolution")] +
+                              [SCHEMA.to_string()]).encode("utf-8")
+
+    partitions = {}
+    states = {}
+    for issue_id, project, content in connection.execute("Select i.id, ifnull(p.project_id, ''), ifnull(i.content_hash, i.updated_date) from issue i "
+                                                         "left join project p on p.id = i.project_id order by i.id"):
+        version_id = first_versions.get(issue_id)
+        partition = (project, names["version"].get(version_id, NO_VERSION) if version_id is not None else NO_VERSION)
+        if partition not in partitions:
+            partitions[partition] = []
+            states[partition] = hashlib.sha1(common_state)
+        partitions[partition].append(issue_id)
+        states[partition].update("{0}:{1};".format(issue_id, content).encode("utf-8"))
+    return partitions, {partition: state.hexdigest() for partition, state in states.items()}, names
+
+
+def load_links(connection, table, column, issue_ids, names):
+    # {issue id: [names of the linked sprints or versions]}
+    links = {}
+    query = "Select issue_id, " + column + " from " + table + " where issue_id in ({0}) order by " + column
+    for index in range(0, len(issue_ids), EXPORT_CHUNK_SIZE):
+        chunk = issue_ids[index:index + EXPORT_CHUNK_SIZE]
+        for issue_id, target_id in connection.execute(query.format(",".join(["?"] * len(chunk))), chunk):
+            links.setdefault(issue_id, []).append(names.get(target_id))
+    return links
+
+
+def partition_table(connection, issue_ids, names):
+    """
+        Description: Arrow table of the issues of a partition, one query per EXPORT_CHUNK_SIZE issues and per link table
+    """
+
+    rows = []
+    for index in range(0, len(issue_ids), EXPORT_CHUNK_SIZE):
+        chunk = issue_ids[index:index + EXPORT_CHUNK_SIZE]
+        rows += connection.execute(issue_query(len(chunk)), chunk).fetchall()
+    columns = list(zip(*rows)) if len(rows) > 0 else [[] for field in range(1 + len(STRING_COLUMNS) + len(TIMESTAMP_COLUMNS) + len(DATE_COLUMNS) + 3)]
+    ids = list(columns[0])
+    position = 1 + len(STRING_COLUMNS)
+
+    arrays = [pa.array(ids, pa.int64())] + [pa.array(values, pa.string()) for values in columns[1:position]]
+    arrays += [pa.array(values, pa.int64()).cast(pa.timestamp("ms", tz="UTC")) for values in columns[position:position + len(TIMESTAMP_COLUMNS)]]
+    position += len(TIMESTAMP_COLUMNS)
+    arrays += [pa.array(values, pa.int32()).cast(pa.date32()) for values in columns[position:position + len(DATE_COLUMNS)]]
+    position += len(DATE_COLUMNS)
+    arrays.append(pa.array(columns[position], pa.float64()))
+    arrays += [pa.array([split_list(value) for value in values], pa.list_(pa.string())) for values in columns[position + 1:position + 3]]
+
+    for table, column, target in (("issue_sprints", "sprint_id", "sprint"), ("issue_fix_version", "version_id", "version"),
+                                  ("issue_affects_version", "version_id", "version")):
+        links = load_links(connection, table, column, ids, names[target])
+        arrays.append(pa.array([links.get(issue_id, []) for issue_id in ids], pa.list_(pa.string())))
+    return pa.Table.from_arrays(arrays, schema=SCHEMA)
+
+
+def write_partition(path, table):
+    # written next to the previous file and renamed over it, readers never see a partial partition
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(table, path + ".tmp", compression=EXPORT_COMPRESSION)
+    os.replace(path + ".tmp", path)
+
+
+def remove_partition(output_dir, path):
+    if os.path.exists(path):
+        os.remove(path)
+    directory = os.path.dirname(path)
+    while directory != os.path.normpath(output_dir) and os.path.isdir(directory) and len(os.listdir(directory)) == 0:
+        os.rmdir(directory)
+        directory = os.path.dirname(directory)
+
+
+def export_dataset(connection, output_dir=EXPORT_DIR, force=False):
+    """
+        Description: Bring the columnar export of output_dir up to date: write the partitions whose state changed (or whose file is missing), remove the
+        partitions without issues anymore and store the new states in export_state. Returns (partitions written, partitions unchanged, partitions removed)
+    """
+
+    partitions, states, names = load_partitions(connection)
+    stored = {} if force else {(project, version): state for project, version, state in connection.execute("Select project, version, state_hash from export_state")}
+
+    written = []
+    unchanged = 0
+    for partition, issue_ids in partitions.items():
+        path = partition_path(output_dir, *partition)
+        if stored.get(partition) == states[partition] and os.path.exists(path):
+            unchanged += 1
+            continue
+        write_partition(path, partition_table(connection, issue_ids, names))
+        written.append(partition)
+
+    removed = [(project, version) for project, version in connection.execute("Select project, version from export_state") if (project, version) not in partitions]
+    for partition in removed:
+        remove_partition(output_dir, partition_path(output_dir, *partition))
+
+    exported_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    with connection:
+        connection.executemany("INSERT INTO export_state(project, version, state_hash, issues, exported_at) values(?,?,?,?,?) "
+                               "ON CONFLICT(project, version) DO UPDATE SET state_hash=excluded.state_hash, issues=excluded.issues, exported_at=excluded.exported_at",
+                               [partition + (states[partition], len(partitions[partition]), exported_at) for partition in written])
+        connection.executemany("DELETE FROM export_state where project=? and version=?", removed)
+    log.info("Export to {0}: {1} partitions written, {2} unchanged, {3} removed".format(output_dir, len(written), unchanged, len(removed)))
+    return len(written), unchanged, len(removed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the issues of the database as a Parquet dataset partitioned by project and version")
+    parser.add_argument("--output-dir", default=EXPORT_DIR)
+    parser.add_argument("--force", action="store_true", help="write all partitions again")
+    args = parser.parse_args()
+
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
+    logging.basicConfig(filename='logs/log_export.log', level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    with open("manifest.json") as _file:
+        manifest = json.load(_file)
+    connection = shards.connect(manifest["database"], manifest.get("extraction", {}).get("storage") == "sharded")
+    start = time.monotonic()
+    try:
+        written, unchanged, removed = export_dataset(connection, args.output_dir, args.force)
+    finally:
+        connection.close()
+    print("{0} partitions written, {1} unchanged, {2} removed in {3:.1f}s".format(written, unchanged, removed, time.monotonic() - start))
+
+
+if __name__ == "__main__":
+    main()
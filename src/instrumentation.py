@@ -0,0 +1,278 @@
+"""
+    Description: Lightweight run instrumentation: counters, gauges and latency histograms per stage of the extraction
+    Every process (main, workers, writer) records into its own module state and hands a snapshot to the main process at the end (multiprocessing Manager list),
+    the main process merges them into the run report: a JSON file in REPORT_DIR and a short human summary
+    Names are dotted: "http.<endpoint>" (requests), "map" (issue mapping), "db.<step>" (writer), "queue.<name>" (queue depth and put waits), "stage.<name>" (populate_db stages)
+"""
+
+import bisect
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse
+
+log = logging.getLogger(__name__)
+
+REPORT_DIR = "logs"
+# histogram bucket upper bounds in seconds, the last bucket counts everything above
+HISTOGRAM_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0]
+# jira REST paths and the endpoint they are reported under
+ENDPOINTS = [(re.compile(r"/search$"), "search"), (re.compile(r"/agile/1.0/sprint/\d+$"), "sprint_info"), (re.compile(r"/issue/[^/]+/changelog$"), "changelog"),
+             (re.compile(r"/board/\d+/sprint$"), "board_sprints"), (re.compile(r"/project/[^/]+/versions$"), "project_versions"),
+             (re.compile(r"/project/[^/]+$"), "project"), (re.compile(r"/serverInfo$"), "server_info")]
+PROFILERS = ["cprofile", "pyinstrument"]
+
+# process state, a forked process starts with reset()
+counters = {}
+gauges = {}
+histograms = {}
+process_started = time.monotonic()
+
+
+def reset():
+    global process_started
+
+    counters.clear()
+    gauges.clear()
+    histograms.clear()
+    process_started = time.monotonic()
+
+
+def count(name, value=1):
+    counters[name] = counters.get(name, 0) + value
+
+
+def gauge(name, value):
+    """
+        Description: Add a sample of a level (queue depth...), reported as samples, mean and max
+    """
+
+    if value is None:
+        return
+    samples = gauges.get(name)
+    if samples is None:
+        gauges[name] = [1, value, value]
+    else:
+        samples[0] += 1
+        samples[1] += value
+        samples[2] = max(samples[2], value)
+
+
+def observe(name, seconds):
+    """
+        Description: Add a duration to the latency histogram of name: [count, total seconds, max seconds, bucket counts]
+    """
+
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = [0, 0.0, 0.0, [0] * (len(HISTOGRAM_BUCKETS) + 1)]
+    histogram[0] += 1
+    histogram[1] += seconds
+    histogram[2] = max(histogram[2], seconds)
+    histogram[3][bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+
+
+@contextmanager
+def timed(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def endpoint_name(url):
+    path = urlparse(url).path
+    for pattern, name in ENDPOINTS:
+        if pattern.search(path):
+            return name
+    return "other"
+
+
+def record_http(endpoint, seconds, error=False, size=None):
+    observe("http." + endpoint, seconds)
+    if error:
+        count("http." + endpoint + ".errors")
+    if size is not None:
+        count("http." + endpoint + ".bytes", size)
+
+
+def response_hook(response, *args, **kwargs):
+    """
+        Description: requests response hook of the jira session (requests and latency are recorded by the callers), adds the response size of the endpoint
+    """
+
+    count("http." + endpoint_name(response.url) + ".bytes", len(response.content))
+
+
+def queue_size(_queue):
+    # multiprocessing qsize is not implemented on macOS
+    try:
+        return _queue.qsize()
+    except NotImplementedError:
+        return None
+
+
+def snapshot(process_name):
+    return {"process": process_name, "seconds": time.monotonic() - process_started, "counters": dict(counters),
+            "gauges": {name: list(samples) for name, samples in gauges.items()},
+            "histograms": {name: [histogram[0], histogram[1], histogram[2], list(histogram[3])] for name, histogram in histograms.items()}}
+
+
+def merge(snapshots):
+    """
+        Description: Sum the counters, gauges and histograms of process snapshots
+    """
+
+    merged = {"counters": {}, "gauges": {}, "histograms": {}}
+    for process in snapshots:
+        for name, value in process["counters"].items():
+            merged["counters"][name] = merged["counters"].get(name, 0) + value
+        for name, samples in process["gauges"].items():
+            total = merged["gauges"].setdefault(name, [0, 0, 0])
+            merged["gauges"][name] = [total[0] + samples[0], total[1] + samples[1], max(total[2], samples[2])]
+        for name, histogram in process["histograms"].items():
+            total = merged["histograms"].setdefault(name, [0, 0.0, 0.0, [0] * (len(HISTOGRAM_BUCKETS) + 1)])
+            merged["histograms"][name] = [total[0] + histogram[0], total[1] + histogram[1], max(total[2], histogram[2]),
+                                          [a + b for a, b in zip(total[3], histogram[3])]]
+    return merged
+
+
+def histogram_summary(histogram):
+    """
+        Description: Count, total, mean, max and p50/p95/p99 of a histogram, percentiles are the upper bound of their bucket (max for the last one)
+    """
+
+    number, total, maximum, buckets = histogram
+    summary = {"count": number, "total_s": round(total, 3), "mean_ms": round(total / number * 1000, 3) if number > 0 else None, "max_ms": round(maximum * 1000, 3)}
+    for label, quantile in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+        rank = quantile * number
+        cumulated = 0
+        summary[label] = None
+        for index, bucket in enumerate(buckets):
+            cumulated += bucket
+            if number > 0 and cumulated >= rank:
+                summary[label] = round(min(HISTOGRAM_BUCKETS[index], maximum) * 1000 if index < len(HISTOGRAM_BUCKETS) else maximum * 1000, 3)
+                break
+    return summary
+
+
+def gauge_summary(samples):
+    return {"samples": samples[0], "mean": round(samples[1] / samples[0], 2) if samples[0] > 0 else None, "max": samples[2]}
+
+
+def rate(value, seconds):
+    return round(value / seconds, 1) if seconds > 0 else None
+
+
+def build_report(snapshots, started, settings):
+    """
+        Description: Run report of the process snapshots: totals of all processes, derived rates and the numbers of every process
+        started is the datetime of the run start, settings the extraction settings of the run
+    """
+
+    seconds = max([process["seconds"] for process in snapshots] + [0])
+    merged = merge(snapshots)
+    counters_total = merged["counters"]
+    histograms_total = merged["histograms"]
+
+    http = {}
+    for name, histogram in histograms_total.items():
+        if name.startswith("http."):
+            endpoint = name[len("http."):]
+            http[endpoint] = histogram_summary(histogram)
+            http[endpoint]["errors"] = counters_total.get(name + ".errors", 0)
+            http[endpoint]["bytes"] = counters_total.get(name + ".bytes", 0)
+
+    mapped = counters_total.get("map.issues", 0)
+    rows = sum(value for name, value in counters_total.items() if name.startswith("db.rows."))
+    write_seconds = histograms_total.get("db.write_batch", [0, 0.0])[1]
+    rates = {"issues_mapped_per_second": rate(mapped, seconds), "issues_mapped_per_mapping_second": rate(mapped, histograms_total.get("map", [0, 0.0])[1]),
+             "rows_written_per_second": rate(rows, seconds), "rows_written_per_write_second": rate(rows, write_seconds)}
+
+    return {"started": started.isoformat(timespec="seconds"), "seconds": round(seconds, 3), "settings": settings, "rates": rates, "http": http,
+            "counters": counters_total,
+            "gauges": {name: gauge_summary(samples) for name, samples in merged["gauges"].items()},
+            "histograms": {name: histogram_summary(histogram) for name, histogram in histograms_total.items() if not name.startswith("http.")},
+            "processes": [{"process": process["process"], "seconds": round(process["seconds"], 3), "counters": process["counters"],
+                           "gauges": {name: gauge_summary(samples) for name, samples in process["gauges"].items()},
+                           "histograms": {name: histogram_summary(histogram) for name, histogram in process["histograms"].items()}} for process in snapshots]}
+
+
+def summary_lines(report):
+    """
+        Description: Short human summary of a run report
+    """
+
+    lines = ["Run of {0:.1f}s started {1}".format(report["seconds"], report["started"])]
+    for name, stage in sorted(report["histograms"].items()):
+        if name.startswith("stage."):
+            lines.append("  stage {0:<22} {1:10.2f}s".format(name[len("stage."):], stage["total_s"]))
+    for endpoint, stats in sorted(report["http"].items()):
+        lines.append("  http {0:<23} {1:7d} requests {2:5d} errors {3:9.1f} MB  mean {4} ms  p95 {5} ms".format(
+            endpoint, stats["count"], stats["errors"], stats["bytes"] / 1024.0 / 1024.0, stats["mean_ms"], stats["p95_ms"]))
+    rates = report["rates"]
+    lines.append("  issues mapped {0} ({1}/s, {2}/s of mapping time)".format(report["counters"].get("map.issues", 0), rates["issues_mapped_per_second"],
+                                                                           rates["issues_mapped_per_mapping_second"]))
+    lines.append("  rows written {0} ({1}/s, {2}/s of write time)".format(sum(value for name, value in report["counters"].items() if name.startswith("db.rows.")),
+                                                                        rates["rows_written_per_second"], rates["rows_written_per_write_second"]))
+    commit = report["histograms"].get("db.commit")
+    if commit is not None:
+        lines.append("  commits {0}  mean {1} ms  p95 {2} ms  max {3} ms".format(commit["count"], commit["mean_ms"], commit["p95_ms"], commit["max_ms"]))
+    for process in report["processes"]:
+        for name, samples in sorted(process["gauges"].items()):
+            lines.append("  {0:<24} {1:<22} mean {2}  max {3}".format(process["process"], name, samples["mean"], samples["max"]))
+    return lines
+
+
+def write_report(report, report_dir=REPORT_DIR):
+    if not os.path.exists(report_dir):
+        os.makedirs(report_dir)
+    path = os.path.join(report_dir, "run_report_{0}.json".format(datetime.now().strftime("%Y%m%d_%H%M%S")))
+    with open(path, "w") as _file:
+        json.dump(report, _file, indent=2)
+    return path
+
+
+def run_profiled(profiler, name, function, *args):
+    """
+        Description: Run function(*args) under cProfile or pyinstrument (optional dependency, cProfile is used when it is missing)
+        The profile is written to REPORT_DIR/profile_<name>.prof (pstats) or .html and the top functions are logged
+    """
+
+    if (profiler == "pyinstrument"):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            log.error("pyinstrument is not installed, profiling with cProfile")
+            profiler = "cprofile"
+
+    if not os.path.exists(REPORT_DIR):
+        os.makedirs(REPORT_DIR)
+    path = os.path.join(REPORT_DIR, "profile_" + re.sub(r"[^\w.-]+", "_", name))
+    if (profiler == "pyinstrument"):
+        profile = Profiler()
+        profile.start()
+        try:
+            return function(*args)
+        finally:
+            profile.stop()
+            with open(path + ".html", "w") as _file:
+                _file.write(profile.output_html())
+            log.info("Profile of {0} written to {1}.html\n{2}".format(name, path, profile.output_text()))
+
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(function, *args)
+    finally:
+        profile.dump_stats(path + ".prof")
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(30)
+        log.info("Profile of {0} written to {1}.prof\n{2}".format(name, path, stream.getvalue()))
@@ -0,0 +1,444 @@
+"""
+    Description: KPI computation for the manifest.json "kpis" block of every project (values set to "true" are computed)
+    The issue, sprint, version, dimension and link tables are loaded once from jira.db into numpy column arrays with one query per table,
+    every KPI is then computed with vectorized group-bys (bincount, lexsort, searchsorted) over these arrays. The monthly trends (backlog_evolution,
+    defect_trend) read the project totals of the daily_snapshot table maintained by the writer process instead of the issue dates, cycle_time and
+    reopened_bugs use the status transitions of the issue_transition table when the changelog is extracted
+    Run from the repository root: python3 -m src.kpi [output_file]   (numpy is required)
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from src import shards
+
+log = logging.getLogger(__name__)
+
+KPI_OUTPUT_FILE = "db/kpis.json"
+# issue types counted as bugs and statuses counted as reopened
+BUG_TYPES = ["Bug", "Defect"]
+REOPENED_STATUSES = ["Reopened"]
+SPRINT_DATE_FORMATS = ["%d/%b/%y %I:%M %p", "%d/%b/%y"]
+ISO_DATE_REGEX = re.compile(r"^\d{4}-\d{2}-\d{2}")
+NAT = np.datetime64("NaT", "D")
+# sqlite julianday of 1970-01-01, dates are loaded as days since 1970 (cheaper than parsing date strings)
+UNIX_EPOCH_JULIANDAY = 2440587.5
+
+
+def load_tables(connection):
+    """
+        Description: Load the tables used by the KPIs into column arrays {table: {column: numpy array}}, rows sorted by db id
+        Issue dates are kept as datetime64[D] (NaT when empty) and story points as float (nan when empty)
+        The link tables also get the rows of their issue and sprint/version ("issue_row", "target_row", -1 when missing)
+    """
+
+    tables = {}
+    tables["issue"] = load_columns(connection, "Select id, ifnull(project_id, 0), ifnull(type_id, 0), ifnull(status_id, 0), ifnull(epic_link, ''), "
+                                               + epoch_days("creation_date") + ", " + epoch_days("resolution_date") + ", cast(nullif(story_points, '') as real) "
+                                               "from issue order by id",
+                                   [("id", np.int64), ("project_id", np.int64), ("type_id", np.int64), ("status_id", np.int64), ("epic_link", object),
+                                    ("created", "days"), ("resolved", "days"), ("story_points", np.float64)])
+    tables["version"] = load_columns(connection, "Select id, name, " + epoch_days("start_date") + ", " + epoch_days("released_date") + " from version order by id",
+                                     [("id", np.int64), ("name", object), ("start", "days"), ("released", "days")])
+    # sprint dates come in the greenhopper format ("4/Jan/21 9:00 AM") or in ISO format (agile board sprints), sprints are few and parsed one by one
+    rows = connection.execute("Select id, name, ifnull(sequence, id), upper(ifnull(state, '')), start_date, complete_date from sprint order by id").fetchall()
+    tables["sprint"] = {"id": np.array([row[0] for row in rows], dtype=np.int64), "name": np.array([row[1] for row in rows], dtype=object),
+                        "sequence": np.array([float(row[2]) for row in rows], dtype=np.float64), "state": np.array([row[3] for row in rows], dtype=object),
+                        "start": np.array([parse_sprint_date(row[4]) for row in rows], dtype="datetime64[D]"),
+                        "complete": np.array([parse_sprint_date(row[5]) for row in rows], dtype="datetime64[D]")}
+    for table in ("issue_sprints", "issue_fix_version", "issue_affects_version"):
+        link_column = "sprint_id" if table == "issue_sprints" else "version_id"
+        tables[table] = load_columns(connection, "Select issue_id, " + link_column + " from " + table, [("issue_id", np.int64), (link_column, np.int64)])
+        tables[table]["issue_row"] = row_index(tables["issue"]["id"], tables[table]["issue_id"])
+        tables[table]["target_row"] = row_index(tables["sprint" if table == "issue_sprints" else "version"]["id"], tables[table][link_column])
+    tables["issue_transition"] = load_columns(connection, "Select issue_id, to_status_id, " + epoch_days("transition_date") + " from issue_transition",
+                                              [("issue_id", np.int64), ("to_status_id", np.int64), ("day", "days")])
+    tables["issue_transition"]["issue_row"] = row_index(tables["issue"]["id"], tables["issue_transition"]["issue_id"])
+    tables["daily_snapshot"] = load_columns(connection, "Select project_id, type_id, " + epoch_days("day") + ", created, resolved from daily_snapshot where version_id = 0",
+                                            [("project_id", np.int64), ("type_id", np.int64), ("day", "days"), ("created", np.int64), ("resolved", np.int64)])
+    for table, column in (("project", "project_id"), ("type", "name"), ("status", "name")):
+        tables[table] = dict(connection.execute("Select " + column + ", id from " + table).fetchall())
+    return tables
+
+
+def load_columns(connection, query, columns):
+    """
+        Description: Run the query and return {column name: numpy array}, columns of type "days" (see epoch_days) become datetime64[D] arrays
+    """
+
+    rows = connection.execute(query).fetchall()
+    values = list(zip(*rows)) if len(rows) > 0 else [[] for column in columns]
+    result = {}
+    for (name, dtype), column_values in zip(columns, values):
+        if dtype == "days":
+            days = np.array(column_values, dtype=np.float64)
+            result[name] = np.full(len(days), NAT)
+            known = ~np.isnan(days)
+            result[name][known] = days[known].astype(np.int64).astype("datetime64[D]")
+        else:
+            result[name] = np.array(column_values, dtype=dtype)
+    return result
+
+
+def epoch_days(column):
+    # days since 1970 of an ISO date column, NULL when empty
+    return "cast(julianday(nullif(substr(" + column + ", 1, 10), '')) - " + str(UNIX_EPOCH_JULIANDAY) + " as integer)"
+
+
+def parse_sprint_date(value):
+    if (value is None or value == ""):
+        return NAT
+    if ISO_DATE_REGEX.match(value):
+        return np.datetime64(value[:10], "D")
+    for date_format in SPRINT_DATE_FORMATS:
+        try:
+            return np.datetime64(datetime.strptime(value, date_format).date(), "D")
+        except ValueError:
+            pass
+    log.warning("Unable to parse sprint date: {0}".format(value))
+    return NAT
+
+
+def enabled_kpis(kpis_block):
+    """
+        Description: Names of the KPIs set to "true" in a manifest "kpis" block (grouped by scope, on_time_delivery, solution_quality)
+    """
+
+    names = []
+    for group in kpis_block.values():
+        if isinstance(group, dict):
+            names.extend(name for name, value in group.items() if value is True or str(value).lower() == "true")
+    return names
+
+
+def row_index(ids, values):
+    """
+        Description: Row of each value in the sorted ids array, -1 when the value is missing
+    """
+
+    if len(ids) == 0:
+        return np.full(len(values), -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(ids, values), len(ids) - 1)
+    return np.where(ids[positions] == values, positions, -1)
+
+
+def project_links(tables, link_table, mask):
+    """
+        Description: (issue rows, sprint or version rows) of the link rows of link_table whose issue is selected by mask and whose sprint or version exists
+    """
+
+    links = tables[link_table]
+    issue_rows = links["issue_row"]
+    target_rows = links["target_row"]
+    keep = (issue_rows >= 0) & (target_rows >= 0)
+    keep[keep] = mask[issue_rows[keep]]
+    return issue_rows[keep], target_rows[keep]
+
+
+def bug_mask(tables):
+    return np.isin(tables["issue"]["type_id"], [tables["type"][name] for name in BUG_TYPES if name in tables["type"]])
+
+
+def to_list(values):
+    # numpy values to json values, nan and NaT become None
+    if values.dtype.kind == "M":
+        return [None if np.isnat(value) else str(value) for value in values]
+    if values.dtype.kind == "f":
+        return [None if np.isnan(value) else round(float(value), 2) for value in values]
+    return values.tolist()
+
+
+def safe_ratio(numerator, denominator):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denominator > 0, numerator / np.maximum(denominator, 1e-12), np.nan)
+
+
+def days_between(start, end):
+    return (end - start).astype("timedelta64[D]").astype(np.float64)
+
+
+def group_percentiles(groups, values, number_of_groups, quantiles):
+    """
+        Description: Count, mean and the requested quantiles (nearest lower rank) of values per group, groups are row numbers from 0 to number_of_groups - 1
+    """
+
+    order = np.lexsort((values, groups))
+    groups = groups[order]
+    values = values[order]
+    counts = np.bincount(groups, minlength=number_of_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+    mean = safe_ratio(np.bincount(groups, weights=values, minlength=number_of_groups), counts)
+    result = {"count": counts, "mean": mean}
+    for name, quantile in quantiles:
+        result[name] = np.full(number_of_groups, np.nan)
+        has_values = counts > 0
+        result[name][has_values] = values[starts[has_values] + np.floor(quantile * (counts[has_values] - 1)).astype(np.int64)]
+    return result
+
+
+def monthly_flow(tables, rows):
+    """
+        Description: Issues created and resolved per month and issues still open at the end of each month, from the selected daily_snapshot rows
+    """
+
+    snapshot = tables["daily_snapshot"]
+    rows = rows & ~np.isnat(snapshot["day"])
+    if not rows.any():
+        return {"month": [], "created": [], "resolved": [], "open": []}
+    months = snapshot["day"][rows].astype("datetime64[M]")
+    first = months.min()
+    month_rows = (months - first).astype(np.int64)
+    number_of_months = int(month_rows.max()) + 1
+    created_count = np.bincount(month_rows, weights=snapshot["created"][rows], minlength=number_of_months).astype(np.int64)
+    resolved_count = np.bincount(month_rows, weights=snapshot["resolved"][rows], minlength=number_of_months).astype(np.int64)
+    return {"month": np.arange(first, first + number_of_months).astype(str).tolist(), "created": to_list(created_count), "resolved": to_list(resolved_count),
+            "open": to_list(np.cumsum(created_count) - np.cumsum(resolved_count))}
+
+
+def version_order(tables, used):
+    # versions with issues, by start date (versions without one last) then name
+    versions = tables["version"]
+    rows = np.flatnonzero(used)
+    start = versions["start"][rows]
+    return rows[np.lexsort((versions["name"][rows].astype(str), start.astype(np.int64), np.isnat(start)))]
+
+
+def per_version(tables, link_table, mask, columns):
+    """
+        Description: Sum of each {name: per issue values} column per version of the link table (fix or affects version), versions without issues are left out
+    """
+
+    issue_rows, version_rows = project_links(tables, link_table, mask)
+    number_of_versions = len(tables["version"]["id"])
+    counts = np.bincount(version_rows, minlength=number_of_versions)
+    rows = version_order(tables, counts > 0)
+    result = {"version": to_list(tables["version"]["name"][rows]), "issues": to_list(counts[rows])}
+    for name, values in columns.items():
+        result[name] = to_list(np.bincount(version_rows, weights=values[issue_rows], minlength=number_of_versions)[rows].astype(np.int64))
+    return result
+
+
+def sprint_velocity(tables, mask):
+    """
+        Description: Story points committed (all issues of the sprint) and completed (resolved between the sprint start and completion) per sprint,
+        sprints ordered by start date and sequence
+    """
+
+    issues = tables["issue"]
+    sprints = tables["sprint"]
+    issue_rows, sprint_rows = project_links(tables, "issue_sprints", mask)
+    number_of_sprints = len(sprints["id"])
+
+    points = np.nan_to_num(issues["story_points"][issue_rows])
+    resolved = issues["resolved"][issue_rows]
+    start = sprints["start"][sprint_rows]
+    complete = sprints["complete"][sprint_rows]
+    done = ~np.isnat(resolved) & (np.isnat(start) | (resolved >= start)) & (np.isnat(complete) | (resolved <= complete))
+
+    counts = np.bincount(sprint_rows, minlength=number_of_sprints)
+    committed = np.bincount(sprint_rows, weights=points, minlength=number_of_sprints)
+    completed = np.bincount(sprint_rows, weights=points * done, minlength=number_of_sprints)
+    rows = np.flatnonzero(counts > 0)
+    rows = rows[np.lexsort((sprints["sequence"][rows], sprints["start"][rows].astype(np.int64), np.isnat(sprints["start"][rows])))]
+    return rows, counts[rows], committed[rows], completed[rows]
+
+
+def agregated_velocity(tables, mask):
+    sprints = tables["sprint"]
+    rows, counts, committed, completed = sprint_velocity(tables, mask)
+    closed = sprints["state"][rows] == "CLOSED"
+    return {"sprint": to_list(sprints["name"][rows]), "state": to_list(sprints["state"][rows]), "issues": to_list(counts), "committed": to_list(committed),
+            "completed": to_list(completed), "average_completed": round(float(completed[closed].mean()), 2) if closed.any() else None}
+
+
+def predictibility_score(tables, mask):
+    """
+        Description: Completed / committed story points (percent) of the closed sprints, and over all closed sprints
+    """
+
+    sprints = tables["sprint"]
+    rows, counts, committed, completed = sprint_velocity(tables, mask)
+    closed = sprints["state"][rows] == "CLOSED"
+    total_committed = committed[closed].sum()
+    return {"sprint": to_list(sprints["name"][rows][closed]), "score": to_list(safe_ratio(completed[closed], committed[closed]) * 100),
+            "overall": round(float(completed[closed].sum() / total_committed * 100), 2) if total_committed > 0 else None}
+
+
+def work_started(tables):
+    """
+        Description: Date of the first status transition of every issue row, NaT for the issues without stored transitions
+    """
+
+    transitions = tables["issue_transition"]
+    started = np.full(len(tables["issue"]["id"]), NAT)
+    valid = (transitions["issue_row"] >= 0) & ~np.isnat(transitions["day"])
+    rows = transitions["issue_row"][valid]
+    days = transitions["day"][valid]
+    order = np.lexsort((days, rows))
+    issue_rows, first = np.unique(rows[order], return_index=True)
+    started[issue_rows] = days[order][first]
+    return started
+
+
+def cycle_time(tables, mask):
+    """
+        Description: Days from the start of work to resolution of the resolved issues per issue type: count, mean, median and 85th percentile
+        Work starts with the first status transition of the issue, or at its creation when no transition is stored (changelog not extracted)
+    """
+
+    issues = tables["issue"]
+    started = work_started(tables)
+    started = np.where(np.isnat(started), issues["created"], started)
+    resolved = mask & ~np.isnat(issues["resolved"]) & ~np.isnat(started)
+    type_names = {id: name for name, id in tables["type"].items()}
+    type_ids, groups = np.unique(issues["type_id"][resolved], return_inverse=True)
+    stats = group_percentiles(groups, days_between(started[resolved], issues["resolved"][resolved]), len(type_ids), [("median", 0.5), ("p85", 0.85)])
+    return {"type": [type_names.get(id, "") for id in type_ids.tolist()], "count": to_list(stats["count"]), "mean_days": to_list(stats["mean"]),
+            "median_days": to_list(stats["median"]), "p85_days": to_list(stats["p85"])}
+
+
+def open_vs_closed(tables, mask):
+    closed = ~np.isnat(tables["issue"]["resolved"])
+    return per_version(tables, "issue_fix_version", mask, {"open": (~closed).astype(np.int64), "closed": closed.astype(np.int64)})
+
+
+def snapshot_rows(tables, mask):
+    # daily_snapshot rows of the projects of the selected issues
+    return np.isin(tables["daily_snapshot"]["project_id"], np.unique(tables["issue"]["project_id"][mask]))
+
+
+def defect_trend(tables, mask):
+    bug_types = [tables["type"][name] for name in BUG_TYPES if name in tables["type"]]
+    return monthly_flow(tables, snapshot_rows(tables, mask) & np.isin(tables["daily_snapshot"]["type_id"], bug_types))
+
+
+def backlog_evolution(tables, mask):
+    return monthly_flow(tables, snapshot_rows(tables, mask))
+
+
+def average_bug_time(tables, mask):
+    """
+        Description: Average days from creation to resolution of the bugs resolved each month, and over all resolved bugs
+    """
+
+    issues = tables["issue"]
+    resolved = mask & bug_mask(tables) & ~np.isnat(issues["resolved"]) & ~np.isnat(issues["created"])
+    if not resolved.any():
+        return {"month": [], "resolved": [], "average_days": [], "overall_days": None}
+    days = days_between(issues["created"][resolved], issues["resolved"][resolved])
+    months = issues["resolved"][resolved].astype("datetime64[M]")
+    first = months.min()
+    month_rows = (months - first).astype(np.int64)
+    counts = np.bincount(month_rows)
+    return {"month": np.arange(first, first + len(counts)).astype(str).tolist(), "resolved": to_list(counts),
+            "average_days": to_list(safe_ratio(np.bincount(month_rows, weights=days), counts)), "overall_days": round(float(days.mean()), 2)}
+
+
+def reopened_bugs(tables, mask):
+    # bugs that went through one of REOPENED_STATUSES (stored transitions) or are in one of them, per fix version
+    bugs = bug_mask(tables)
+    reopened_ids = [tables["status"][name] for name in REOPENED_STATUSES if name in tables["status"]]
+    transitions = tables["issue_transition"]
+    reopened = np.isin(tables["issue"]["status_id"], reopened_ids)
+    reopened[transitions["issue_row"][(transitions["issue_row"] >= 0) & np.isin(transitions["to_status_id"], reopened_ids)]] = True
+    reopened &= bugs
+    return per_version(tables, "issue_fix_version", mask & bugs, {"reopened": reopened.astype(np.int64)})
+
+
+def bugs_found_per_release(tables, mask):
+    return per_version(tables, "issue_affects_version", mask & bug_mask(tables), {})
+
+
+def epic_changes(tables, mask):
+    """
+        Description: Per fix version, the number of epics and the scope added after the version started: issues created after the version
+        start date and the number of epics they belong to
+    """
+
+    issues = tables["issue"]
+    versions = tables["version"]
+    issue_rows, version_rows = project_links(tables, "issue_fix_version", mask)
+    epics, epic_rows = np.unique(issues["epic_link"][issue_rows].astype(str), return_inverse=True)
+    with_epic = epics[epic_rows] != ""
+    version_start = versions["start"][version_rows]
+    added = ~np.isnat(version_start) & (issues["created"][issue_rows] > version_start)
+
+    number_of_versions = len(versions["id"])
+    counts = np.bincount(version_rows, minlength=number_of_versions)
+    rows = version_order(tables, counts > 0)
+    # distinct (version, epic) pairs
+    pairs = np.unique(version_rows[with_epic] * len(epics) + epic_rows[with_epic])
+    added_pairs = np.unique(version_rows[with_epic & added] * len(epics) + epic_rows[with_epic & added])
+    return {"version": to_list(versions["name"][rows]), "issues": to_list(counts[rows]),
+            "epics": to_list(np.bincount(pairs // max(len(epics), 1), minlength=number_of_versions)[rows]),
+            "added_issues": to_list(np.bincount(version_rows, weights=added.astype(np.float64), minlength=number_of_versions)[rows].astype(np.int64)),
+            "epics_with_added_issues": to_list(np.bincount(added_pairs // max(len(epics), 1), minlength=number_of_versions)[rows])}
+
+
+# manifest kpi name and the function computing it
+KPI_FUNCTIONS = {"epic_changes": epic_changes, "backlog_evolution": backlog_evolution, "agregated_velocity": agregated_velocity, "cycle_time": cycle_time,
+                 "predictibility_score": predictibility_score, "open_vs_closed": open_vs_closed, "defect_trend": defect_trend, "average_bug_time": average_bug_time,
+                 "reopened_bugs": reopened_bugs, "bugs_found_per_release": bugs_found_per_release}
+
+
+def project_mask(tables, project_codes):
+    project_ids = [tables["project"][code] for code in project_codes if code in tables["project"]]
+    return np.isin(tables["issue"]["project_id"], project_ids)
+
+
+def compute_project_kpis(tables, project_codes, kpi_names):
+    """
+        Description: Compute the listed KPIs on the issues of the project codes, returns {kpi name: result}
+    """
+
+    mask = project_mask(tables, project_codes)
+    results = {}
+    for name in kpi_names:
+        if name not in KPI_FUNCTIONS:
+            log.warning("Unknown KPI: {0}".format(name))
+            continue
+        results[name] = KPI_FUNCTIONS[name](tables, mask)
+    return results
+
+
+def compute_kpis(connection, manifest):
+    """
+        Description: Compute the enabled KPIs of every manifest project, the tables are loaded once for all projects. Returns {project name: {kpi name: result}}
+    """
+
+    tables = load_tables(connection)
+    log.info("Loaded {0} issues, {1} sprints and {2} versions for the KPIs".format(len(tables["issue"]["id"]), len(tables["sprint"]["id"]), len(tables["version"]["id"])))
+    results = {}
+    for project_name, project in manifest["extract_for"].items():
+        kpi_names = enabled_kpis(project.get("kpis", {}))
+        results[project_name] = compute_project_kpis(tables, project["settings"]["project_code"], kpi_names)
+        log.info("Computed KPIs {0} for project: {1}".format(kpi_names, project_name))
+    return results
+
+
+def main():
+    output_file = sys.argv[1] if len(sys.argv) > 1 else KPI_OUTPUT_FILE
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
+    logging.basicConfig(filename='logs/log_kpi.log', level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    with open("manifest.json") as _file:
+        manifest = json.load(_file)
+    connection = shards.connect(manifest["database"], manifest.get("extraction", {}).get("storage") == "sharded")
+    try:
+        results = compute_kpis(connection, manifest)
+    finally:
+        connection.close()
+    with open(output_file, "w") as _file:
+        json.dump(results, _file, indent=2)
+    print("KPIs of {0} projects written to {1}".format(len(results), output_file))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,26 @@
 from jira import JIRA
 from jira import JIRAError
+import ast
+import hashlib
+import importlib.util
+import itertools
 import json
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
 import re
-from multiprocessing import Lock, Process, Queue, current_process
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing import Array, Lock, Manager, Process, Queue, Value, current_process
 import queue
+import threading
 import time
+from datetime import datetime, timedelta, timezone
 import sqlite3
 from sqlite3 import Error
+import zlib
+
+from src import instrumentation
+from src import shards
 
 MANIFEST_JSON = ""
 JIRA_URL = ""
@@ -16,16 +28,154 @@ JIRA_USER = ""
 JIRA_PASSWORD = ""
 DB_FILE =""
 MAPPER_FILE=""
+# extraction engine selected in manifest.json: "process" (NUMBER_OF_THREADS worker processes) or "async" (see src/async_engine.py)
+ENGINE = "process"
 DB_CONNECTION = None
 TH_JIRA_CONNECTION = None
-# change this if you need to lower or increase the amount of threads, each extracting issues from a different version
+# default amount of threads, each extracting issues from a different version (manifest.json "extraction" block or main.py --workers)
 NUMBER_OF_THREADS = 4
+# the writer process commits after WRITER_BATCH_SIZE issues or after WRITER_BATCH_TIMEOUT_MS, whichever comes first
+WRITER_BATCH_SIZE = 500
+WRITER_BATCH_TIMEOUT_MS = 2000
+# issues requested from jira per search request, and the maximum number of records waiting for the writer
+ISSUE_PAGE_SIZE = 100
+WRITE_QUEUE_SIZE = 2000
+# maximum number of values used in a single "where ... in (...)" query
+SQL_CHUNK_SIZE = 500
+MIGRATIONS_DIR = "db/migrations"
+# pages the WAL of the writer process may hold before it is copied to the database, each copy rewrites the index pages touched since the last one
+WRITER_WAL_AUTOCHECKPOINT = 10000
+# incremental mode: issues updated since the last stored updated date (minus the overlap) are extracted, full resync extracts everything
+FULL_RESYNC = False
+WATERMARK_OVERLAP_MINUTES = 1440
+WATERMARK_FORMAT = "%Y-%m-%dT%H:%M:%S+0000"
+# versions bigger than TASK_CHUNK_SIZE issues are split in page range tasks shared by all workers
+TASK_CHUNK_SIZE = 1000
+# auto tune: start with AUTO_TUNE_START_WORKERS and every AUTO_TUNE_INTERVAL_SECONDS add one worker (up to NUMBER_OF_THREADS) while the jira requests are healthy,
+# halve the workers when the error rate or the average latency (compared to the best interval) is too high
+AUTO_TUNE = False
+AUTO_TUNE_START_WORKERS = 2
+AUTO_TUNE_INTERVAL_SECONDS = 10
+AUTO_TUNE_MAX_ERROR_RATE = 0.05
+AUTO_TUNE_MAX_LATENCY_FACTOR = 2.0
+# raw issue payload: "compressed" (canonical JSON compressed with zlib), "json" (canonical JSON text, readable by the sqlite JSON functions),
+# "repr" (the previous str(issue) text) or "off", stored in the issue_raw side table or in issue.raw_value
+# RAW_STORAGE_KEYS keeps only the listed keys of the payload (dotted paths like "fields.status"), an empty list keeps the whole issue
+RAW_STORAGE = "compressed"
+RAW_STORAGE_TABLE = "issue_raw"
+RAW_STORAGE_KEYS = []
+RAW_COMPRESSION_LEVEL = 6
+# status transitions (issue_transition table) from the jira changelog, only requested for the issues updated since their changelog was stored
+CHANGELOG = False
+# histories per request when a changelog is paged with the issue changelog endpoint
+CHANGELOG_PAGE_SIZE = 100
+CHANGELOG_PATH = "issue/{0}/changelog"
+# {issue key: issue updated date of the stored changelog}, loaded by the main process before the workers start
+CHANGELOG_STATE = {}
+# log file written by a listener thread of the main process, rotated at LOG_MAX_BYTES (LOG_BACKUP_COUNT files kept)
+LOG_FILE = "logs/log_data.log"
+LOG_FORMAT = "%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s"
+LOG_LEVEL = "INFO"
+LOG_MAX_BYTES = 100 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# DEBUG only: issue payloads are logged for one issue out of LOG_PAYLOAD_SAMPLE (0: never) and cut to LOG_PAYLOAD_CHARS characters (0: no limit)
+LOG_PAYLOAD_SAMPLE = 100
+LOG_PAYLOAD_CHARS = 1000
+# version discovery: the versions of DISCOVERY_THREADS projects are requested at the same time, a stored version catalogue younger than
+# VERSION_CACHE_TTL_MINUTES is used without request (0: always ask jira), an older one is revalidated with its ETag
+DISCOVERY_THREADS = 8
+VERSION_CACHE_TTL_MINUTES = 60
+VERSION_CATALOGUE_PATH = "project/{0}/versions"
+# seconds a worker waits for a task while the version discovery is still queueing them
+WORK_QUEUE_POLL_SECONDS = 0.2
+# "single": one database, "sharded": one database per manifest project with its own writer process, the manifest database keeps the global ids (see src/shards.py)
+STORAGE = "single"
+# sharded storage: {manifest project name: shard file}, the write queue of every shard and the registry connection of a shard writer
+SHARDS = {}
+WRITE_QUEUES = {}
+REGISTRY_CONNECTION = None
+# export stage after the extraction: Parquet snapshot of the issues in EXPORT_DIR, only the partitions changed by the run are written (see src/export.py)
+EXPORT = False
+EXPORT_DIR = "export"
+# durable checkpoints: every run and the state of its tasks are stored (extraction_run and run_task tables, see checkpoint_record), a failed task is retried
+# TASK_MAX_ATTEMPTS times after task_retry_delay(attempt) seconds and RESUME (main.py --resume) continues the last run that did not complete
+TASK_MAX_ATTEMPTS = 3
+TASK_RETRY_BACKOFF_SECONDS = 5
+RESUME = False
+RUN_ID = None
+# "cprofile" or "pyinstrument": profile the first worker process (or the async extraction), see instrumentation.run_profiled
+PROFILE_WORKER = None
+# manifest.json "extraction" keys (and main.py arguments) and the setting they change
+EXTRACTION_SETTINGS = {"engine": "ENGINE", "workers": "NUMBER_OF_THREADS", "page_size": "ISSUE_PAGE_SIZE", "writer_batch_size": "WRITER_BATCH_SIZE",
+                       "writer_batch_timeout_ms": "WRITER_BATCH_TIMEOUT_MS", "task_chunk_size": "TASK_CHUNK_SIZE", "auto_tune": "AUTO_TUNE",
+                       "raw_storage": "RAW_STORAGE", "raw_storage_table": "RAW_STORAGE_TABLE", "raw_storage_keys": "RAW_STORAGE_KEYS",
+                       "changelog": "CHANGELOG", "profile_worker": "PROFILE_WORKER", "log_level": "LOG_LEVEL", "log_max_bytes": "LOG_MAX_BYTES",
+                       "log_backup_count": "LOG_BACKUP_COUNT", "log_payload_sample": "LOG_PAYLOAD_SAMPLE", "log_payload_chars": "LOG_PAYLOAD_CHARS",
+                       "discovery_threads": "DISCOVERY_THREADS", "version_cache_ttl_minutes": "VERSION_CACHE_TTL_MINUTES", "storage": "STORAGE",
+                       "export": "EXPORT", "export_dir": "EXPORT_DIR", "task_max_attempts": "TASK_MAX_ATTEMPTS",
+                       "task_retry_backoff_seconds": "TASK_RETRY_BACKOFF_SECONDS"}
+# worker processes: [requests, errors, latency seconds] of the jira requests since the last auto tune interval, and the number of workers allowed to run
+tune_stats = None
+tune_level = None
+# instrumentation snapshots of the worker and writer processes, handed to the main process at the end of the run (multiprocessing Manager list)
+RUN_STATS = None
+log_listener = None
+# warnings of apply_extraction_settings, the logging settings are only known (and configured) once all settings are applied
+setting_warnings = []
+# issues seen by the payload log sampling of the current process
+payload_counter = 0
 log = None
 workQueue = None
+writeQueue = None
+# [tasks queued by the version discovery (-1 while it runs), tasks taken by the workers], the workers stop when both are equal
+task_counts = None
+# jira connection of each version discovery thread
+discovery_local = threading.local()
 FIELDS_JSON_DICT = {}
-
-version_dict = {}
-issues_populated_dict = {}
+# FIELDS_JSON_DICT compiled at startup: extractors used by map_issue and the jira fields requested by the search
+COMPILED_MAPPER = []
+MAPPED_FIELDS = ""
+MAP_VALUE = 0
+MAP_LIST = 1
+MAP_SPRINTS = 2
+SPRINT_ID_REGEX = re.compile(r"id=([\d*]*)")
+
+# per process cache of the dimension tables {table: {name: db id}}, filled by the writer process (the only one creating dimension values)
+DIMENSION_CACHE = {}
+DIMENSION_CACHE_STATS = {}
+# writer process: issues inserted, updated and skipped because their content hash did not change
+ISSUE_WRITE_STATS = {"inserted": 0, "updated": 0, "unchanged": 0}
+# contribution of the issues listed in the snapshot_issues temp table to daily_snapshot: issues created and resolved per project, fix version, type,
+# current status and day. Every issue also counts once under version_id 0, the project totals
+DAILY_SNAPSHOT_SELECT = ("Select ifnull(i.project_id, 0) as project_id, v.version_id as version_id, ifnull(i.type_id, 0) as type_id, ifnull(i.status_id, 0) as status_id, "
+                         "d.day as day, sum(d.created) as created, sum(d.resolved) as resolved from ("
+                         "Select i.id as issue_id, substr(i.creation_date, 1, 10) as day, 1 as created, 0 as resolved from snapshot_issues s join issue i on i.id = s.issue_id "
+                         "where i.creation_date <> '' "
+                         "union all Select i.id, substr(i.resolution_date, 1, 10), 0, 1 from snapshot_issues s join issue i on i.id = s.issue_id where i.resolution_date <> '') d "
+                         "join issue i on i.id = d.issue_id "
+                         "join (Select issue_id, 0 as version_id from snapshot_issues union all "
+                         "Select f.issue_id, f.version_id from snapshot_issues s join issue_fix_version f on f.issue_id = s.issue_id) v on v.issue_id = d.issue_id "
+                         "group by 1, 2, 3, 4, 5")
+# populated fields holding the link sets of an issue (sprints, fix versions, affects versions)
+LINK_FIELDS = ["sprints", "fix_version", "affects_version"]
+# sprint cache {jira sprint id: sprint data} shared by all processes for the whole run (multiprocessing Manager dict)
+# local_sprint_cache avoids the round trip to the manager for sprints already seen by the current process
+SPRINT_CACHE = None
+local_sprint_cache = {}
+# cached instead of the sprint data when a sprint lookup failed, the sprint is not requested again during the run
+SPRINT_LOOKUP_FAILED = "lookup failed"
+sprint_cache_stats = {"hits": 0, "misses": 0}
+# writer process: chunks done per version {(manifest project name, version name): {"chunks": set, "updated": max updated}}
+pending_watermarks = {}
+# writer process: tasks {(run id, task key)} that may have lost records with a batch that could not be committed, and their versions (see fail_dropped_tasks)
+dropped_tasks = set()
+blocked_versions = set()
+DIMENSION_COLUMNS = {"project": "project_id", "resolution": "name", "status": "name", "type": "name", "version": "name"}
+# issue table column and the fields.json key that populates it
+ISSUE_FIELD_COLUMNS = [("key", "key"), ("summary", "summary"), ("epic_name", "epic_name"), ("labels", "labels"), ("creation_date", "created_date"),
+                       ("resolution_date", "resolution_date"), ("updated_date", "updated_date"), ("start_date", "start_date"), ("due_date", "due_date"),
+                       ("priority", "priority"), ("assignee", "assignee"), ("reporter", "reporter"), ("components", "components"), ("epic_link", "epic_links"),
+                       ("story_points", "story_points"), ("tshirt_size", "tshirt_size"), ("linked_theme", "linked_theme")]
 
 def get_credentials():
     """
@@ -37,7 +187,10 @@ def get_credentials():
     global JIRA_PASSWORD
     global DB_FILE
     global MANIFEST_JSON
+    global ENGINE
     global FIELDS_JSON_DICT
+    global COMPILED_MAPPER
+    global MAPPED_FIELDS
 
     with open("manifest.json") as f:
         MANIFEST_JSON = json.load(f)
@@ -47,12 +200,84 @@ def get_credentials():
     with open("json/mapper/fields.json") as _file:
         file_json = json.load(_file)
         FIELDS_JSON_DICT = file_json["issue"]
+    COMPILED_MAPPER = compile_field_mapper(FIELDS_JSON_DICT)
+    MAPPED_FIELDS = mapped_jira_fields()
 
     JIRA_URL = access_json["server_url"]
     JIRA_USER = access_json["username"]
     JIRA_PASSWORD = access_json["password"]
     DB_FILE = MANIFEST_JSON["database"]
+    ENGINE = MANIFEST_JSON.get("engine", "process")
     MAPPER_FILE = MANIFEST_JSON["mapper"]
+    apply_extraction_settings(MANIFEST_JSON.get("extraction", {}))
+
+
+class LogPayload:
+    """
+        Description: Lazy log argument for payloads (issue, sprint, version dictionaries): converted to text only when the record is emitted, cut to LOG_PAYLOAD_CHARS
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        text = str(self.value)
+        if (LOG_PAYLOAD_CHARS > 0 and len(text) > LOG_PAYLOAD_CHARS):
+            return "{0}... ({1} characters)".format(text[:LOG_PAYLOAD_CHARS], len(text))
+        return text
+
+
+def payload_sampled():
+    """
+        Description: True when the payloads of the current issue are logged: DEBUG enabled and one issue out of LOG_PAYLOAD_SAMPLE
+    """
+
+    global payload_counter
+
+    if (LOG_PAYLOAD_SAMPLE <= 0 or not log.isEnabledFor(logging.DEBUG)):
+        return False
+    payload_counter += 1
+    return (payload_counter - 1) % LOG_PAYLOAD_SAMPLE == 0
+
+
+def configure_logging():
+    """
+        Description: Send the records of all processes to LOG_FILE through one multiprocessing queue, at LOG_LEVEL
+        The forked workers and writer inherit the root queue handler, only the listener thread of the main process writes (and rotates) the file
+    """
+
+    global log_listener
+
+    if not os.path.exists(os.path.dirname(LOG_FILE)):
+        os.makedirs(os.path.dirname(LOG_FILE))
+    log_queue = Queue()
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_listener = QueueListener(log_queue, file_handler)
+    log_listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(str(LOG_LEVEL).upper())
+
+
+def apply_extraction_settings(settings):
+    """
+        Description: Change the extraction settings (engine, workers, page size, batch size...) from a manifest "extraction" block or the main.py arguments, None values are ignored
+        The "_comment" keys of the manifest document the settings and are skipped, the unknown keys are kept in setting_warnings until logging is configured
+    """
+
+    for key, value in settings.items():
+        if key.startswith("_comment"):
+            continue
+        if key in EXTRACTION_SETTINGS and value is not None:
+            globals()[EXTRACTION_SETTINGS[key]] = value
+        elif key not in EXTRACTION_SETTINGS:
+            setting_warnings.append("Unknown extraction setting: {0}".format(key))
 
 
 def connect_to_db():
@@ -62,12 +287,83 @@ def connect_to_db():
     global DB_CONNECTION
     log.info("Try to connect to the database")
     try:
-        DB_CONNECTION = sqlite3.Connection(DB_FILE)
+        # with the async engine the version discovery stores the versions from a thread of the event loop executor, one thread at a time
+        DB_CONNECTION = sqlite3.Connection(DB_FILE, timeout=30, check_same_thread=False)
+        # WAL lets the version discovery in the main process and the writer process work on the same file without locking each other out
+        DB_CONNECTION.execute("PRAGMA journal_mode=WAL")
+        DB_CONNECTION.execute("PRAGMA synchronous=NORMAL")
         log.info("Successful connection to the database: {0}".format(DB_FILE))
     except Error as er:
         log.error("Connection to the database ERROR:{0}".format(er))
     
 
+def migrate_db(connection=None):
+    """
+        Description: Apply the schema migrations from MIGRATIONS_DIR that are newer than the database user_version, to DB_CONNECTION or to the given connection (shard)
+        Migrations are named <number>_<description>.sql, or .py for data migrations (a module with a migrate(connection) function)
+    """
+
+    connection = DB_CONNECTION if connection is None else connection
+    if (connection is None):
+        log.error("unable to migrate the database, no connection")
+        return
+
+    current_version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for file_name in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not (file_name.endswith(".sql") or file_name.endswith(".py")):
+            continue
+        migration_version = int(file_name.split("_")[0])
+        if migration_version > current_version:
+            log.info("Apply database migration: {0}".format(file_name))
+            if file_name.endswith(".py"):
+                spec = importlib.util.spec_from_file_location(file_name[:-3], os.path.join(MIGRATIONS_DIR, file_name))
+                migration = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(migration)
+                migration.migrate(connection)
+            else:
+                with open(os.path.join(MIGRATIONS_DIR, file_name)) as _file:
+                    connection.executescript(_file.read())
+            connection.execute("PRAGMA user_version = {0}".format(migration_version))
+            connection.commit()
+            current_version = migration_version
+
+
+def prepare_shards():
+    """
+        Description: Sharded storage: register the shard of every manifest project in the main database, create its file or apply the pending migrations to it
+    """
+
+    global SHARDS
+
+    SHARDS = {}
+    for project in MANIFEST_JSON["extract_for"]:
+        shard_file = shards.register_shard(DB_CONNECTION, DB_FILE, project)
+        connection = sqlite3.Connection(shard_file, timeout=30)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            migrate_db(connection)
+        finally:
+            connection.close()
+        SHARDS[project] = shard_file
+    log.info("Sharded storage: {0}".format(SHARDS))
+
+
+def data_connections():
+    """
+        Description: Connections to the databases holding the extracted issues: DB_CONNECTION, or with sharded storage each shard in turn (opened and closed here)
+    """
+
+    if (STORAGE != "sharded"):
+        yield DB_CONNECTION
+        return
+    for shard_file in SHARDS.values():
+        connection = sqlite3.Connection(shard_file, timeout=30)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+
 def disconnect_from_db():
     """
     Description: disconnect from the SQLITE3 datbase
@@ -87,6 +383,9 @@ def connect_to_jira ():
         log.info("Connecting to JIRA: {0}".format(JIRA_URL))
         jira_options = {'server': JIRA_URL}
         jira = JIRA(options=jira_options, basic_auth=(JIRA_USER, JIRA_PASSWORD))
+        # response sizes per endpoint for the run report
+        if (getattr(jira, "_session", None) is not None):
+            jira._session.hooks["response"].append(instrumentation.response_hook)
         log.info("Connection established")
         return jira
     except Exception as e:
@@ -94,57 +393,174 @@ def connect_to_jira ():
         return None
 
 
-def get_project_versions(jira_connector, project_name, regex_version):
+def discovery_connection():
+    # jira sessions are not shared between threads, every discovery thread connects once
+    if getattr(discovery_local, "jira", None) is None:
+        discovery_local.jira = connect_to_jira()
+    return discovery_local.jira
+
+
+def load_version_catalogue():
     """
-    Description: Generate a list of all versions, filtered by the regex provided on the JSON manifest file
+        Description: Return the stored version catalogue {project code: (etag, fetched at datetime, raw jira versions)}
     """
 
-    versions_dict = {}
-    version_array = []
+    catalogue = {}
+    if (DB_CONNECTION is None):
+        log.error("unable to load the version catalogue, no database connection")
+        return catalogue
+    for project_code, etag, fetched_at, versions in DB_CONNECTION.execute("Select project_code, etag, fetched_at, versions from version_catalogue"):
+        catalogue[project_code] = (etag, datetime.strptime(fetched_at, WATERMARK_FORMAT).replace(tzinfo=timezone.utc), json.loads(versions))
+    log.info("Version catalogue loaded for {0} projects".format(len(catalogue)))
+    return catalogue
 
-    if (regex_version == ""):
-        version_array.append("empty")
-    for version in jira_connector.project_versions(jira_connector.project(str(project_name))):
-        if re.match(re.compile(str(regex_version)),str(version)):
-            store_version_to_db(version.raw)
-            log.info("for project: {0} with regex: {1} we have identified version: {2}".format(project_name, regex_version, version.raw))
-            version_array.append(version.raw["name"])
-    
-    versions_dict["version_name"] = version_array
-    log.info("for project: {0} with regex: {1} we have the following versions: {2}".format(project_name, regex_version, versions_dict))
-    return versions_dict
 
+def fetch_project_versions(project_code, cached, board_ids, sprint_cache):
+    """
+        Description: Runs on a discovery thread: return (status, raw jira versions, etag) of a project, cached is its stored catalogue entry or None
+        status is "fresh" (stored catalogue younger than VERSION_CACHE_TTL_MINUTES, no request), "not_modified" (ETag revalidated by jira) or "fetched"
+        The sprints of the optional board_ids are added to sprint_cache as well
+        Jira output: [{'self': 'link.....', 'id': '1', 'name': 'name_here', 'archived': False, 'released': False, 'startDate': '2001-01-01', 'releaseDate': '2001-01-31', 'overdue': True, 'userStartDate': '01/Jan/01', 'userReleaseDate': '31/Jan/01', 'projectId': 1}]
+    """
+
+    jira_connector = discovery_connection()
+    if (jira_connector is None):
+        raise JIRAError("no jira connection")
+    prefetch_board_sprints(jira_connector, board_ids, sprint_cache)
 
-def store_version_to_db(dict_value):
+    if (cached is not None and VERSION_CACHE_TTL_MINUTES > 0 and datetime.now(timezone.utc) - cached[1] < timedelta(minutes=VERSION_CACHE_TTL_MINUTES)):
+        return "fresh", cached[2], cached[0]
+
+    headers = {"If-None-Match": cached[0]} if (cached is not None and cached[0]) else {}
+    request_started = time.monotonic()
+    try:
+        response = jira_connector._session.get(jira_connector._get_url(VERSION_CATALOGUE_PATH.format(project_code)), headers=headers)
+    except JIRAError:
+        record_request(request_started, True, "project_versions")
+        raise
+    record_request(request_started, endpoint="project_versions")
+    if (response.status_code == 304):
+        return "not_modified", cached[2], cached[0]
+    return "fetched", response.json(), response.headers.get("ETag")
+
+
+def store_versions(project_code, status, versions, etag):
     """
-    Description: Populate the verison database with the data of all versions provided in the input dictionary. To assure updated data, all existing fields will be overwritten
-    Jira output: jira output value: {'self': 'link.....', 'id': '1', 'name': 'name_here', 'archived': False, 'released': False, 'startDate': '2001-01-01', 'releaseDate': '2001-01-31', 'overdue': True, 'userStartDate': '01/Jan/01', 'userReleaseDate': '31/Jan/01', 'projectId': 1}
+        Description: Store the versions of a project in one transaction: upsert of the version table and of its version_catalogue entry
+        To assure updated data, all existing fields of a fetched version are overwritten, a catalogue revalidated unchanged by jira (not_modified) only gets
+        a new fetch date and a fresh catalogue (served from the store, no request) is left as is so that it is revalidated once VERSION_CACHE_TTL_MINUTES are over
     """
 
-    if (DB_CONNECTION is not None):
-        log.info("ready to store in database version :{0}".format(dict_value))
-        cur = DB_CONNECTION.cursor()
-        cur.execute("Select * from version where version_id = ?", (dict_value["id"],))
-        rows = cur.fetchall()
-        if (len(rows) == 0 ):
-            #create version
-            cur.execute("INSERT INTO version(version_id, name, archived, released, start_date, released_date) values(?,?,?,?,?,?)",
-            (dict_value["id"],dict_value["name"],dict_value["archived"],dict_value["released"],dict_value["startDate"],dict_value["releaseDate"],))
-            DB_CONNECTION.commit()
-            log.info("A new version successfully created {0}".format(cur.lastrowid))
-        else:
-            #update version
-            cur.execute("UPDATE version  set name=?, archived=?, released=?, start_date=?, released_date=? WHERE version_id=?",
-            (dict_value["name"],dict_value["archived"],dict_value["released"],dict_value["startDate"],dict_value["releaseDate"],dict_value["id"],))
-            DB_CONNECTION.commit()
-            log.info("An updated version successfully for ID: {0}".format(dict_value["id"]))
-    else:
-        log.error("unable to store version :{0}".format(dict_value))
+    if (status == "fresh"):
+        return
+    if (DB_CONNECTION is None):
+        log.error("unable to store the versions of project: {0}, no database connection".format(project_code))
+        return
+
+    fetched_at = datetime.now(timezone.utc).strftime(WATERMARK_FORMAT)
+    with DB_CONNECTION:
+        if (status == "fetched"):
+            DB_CONNECTION.executemany("INSERT INTO version(version_id, name, archived, released, start_date, released_date) values(?,?,?,?,?,?) "
+                                      "ON CONFLICT(version_id) DO UPDATE SET name=excluded.name, archived=excluded.archived, released=excluded.released, "
+                                      "start_date=excluded.start_date, released_date=excluded.released_date",
+                                      [(version["id"], version["name"], version.get("archived"), version.get("released"), version.get("startDate"),
+                                        version.get("releaseDate")) for version in versions])
+            DB_CONNECTION.execute("INSERT INTO version_catalogue(project_code, etag, fetched_at, versions) values(?,?,?,?) "
+                                  "ON CONFLICT(project_code) DO UPDATE SET etag=excluded.etag, fetched_at=excluded.fetched_at, versions=excluded.versions",
+                                  (project_code, etag, fetched_at, json.dumps(versions)))
+        elif (status == "not_modified"):
+            DB_CONNECTION.execute("UPDATE version_catalogue set fetched_at=? WHERE project_code=?", (fetched_at, project_code))
+
+
+def filter_versions(versions, regex_version):
+    """
+        Description: Names of the versions matching the regex of the manifest (compiled once per project), "empty" (issues without fix version) when the regex is empty
+    """
+
+    pattern = re.compile(str(regex_version))
+    version_names = ["empty"] if regex_version == "" else []
+    version_names += [version["name"] for version in versions if pattern.match(version["name"])]
+    return version_names
+
+
+def discover_versions(watermarks, sprint_cache):
+    """
+        Description: Version discovery of the manifest projects: the versions (and board sprints) of DISCOVERY_THREADS projects are requested at the same time,
+        each project is stored and yielded as (manifest project name, version tasks) as soon as its versions are known, so that its extraction can start
+        while the other projects are still discovered. A project whose versions cannot be requested falls back to its stored catalogue
+    """
 
+    catalogue = {} if FULL_RESYNC else load_version_catalogue()
+    with ThreadPoolExecutor(max_workers=DISCOVERY_THREADS) as executor:
+        futures = {}
+        for project, project_json in MANIFEST_JSON["extract_for"].items():
+            project_code = project_json["settings"]["project_code"][0]
+            future = executor.submit(fetch_project_versions, project_code, catalogue.get(project_code), project_json["settings"].get("sprint_board_ids", []), sprint_cache)
+            futures[future] = project
+
+        for future in as_completed(futures):
+            project = futures[future]
+            settings = MANIFEST_JSON["extract_for"][project]["settings"]
+            project_code = settings["project_code"][0]
+            try:
+                status, versions, etag = future.result()
+                store_versions(project_code, status, versions, etag)
+            except Exception as e:
+                log.error("unable to collect the versions of project: {0}, error received: {1}".format(project, e))
+                if project_code not in catalogue:
+                    continue
+                status, versions = "stored", catalogue[project_code][2]
+            instrumentation.count("version_catalogue." + status)
+
+            version_tasks = []
+            for version_name in filter_versions(versions, settings["regex_version"]):
+                version_tasks.append({"version_name": version_name, "project_code": settings["project_code"], "manifest_project_name": project,
+                                      "special_filters": settings["special_filters"], "watermark": watermarks.get((project, version_name))})
+                # version task: {'version_name': 'name_here', 'project_code': ['project_code'], 'manifest_project_name': 'Project name', 'special_filters': ['issuetype in standardIssueTypes()'], 'watermark': '2001-01-01T01:01:00+0000'}
+            log.info("for project: {0} with regex: {1} we have {2} versions of {3} ({4} catalogue)".format(project, settings["regex_version"], len(version_tasks),
+                                                                                                      len(versions), status))
+            print("### Finish Versions for project: {0} ###".format(project))
+            yield project, version_tasks
 
-def collect_version_issues(jira_connector, project_name, special_filters, version_name):
+
+def collect_version_issues(jira_connector, project_name, special_filters, version_name, manifest_project_name="", watermark=None, start_at=0, end_at=None, chunk=(0, 1),
+                           task=None):
     """
         Description: Extact from Jira instance all issues under a version to be stored into the database
+        If a watermark (last stored updated date) is provided, only the issues updated since the watermark (minus the safety overlap) are extracted
+        Big versions are split in chunks (see split_version_tasks): only the issues from start_at up to end_at (None: until the end) are extracted
+        With the task of the run, its checkpoint is queued after the records of every page and when the task is done
+    """
+
+    base_url = build_version_jql(project_name, special_filters, version_name, watermark)
+    log.debug("Collect version issues for JQL: %s", base_url)
+    number_of_issues = 0
+    # a resumed or retried task goes on from the latest updated date of the pages already committed
+    max_updated = None if task is None else task.get("max_updated")
+    # each page is handed to the writer before the next one is requested, memory use does not depend on the version size
+    for jira_array in iterate_issue_pages(jira_connector, base_url, ISSUE_PAGE_SIZE, MAPPED_FIELDS, start_at, end_at):
+        number_of_issues += len(jira_array)
+        instrumentation.gauge("queue.write_depth", instrumentation.queue_size(writeQueue))
+        page_updated = store_issue_in_db(jira_connector, jira_array)
+        if (CHANGELOG):
+            collect_changelogs(jira_connector, [issue.raw for issue in jira_array])
+        if (page_updated is not None and (max_updated is None or page_updated > max_updated)):
+            max_updated = page_updated
+        if (task is not None):
+            task["start_at"] = start_at + number_of_issues
+            task["max_updated"] = max_updated
+            writeQueue.put(checkpoint_record(task, "in_progress"))
+    log.info("version: {0} has {1} issues".format(version_name, number_of_issues))
+
+    # the writer stores the new watermark after the issues queued before it, once all chunks of the version are done
+    writeQueue.put({"watermark": (manifest_project_name, version_name, max_updated), "chunk": chunk})
+    if (task is not None):
+        writeQueue.put(checkpoint_record(task, "done"))
+
+
+def build_version_jql(project_name, special_filters, version_name, watermark=None):
+    """
+        Description: Build the JQL used to extract all issues under a version, restricted to the issues updated since the watermark if one is provided
     """
 
     _filter = " AND ".join(special_filters)
@@ -155,221 +571,865 @@ def collect_version_issues(jira_connector, project_name, special_filters, versio
             base_url = "project =  " + project_name[0] + " AND " + _filter + " AND fixVersion = \"" + version_name + "\""
         else:
             base_url = "project in (" + ','.join(project_name) + ") AND " + _filter + " AND fixVersion = \"" + version_name + "\""
-        log.debug("Collect version issues for URL: {0}".format(base_url))
+        log.debug("Collect version issues for URL: %s", base_url)
+    if (watermark is not None):
+        base_url = base_url + " AND updated >= \"" + watermark_to_jql(watermark) + "\""
     
-    print("base_url: {0}".format(base_url))
-    jira_array = []
-    jira_array = jira_connector.search_issues(jql_str=base_url, maxResults=None)
-    log.info("version: {0} has {1} issues".format(version_name, len(jira_array)))
+    return base_url
+
+
+def iterate_issue_pages(jira_connector, jql, page_size, fields, start_at=0, end_at=None):
+    """
+        Description: Generator that yields the issues matching the JQL one page (list of at most page_size issues) at a time, from start_at up to end_at (None: until the end)
+    """
+
+    while (end_at is None or start_at < end_at):
+        max_results = page_size if end_at is None else min(page_size, end_at - start_at)
+        request_started = time.monotonic()
+        try:
+            jira_array = jira_connector.search_issues(jql_str=jql + " ORDER BY key ASC", startAt=start_at, maxResults=max_results, fields=fields)
+        except JIRAError:
+            record_request(request_started, True)
+            raise
+        record_request(request_started)
+        log.debug("Collected %s issues starting at: %s of %s for: %s", len(jira_array), start_at, jira_array.total, jql)
+        if len(jira_array) == 0:
+            break
+        yield jira_array
+        start_at += len(jira_array)
+        if start_at >= jira_array.total:
+            break
+
+
+def split_version_tasks(jira_connector, version_tasks):
+    """
+        Description: Size every version with a total count search (maxResults=0) and split the versions bigger than TASK_CHUNK_SIZE issues in page range tasks
+        The tasks are returned largest first, the long ones start early and idle workers take the remaining chunks from the shared queue
+    """
 
-    store_issue_in_db(jira_connector, jira_array)
+    tasks = []
+    for version in version_tasks:
+        jql = build_version_jql(version["project_code"], version["special_filters"], version["version_name"], version["watermark"])
+        request_started = time.monotonic()
+        try:
+            total = jira_connector.search_issues(jql_str=jql, maxResults=0, fields="key", json_result=True)["total"]
+            record_request(request_started)
+        except JIRAError as je:
+            record_request(request_started, True)
+            # unknown size, the whole version is extracted by one worker
+            log.error("unable to size version: {0}, error received: {1}".format(version["version_name"], je))
+            total = TASK_CHUNK_SIZE
+
+        chunk_count = max(1, (total + TASK_CHUNK_SIZE - 1) // TASK_CHUNK_SIZE)
+        for index in range(chunk_count):
+            task = dict(version)
+            task["start_at"] = index * TASK_CHUNK_SIZE
+            # the last chunk runs until the end, in case issues were added since the count
+            task["end_at"] = None if index == chunk_count - 1 else (index + 1) * TASK_CHUNK_SIZE
+            task["chunk"] = (index, chunk_count)
+            task["size"] = min(TASK_CHUNK_SIZE, total - index * TASK_CHUNK_SIZE)
+            tasks.append(task)
+        log.info("version: {0} has {1} issues, split in {2} tasks".format(version["version_name"], total, chunk_count))
+
+    tasks.sort(key=lambda task: task["size"], reverse=True)
+    return tasks
+
+
+def task_key(task):
+    # a task is identified in its run by its manifest project, version and chunk
+    return json.dumps([task["manifest_project_name"], task["version_name"]] + list(task["chunk"]))
+
+
+def checkpoint_record(task, status, attempts=0, error=None):
+    """
+        Description: Write queue record of the state of a run task (pending, in_progress, done or failed), committed by the writer in the same transaction
+        as the records queued before it: the task start_at is the first issue not queued yet and its max_updated the latest updated date queued by the task
+        attempts is added to the attempts stored for the task
+    """
+
+    return {"checkpoint": (task["run_id"], task_key(task), json.dumps(task), status, attempts, task.get("start_at", 0), task.get("max_updated"), error,
+                           datetime.now().isoformat(timespec="seconds"))}
+
+
+def store_checkpoints(checkpoint_list):
+    """
+        Description: Store the checkpoint records of the run tasks, the pending record queued by the main process never overwrites the progress of a worker
+    """
+
+    if (DB_CONNECTION is not None):
+        DB_CONNECTION.executemany("INSERT INTO run_task(run_id, task_key, task, status, attempts, next_start_at, max_updated, error, updated_at) values(?,?,?,?,?,?,?,?,?) "
+                                  "ON CONFLICT(run_id, task_key) DO UPDATE SET task=excluded.task, status=excluded.status, attempts=run_task.attempts + excluded.attempts, "
+                                  "next_start_at=excluded.next_start_at, max_updated=excluded.max_updated, error=excluded.error, updated_at=excluded.updated_at "
+                                  "WHERE excluded.status <> 'pending'", checkpoint_list)
+    else:
+        log.error("unable to store checkpoints: {0}".format(checkpoint_list))
+
+
+def start_run():
+    """
+        Description: Start the extraction run (RUN_ID): with RESUME the last run if it did not complete, otherwise a new run
+        Returns True when an interrupted run is resumed
+    """
+
+    global RUN_ID
+
+    now = datetime.now().isoformat(timespec="seconds")
+    if (RESUME):
+        row = DB_CONNECTION.execute("Select id, status from extraction_run order by id desc limit 1").fetchone()
+        if (row is not None and row[1] != "completed"):
+            RUN_ID = row[0]
+            with DB_CONNECTION:
+                DB_CONNECTION.execute("UPDATE extraction_run set status='running', finished_at=NULL where id=?", (RUN_ID,))
+            log.info("Resume extraction run {0}".format(RUN_ID))
+            print("Resume extraction run {0}".format(RUN_ID))
+            return True
+        log.warning("No interrupted extraction run to resume, a new run is started")
+    with DB_CONNECTION:
+        RUN_ID = DB_CONNECTION.execute("INSERT INTO extraction_run(started_at, status) values(?, 'running')", (now,)).lastrowid
+    log.info("Extraction run {0} started".format(RUN_ID))
+    return False
+
+
+def load_run_tasks(run_id):
+    """
+        Description: Return the tasks of a run that are not done, set to continue from their checkpoint, and the {(manifest project name, version name)}
+        versions the run created tasks for (skipped by the version discovery of the resumed run)
+    """
+
+    tasks = []
+    versions = set()
+    for connection in data_connections():
+        for task_json, status, next_start_at, max_updated in connection.execute("Select task, status, next_start_at, max_updated from run_task where run_id = ?",
+                                                                                (run_id,)):
+            task = json.loads(task_json)
+            versions.add((task["manifest_project_name"], task["version_name"]))
+            if (status != "done"):
+                task["start_at"] = next_start_at
+                task["max_updated"] = max_updated
+                task["chunk"] = tuple(task["chunk"])
+                tasks.append(task)
+    log.info("Run {0}: {1} tasks of {2} versions to continue".format(run_id, len(tasks), len(versions)))
+    return tasks, versions
+
+
+def register_task(task):
+    """
+        Description: Add a new task to the run, its pending checkpoint is queued to the writer of its data before the task is extracted
+    """
+
+    task["run_id"] = RUN_ID
+    task.setdefault("chunk", (0, 1))
+    task_write_queue(task, writeQueue).put(checkpoint_record(task, "pending"))
+    return task
+
+
+def done_chunk_records(run_id):
+    """
+        Description: Writer of a resumed run: watermark records of the chunks done by the interrupted run, their versions complete once the remaining chunks are done
+    """
+
+    records = []
+    for task_json, max_updated in DB_CONNECTION.execute("Select task, max_updated from run_task where run_id = ? and status = 'done'", (run_id,)):
+        task = json.loads(task_json)
+        records.append({"watermark": (task["manifest_project_name"], task["version_name"], max_updated), "chunk": tuple(task["chunk"])})
+    return records
+
+
+def finish_run():
+    """
+        Description: Record the end of the run: completed when all its tasks are done, incomplete otherwise (continued by main.py --resume)
+    """
+
+    statuses = {}
+    for connection in data_connections():
+        for status, count in connection.execute("Select status, count(*) from run_task where run_id = ? group by status", (RUN_ID,)):
+            statuses[status] = statuses.get(status, 0) + count
+    unfinished = sum(count for status, count in statuses.items() if status != "done")
+    status = "completed" if unfinished == 0 else "incomplete"
+    with DB_CONNECTION:
+        DB_CONNECTION.execute("UPDATE extraction_run set finished_at=?, status=? where id=?", (datetime.now().isoformat(timespec="seconds"), status, RUN_ID))
+    instrumentation.count("run.tasks_unfinished", unfinished)
+    log.info("Extraction run {0} {1}, tasks: {2}".format(RUN_ID, status, statuses))
+    if (unfinished > 0):
+        print("Extraction run {0} incomplete, {1} tasks not done ({2}): continue it with python3 main.py --resume".format(RUN_ID, unfinished, statuses))
+
+
+def mapped_jira_fields():
+    """
+        Description: Return the jira fields used by the fields JSON mapper (plus the updated date used for the watermarks) as a comma separated string for the search fields parameter
+    """
+
+    fields = ["updated"]
+    for value in FIELDS_JSON_DICT.values():
+        element_list = value.split(".")
+        if (len(element_list) > 1 and element_list[0] == "fields"):
+            field = element_list[1]
+            if field[-2:] == "[]":
+                field = field[:-2]
+            if field not in fields:
+                fields.append(field)
+    return ",".join(fields)
+
+
+def parse_jira_date(value):
+    """
+        Description: Convert a jira date time ('2001-01-01T01:01:00.000+0000') to a UTC datetime, None if the value can not be parsed
+    """
+
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%z").astimezone(timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def issue_updated(issue_dict):
+    """
+        Description: Return the updated date of a jira issue in the watermark format, None if it is missing
+    """
+
+    updated = parse_jira_date(issue_dict.get("fields", {}).get("updated"))
+    if (updated is None):
+        return None
+    return updated.strftime(WATERMARK_FORMAT)
+
+
+def watermark_to_jql(watermark):
+    """
+        Description: Convert a stored watermark to the JQL date format, moved back by WATERMARK_OVERLAP_MINUTES
+        JQL dates are interpreted in the timezone of the jira user, the overlap also covers the timezone difference
+    """
+
+    value = datetime.strptime(watermark, WATERMARK_FORMAT) - timedelta(minutes=WATERMARK_OVERLAP_MINUTES)
+    return value.strftime("%Y/%m/%d %H:%M")
+
+
+def load_watermarks():
+    """
+        Description: Return the stored watermarks as a dictionary {(manifest project name, version name): updated date}
+    """
+
+    watermarks = {}
+    if (DB_CONNECTION is not None):
+        for connection in data_connections():
+            for row in connection.execute("Select project, version, updated_date from sync_watermark"):
+                watermarks[(row[0], row[1])] = row[2]
+        log.info("Loaded {0} watermarks".format(len(watermarks)))
+    else:
+        log.error("unable to load watermarks, no database connection")
+    return watermarks
+
+
+def complete_watermarks(watermark_records):
+    """
+        Description: Collect the watermark records of the version chunks, return the (manifest project name, version name, updated date) watermarks of the versions with all chunks done
+    """
+
+    watermark_list = []
+    for record in watermark_records:
+        project, version_name, max_updated = record["watermark"]
+        if (project, version_name) in blocked_versions:
+            continue
+        index, chunk_count = record.get("chunk", (0, 1))
+        pending = pending_watermarks.setdefault((project, version_name), {"chunks": set(), "updated": None})
+        pending["chunks"].add(index)
+        if (max_updated is not None and (pending["updated"] is None or max_updated > pending["updated"])):
+            pending["updated"] = max_updated
+        if len(pending["chunks"]) == chunk_count:
+            del pending_watermarks[(project, version_name)]
+            if (pending["updated"] is not None):
+                watermark_list.append((project, version_name, pending["updated"]))
+    return watermark_list
+
+
+def store_watermarks(watermark_list):
+    """
+        Description: Store the (manifest project name, version name, updated date) watermarks, a watermark never moves backwards
+    """
+
+    if (DB_CONNECTION is not None):
+        cur = DB_CONNECTION.cursor()
+        cur.executemany("INSERT INTO sync_watermark (project, version, updated_date) values(?,?,?) "
+                        "ON CONFLICT(project, version) DO UPDATE SET updated_date=excluded.updated_date WHERE excluded.updated_date > sync_watermark.updated_date", watermark_list)
+        log.info("Stored watermarks: {0}".format(watermark_list))
+    else:
+        log.error("unable to store watermarks: {0}".format(watermark_list))
 
 
 def store_issue_in_db(jira_connector, jira_array):
     """
-        Description: Prepare to store issue data based on jira extracted information and filtered based on the fields mentioned in the fields JSON file 
+        Description: Prepare issue data based on jira extracted information and filtered based on the fields mentioned in the fields JSON file.
+        The prepared record is handed over to the writer process, workers never write to the database
+        Returns the latest updated date (watermark format) of the issues, None if there are no issues
     """
 
     issue_dict = {}
+    max_updated = None
     for issue in jira_array:
         issue_dict = issue.raw
-            
+
         #Extract value for all necessary fields, and add it to issue dictionary to be stored in the database
-        log.info("Raw issue value: {0}".format(issue_dict))
-        for key, value in FIELDS_JSON_DICT.items():
-            issues_populated_dict[key] = getJiraValue(jira_connector, issue_dict, value.split("."), key)
+        log_payload = payload_sampled()
+        if (log_payload):
+            log.debug("Raw issue value: %s", LogPayload(issue_dict))
+        map_started = time.perf_counter()
+        issues_populated_dict = map_issue(issue_dict)
+        instrumentation.observe("map", time.perf_counter() - map_started)
+        instrumentation.count("map.issues")
+
+        if (log_payload):
+            log.debug("Finihs compiling the issue dictionary with the following values: %s, this will be stored to database", LogPayload(issues_populated_dict))
 
-        log.info("Finihs compiling the issue dictionary with the following values: {0}, this will be stored to database".format(issues_populated_dict))
+        sprints = fetch_sprint_data(jira_connector, issues_populated_dict["sprints"])
+        with instrumentation.timed("encode"):
+            record = build_issue_record(issues_populated_dict, issue_dict, sprints)
+        # time spent waiting for room in the bounded write queue (writer slower than the workers)
+        with instrumentation.timed("queue.put_wait"):
+            writeQueue.put(record)
 
-        store_issue_and_additional_tables_data(jira_connector, issues_populated_dict, issue_dict)
-        
+        updated = issue_updated(issue_dict)
+        if (updated is not None and (max_updated is None or updated > max_updated)):
+            max_updated = updated
 
-def store_issue_and_additional_tables_data(jira_connector, populated_dict, issue_dict):
+    return max_updated
+
+
+def load_changelog_state():
     """
-        Description: Store issue data into the database
+        Description: Return {issue key: issue updated date} of the issues whose changelog is stored
     """
 
+    state = {}
     if (DB_CONNECTION is not None):
-        log.info("ready to store in database issue id :{0}".format(populated_dict["key"]))
-        cur = DB_CONNECTION.cursor()
-        cur.execute("Select id from issue where key = ?", (populated_dict["key"],))
-        rows = cur.fetchall()
-        
+        for connection in data_connections():
+            state.update(connection.execute("Select key, changelog_updated from issue where changelog_updated is not null"))
+        log.info("Loaded the changelog state of {0} issues".format(len(state)))
+    else:
+        log.error("unable to load the changelog state, no database connection")
+    return state
+
+
+def changelog_needed(issues):
+    """
+        Description: Return the keys of the issues (raw jira dictionaries) updated since their changelog was stored
+    """
+
+    return [issue_dict["key"] for issue_dict in issues if CHANGELOG_STATE.get(issue_dict["key"]) != issue_updated(issue_dict)]
+
+
+def changelog_jql(keys):
+    return "key in (" + ",".join(keys) + ")"
+
+
+def parse_transitions(histories):
+    """
+        Description: Return the status transitions [(from status name, to status name, date)] of changelog histories, the other field changes are dropped
+        History: {'id': '1', 'created': '2001-01-01T01:01:00.000+0000', 'items': [{'field': 'status', 'fieldtype': 'jira', 'from': '1', 'fromString': 'Open', 'to': '3', 'toString': 'In Progress'}]}
+    """
+
+    transitions = []
+    for history in histories:
+        for item in history.get("items", []):
+            if item.get("field") == "status":
+                transitions.append((item.get("fromString") or "", item.get("toString") or "", history.get("created")))
+    return transitions
+
+
+def embedded_transitions(issue_dict):
+    """
+        Description: Return the status transitions of the changelog embedded in a search result (expand=changelog)
+        None when the embedded changelog is truncated (jira cloud embeds at most 100 histories), the changelog is then paged with CHANGELOG_PATH
+    """
+
+    changelog = issue_dict.get("changelog", {})
+    histories = changelog.get("histories", [])
+    if changelog.get("total", len(histories)) > len(histories):
+        return None
+    return parse_transitions(histories)
+
+
+def collect_changelogs(jira_connector, issues):
+    """
+        Description: Fetch the changelogs of the page issues updated since their changelog was stored, with one search (expand=changelog) for the page,
+        and queue their status transitions for the writer. Only the transitions of the current page are kept in memory, the histories are dropped once parsed
+    """
+
+    keys = changelog_needed(issues)
+    if len(keys) == 0:
+        return
+
+    request_started = time.monotonic()
+    try:
+        result = jira_connector.search_issues(jql_str=changelog_jql(keys), maxResults=len(keys), fields="updated", expand="changelog", json_result=True)
+    except JIRAError as je:
+        record_request(request_started, True)
+        log.error("unable to collect the changelog of issues: {0}, error received: {1}".format(keys, je))
+        return
+    record_request(request_started)
+
+    for issue_dict in result["issues"]:
+        transitions = embedded_transitions(issue_dict)
+        try:
+            if transitions is None:
+                transitions = page_changelog(jira_connector, issue_dict["key"])
+        except JIRAError as je:
+            # the changelog stays unknown and is requested again by the next run
+            log.error("unable to page the changelog of issue: {0}, error received: {1}".format(issue_dict["key"], je))
+            continue
+        writeQueue.put({"transitions": (issue_dict["key"], issue_updated(issue_dict), transitions)})
+        # an issue found in several versions is requested once per process
+        CHANGELOG_STATE[issue_dict["key"]] = issue_updated(issue_dict)
+
+
+def page_changelog(jira_connector, key):
+    """
+        Description: Return the status transitions of the whole changelog of an issue, requested CHANGELOG_PAGE_SIZE histories at a time
+    """
+
+    transitions = []
+    start_at = 0
+    while True:
+        request_started = time.monotonic()
+        try:
+            page = jira_connector._get_json(CHANGELOG_PATH.format(key), params={"startAt": start_at, "maxResults": CHANGELOG_PAGE_SIZE})
+        except JIRAError:
+            record_request(request_started, True, "changelog")
+            raise
+        record_request(request_started, endpoint="changelog")
+        values = page.get("values", [])
+        transitions += parse_transitions(values)
+        start_at += len(values)
+        if len(values) == 0 or page.get("isLast", True) or start_at >= page.get("total", 0):
+            return transitions
+
+
+def build_issue_record(populated_dict, issue_dict, sprints):
+    """
+        Description: Record handed over to the writer process for an issue, the raw payload is encoded here so that the writer only writes
+    """
+
+    record = {}
+    record["populated"] = populated_dict
+    record["raw_value"], record["raw_hash"] = encode_raw_payload(issue_dict)
+    record["content_hash"] = content_hash(populated_dict, record["raw_hash"])
+    record["sprints"] = sprints
+    return record
+
+
+def content_hash(populated_dict, raw_hash):
+    """
+        Description: Hash of the mapped fields of an issue, its link sets (sprints, fix versions, affects versions, in any order) and its raw payload hash
+        The writer skips an issue whose content hash is the one already stored
+    """
+
+    content = dict(populated_dict)
+    for field in LINK_FIELDS:
+        content[field] = sorted(set(split_csv(content[field])))
+    content["raw_hash"] = raw_hash
+    return hashlib.sha1(json.dumps(content, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def encode_raw_payload(issue_dict):
+    """
+        Description: Encode the raw issue payload with the RAW_STORAGE format, returns (stored value, payload hash), (None, None) when raw storage is off
+        The hash is computed on the canonical JSON (sorted keys, no spaces), an unchanged issue always gets the same hash
+    """
+
+    if (RAW_STORAGE == "off"):
+        return None, None
+    if (len(RAW_STORAGE_KEYS) > 0):
+        issue_dict = select_raw_keys(issue_dict, RAW_STORAGE_KEYS)
+    if (RAW_STORAGE == "repr"):
+        text = str(issue_dict)
+    else:
+        text = json.dumps(issue_dict, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    data = text.encode("utf-8")
+    raw_hash = hashlib.sha1(data).hexdigest()
+    if (RAW_STORAGE == "compressed"):
+        return zlib.compress(data, RAW_COMPRESSION_LEVEL), raw_hash
+    return text, raw_hash
+
+
+def decode_raw_payload(value):
+    """
+        Description: Return the issue dictionary of a stored raw payload (compressed, json or repr format), None if no payload is stored
+    """
+
+    if (value is None):
+        return None
+    if (isinstance(value, bytes)):
+        value = zlib.decompress(value).decode("utf-8")
+    try:
+        return json.loads(value)
+    except ValueError:
+        return ast.literal_eval(value)
+
+
+def select_raw_keys(issue_dict, keys):
+    """
+        Description: Keep only the listed keys of an issue payload, a dotted key ("fields.status") keeps the nested value. Missing keys are ignored
+    """
+
+    selected = {}
+    for key in keys:
+        path = key.split(".")
+        value = issue_dict
+        for item in path:
+            if not isinstance(value, dict) or item not in value:
+                break
+            value = value[item]
+        else:
+            target = selected
+            for item in path[:-1]:
+                target = target.setdefault(item, {})
+            target[path[-1]] = value
+    return selected
+
+
+def store_issues_bulk(batch):
+    """
+        Description: Store a page of issue records (as prepared by store_issue_in_db) with bulk upserts: sprints, issues and the issue_sprints, issue_fix_version and issue_affects_version relations
+        Each table is written with a single executemany, the db ids are collected afterwards with one keyed select per table
+        Issues whose content hash matches the stored one are not written at all (always written with FULL_RESYNC), the links of updated issues are replaced
+        An issue with a link that could not be resolved (failed sprint lookup, unknown version) is stored without content hash, the next run writes it again
+    """
+
+    if (DB_CONNECTION is None):
+        log.error("unable to store a batch of {0} issues".format(len(batch)))
+        return
+
+    cur = DB_CONNECTION.cursor()
+
+    #sprints, unique by jira sprint id
+    sprint_rows = {}
+    for record in batch:
+        for sprint_dict in record["sprints"]:
+            sprint_rows[str(sprint_dict["id"])] = (str(sprint_dict["id"]), sprint_dict["name"], sprint_dict["sequence"], sprint_dict["state"], sprint_dict["goal"],
+                                                   sprint_dict["startDate"], sprint_dict["endDate"], sprint_dict["completeDate"])
+    sprint_columns = ["sprint_id", "name", "sequence", "state", "goal", "start_date", "end_date", "complete_date"]
+    if (REGISTRY_CONNECTION is not None):
+        # sharded storage: a sprint has the same (registry) id in every shard
+        global_ids = registry_ids("sprint", "sprint_id", list(sprint_rows.keys()))
+        sprint_columns = ["id"] + sprint_columns
+        sprint_rows = {sprint_id: (global_ids[sprint_id],) + row for sprint_id, row in sprint_rows.items()}
+    cur.executemany("INSERT INTO sprint(" + ", ".join(sprint_columns) + ") values(" + ",".join(["?"] * len(sprint_columns)) + ") "
+                    "ON CONFLICT(sprint_id) DO UPDATE SET name=excluded.name, sequence=excluded.sequence, state=excluded.state, goal=excluded.goal, "
+                    "start_date=excluded.start_date, end_date=excluded.end_date, complete_date=excluded.complete_date "
+                    "WHERE (sprint.name, sprint.sequence, sprint.state, sprint.goal, sprint.start_date, sprint.end_date, sprint.complete_date) IS NOT "
+                    "(excluded.name, excluded.sequence, excluded.state, excluded.goal, excluded.start_date, excluded.end_date, excluded.complete_date)", list(sprint_rows.values()))
+    sprint_db_ids = select_ids_by(cur, "sprint", "sprint_id", list(sprint_rows.keys()))
+    instrumentation.count("db.rows.sprint", len(sprint_rows))
+    log.info("Upserted {0} sprints".format(len(sprint_rows)))
+
+    #skip the issues stored with the same content hash, an issue found twice in the batch (several versions) is written once
+    stored_hashes = select_ids_by(cur, "issue", "key", list(set(record["populated"]["key"] for record in batch)), "content_hash")
+    changed_batch = []
+    updated_keys = set()
+    for record in batch:
+        key = record["populated"]["key"]
+        if key not in stored_hashes:
+            ISSUE_WRITE_STATS["inserted"] += 1
+        elif not FULL_RESYNC and stored_hashes[key] == record["content_hash"]:
+            ISSUE_WRITE_STATS["unchanged"] += 1
+            continue
+        else:
+            ISSUE_WRITE_STATS["updated"] += 1
+            updated_keys.add(key)
+        stored_hashes[key] = record["content_hash"]
+        changed_batch.append(record)
+    log.info("{0} of {1} issues changed".format(len(changed_batch), len(batch)))
+    if len(changed_batch) == 0:
+        return
+    batch = changed_batch
+
+    #the daily snapshot loses the previous contribution of the updated issues, the new one is added once the issues and links are stored
+    update_daily_snapshot(cur, list(select_ids_by(cur, "issue", "key", list(updated_keys)).values()), -1)
+
+    version_names = set()
+    for record in batch:
+        version_names.update(split_csv(record["populated"]["fix_version"]))
+        version_names.update(split_csv(record["populated"]["affects_version"]))
+    version_db_ids = lookup_version_ids(cur, list(version_names))
+
+    #the content hash only stands for the mapped links when all of them are stored
+    for record in batch:
+        populated_dict = record["populated"]
+        missing_sprints = set(split_csv(populated_dict["sprints"])) - set(str(sprint_dict["id"]) for sprint_dict in record["sprints"])
+        missing_versions = [name for field in ("fix_version", "affects_version") for name in split_csv(populated_dict[field]) if name not in version_db_ids]
+        if len(missing_sprints) > 0 or len(missing_versions) > 0:
+            record["content_hash"] = None
+            instrumentation.count("db.issues.unresolved_links")
+
+    #issues, unique by key
+    issue_rows = []
+    for record in batch:
+        populated_dict = record["populated"]
         project_id = store_project(populated_dict["project_code"])
         resolution_id = store_resolution(populated_dict["resolution"])
         status_id = store_status(populated_dict["status"])
         type_id = store_type(populated_dict["type"])
-        if (len(rows) == 0 ):
-            #create issue
-            cur.execute("INSERT INTO issue(key, summary, epic_name, labels,creation_date,resolution_date,updated_date,start_date,due_date,priority,assignee,reporter,components,epic_link,story_points,tshirt_size,linked_theme, resolution_id, status_id, type_id, project_id, raw_value) values(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
-             (populated_dict["key"],populated_dict["summary"],populated_dict["epic_name"],populated_dict["labels"],populated_dict["created_date"],populated_dict["resolution_date"],\
-                 populated_dict["updated_date"],populated_dict["start_date"],populated_dict["due_date"],populated_dict["priority"],populated_dict["assignee"],populated_dict["reporter"],populated_dict["components"],populated_dict["epic_links"],\
-                     populated_dict["story_points"],populated_dict["tshirt_size"],populated_dict["linked_theme"],\
-                         resolution_id,status_id,type_id,project_id,str(issue_dict)))
-            DB_CONNECTION.commit()
-            id_value = cur.lastrowid
-            log.info("A new issue successfully created {0}".format(cur.lastrowid))
-        else:
-            #update issue
-            cur.execute("UPDATE issue set summary=?, epic_name=?, labels=?, creation_date=?, resolution_date=?, updated_date=?, start_date=?, due_date=?, priority=?, assignee=?, reporter=?, components=?, epic_link=?, story_points=?, tshirt_size=?, linked_theme=?, resolution_id=?, status_id=?, type_id=?, project_id=?, raw_value=? WHERE key = ?",
-             (populated_dict["summary"],populated_dict["epic_name"],populated_dict["labels"],populated_dict["created_date"],populated_dict["resolution_date"],\
-                 populated_dict["updated_date"],populated_dict["start_date"],populated_dict["due_date"],populated_dict["priority"],populated_dict["assignee"],populated_dict["reporter"],populated_dict["components"],populated_dict["epic_links"],\
-                     populated_dict["story_points"],populated_dict["tshirt_size"],populated_dict["linked_theme"],\
-                         resolution_id,status_id,type_id,project_id,str(issue_dict),populated_dict["key"]))
-            DB_CONNECTION.commit()            
-            
-            cur.execute("Select id from issue where key = ?", (populated_dict["key"],))
-            rows = cur.fetchall()
-            id_value = rows[0][0]
-            log.info("An updated issue successfully for issue db id: {0} with key: {1}".format(id_value, populated_dict["key"]))
-        
-        #create issue_sprint records based on array populated_dict["sprints"] and returned issue db id
-        store_issue_sprints(id_value, populated_dict["sprints"])
-        store_issue_fix_version(id_value, populated_dict["fix_version"])
-        store_issue_affects_version(id_value, populated_dict["affects_version"])
+        # with the side table issue.raw_value is emptied, it may still hold a payload stored by a previous version
+        raw_columns = (record["raw_value"], record["raw_hash"]) if RAW_STORAGE_TABLE == "issue" else (None, None)
+        issue_rows.append(tuple(populated_dict[field] for column, field in ISSUE_FIELD_COLUMNS) + (resolution_id, status_id, type_id, project_id) + raw_columns + (record["content_hash"],))
+    columns = [column for column, field in ISSUE_FIELD_COLUMNS] + ["resolution_id", "status_id", "type_id", "project_id", "raw_value", "raw_hash", "content_hash"]
+    cur.executemany("INSERT INTO issue(" + ", ".join(columns) + ") values(" + ",".join(["?"] * len(columns)) + ") "
+                    "ON CONFLICT(key) DO UPDATE SET " + ", ".join(column + "=excluded." + column for column in columns[1:]), issue_rows)
+    issue_db_ids = select_ids_by(cur, "issue", "key", [record["populated"]["key"] for record in batch])
+    instrumentation.count("db.rows.issue", len(issue_rows))
+    log.info("Upserted {0} issues".format(len(issue_rows)))
+
+    #raw payloads in the side table, a payload is only rewritten when its hash changed
+    if (RAW_STORAGE_TABLE == "issue_raw" and RAW_STORAGE != "off"):
+        raw_rows = [(issue_db_ids[record["populated"]["key"]], record["raw_hash"], record["raw_value"]) for record in batch]
+        cur.executemany("INSERT INTO issue_raw(issue_id, raw_hash, raw_value) values(?,?,?) "
+                        "ON CONFLICT(issue_id) DO UPDATE SET raw_hash=excluded.raw_hash, raw_value=excluded.raw_value WHERE issue_raw.raw_hash IS NOT excluded.raw_hash", raw_rows)
+        instrumentation.count("db.rows.issue_raw", len(raw_rows))
+
+    #issue relations, the links of the changed issues are replaced by the current link sets
+    issue_ids = [issue_db_ids[key] for key in updated_keys]
+    for table in ("issue_sprints", "issue_fix_version", "issue_affects_version"):
+        for index in range(0, len(issue_ids), SQL_CHUNK_SIZE):
+            chunk = issue_ids[index:index + SQL_CHUNK_SIZE]
+            cur.execute("DELETE FROM " + table + " where issue_id in (" + ",".join(["?"] * len(chunk)) + ")", chunk)
+
+    issue_sprint_rows = []
+    fix_version_rows = []
+    affects_version_rows = []
+    for record in batch:
+        issue_id = issue_db_ids[record["populated"]["key"]]
+        record["populated"]["sprints"] = ",".join(str(sprint_db_ids[str(sprint_dict["id"])]) for sprint_dict in record["sprints"])
+        for sprint_dict in record["sprints"]:
+            issue_sprint_rows.append((issue_id, sprint_db_ids[str(sprint_dict["id"])]))
+        for relation_rows, field in ((fix_version_rows, "fix_version"), (affects_version_rows, "affects_version")):
+            for name in split_csv(record["populated"][field]):
+                if name in version_db_ids:
+                    relation_rows.append((issue_id, version_db_ids[name]))
+                else:
+                    log.error("unable to locate version name: %s for issue: %s", name, record["populated"]["key"])
 
-    else:
-        log.error("unable to store issue with values:{0}".format(populated_dict))
+    cur.executemany("INSERT INTO issue_sprints (issue_id, sprint_id) values(?,?) ON CONFLICT DO NOTHING", issue_sprint_rows)
+    cur.executemany("INSERT INTO issue_fix_version (issue_id, version_id) values(?,?) ON CONFLICT DO NOTHING", fix_version_rows)
+    cur.executemany("INSERT INTO issue_affects_version (issue_id, version_id) values(?,?) ON CONFLICT DO NOTHING", affects_version_rows)
+    instrumentation.count("db.rows.issue_sprints", len(issue_sprint_rows))
+    instrumentation.count("db.rows.issue_fix_version", len(fix_version_rows))
+    instrumentation.count("db.rows.issue_affects_version", len(affects_version_rows))
+    log.info("Upserted {0} issue_sprints, {1} issue_fix_version and {2} issue_affects_version records".format(len(issue_sprint_rows), len(fix_version_rows), len(affects_version_rows)))
+
+    update_daily_snapshot(cur, list(set(issue_db_ids.values())), 1)
 
 
-def store_issue_sprints(value, sprint_list):
+def store_transitions(transition_list):
     """
-        Description: Store issue-sprint relation data into the database
+        Description: Replace the status transitions of the issues [(issue key, issue updated date, [(from status, to status, date)])], status names are resolved through the status table
+        issue.changelog_updated records the issue updated date the transitions belong to
     """
 
-    if (DB_CONNECTION is not None):
-        log.info("ready to store in database issue_sprints, issue id:{0} and sprint list: {1}".format(value, sprint_list))
-        if sprint_list != "":
-            for item in sprint_list.split(','):
-                cur = DB_CONNECTION.cursor()
-                cur.execute("Select * from issue_sprints where issue_id = ? and sprint_id=?", (value,item))
-                rows = cur.fetchall()
-                if (len(rows) == 0 ):
-                    #create issue_sprints
-                    cur.execute("INSERT INTO issue_sprints (issue_id, sprint_id) values(?,?)", (value,item))
-                    DB_CONNECTION.commit()
-                    id_value = cur.lastrowid
-                    log.info("A new record created for issue_sprints id:{0} for issue id: {1} and sprint id: {2}".format(id_value,value, item))
-                else:
-                    log.info("Already existins issue_sprint record with issue id: {0} and sprint id: {1}".format(value, item))
-        else:
-            log.info("Unable to add issue_sprint record with issue id: {0} and sprint id: {1}".format(value, sprint_list))
-    else:
-        log.error("unable to store issue_sprints with issue id: {0} and sprint: {1}".format(value, sprint_list))
+    if (DB_CONNECTION is None):
+        log.error("unable to store the transitions of {0} issues".format(len(transition_list)))
+        return
+    if len(transition_list) == 0:
+        return
+
+    cur = DB_CONNECTION.cursor()
+    # an issue found twice in the batch (several versions) keeps its latest changelog
+    changelogs = {key: (updated, transitions) for key, updated, transitions in transition_list}
+    issue_db_ids = select_ids_by(cur, "issue", "key", list(changelogs.keys()))
+    transition_rows = []
+    updated_rows = []
+    for key, (updated, transitions) in changelogs.items():
+        if key not in issue_db_ids:
+            log.error("unable to locate issue: %s for its transitions", key)
+            continue
+        issue_id = issue_db_ids[key]
+        updated_rows.append((updated, issue_id))
+        for from_status, to_status, transition_date in transitions:
+            transition_rows.append((issue_id, store_status(from_status) if from_status != "" else None, store_status(to_status), transition_date))
+
+    issue_ids = [issue_id for updated, issue_id in updated_rows]
+    for index in range(0, len(issue_ids), SQL_CHUNK_SIZE):
+        chunk = issue_ids[index:index + SQL_CHUNK_SIZE]
+        cur.execute("DELETE FROM issue_transition where issue_id in (" + ",".join(["?"] * len(chunk)) + ")", chunk)
+    cur.executemany("INSERT INTO issue_transition (issue_id, from_status_id, to_status_id, transition_date) values(?,?,?,?)", transition_rows)
+    cur.executemany("UPDATE issue set changelog_updated=? where id=?", updated_rows)
+    instrumentation.count("db.rows.issue_transition", len(transition_rows))
+    log.info("Stored {0} transitions of {1} issues".format(len(transition_rows), len(updated_rows)))
+
+
+def update_daily_snapshot(cur, issue_ids, sign):
+    """
+        Description: Add (sign 1) or remove (sign -1) the contribution of the issues to the daily_snapshot table, as stored in the issue and issue_fix_version tables
+        Only the (project, version, type, status, day) rows of these issues are touched
+    """
+
+    if len(issue_ids) == 0:
+        return
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS snapshot_issues (issue_id INTEGER PRIMARY KEY)")
+    cur.execute("DELETE FROM snapshot_issues")
+    cur.executemany("INSERT OR IGNORE INTO snapshot_issues(issue_id) values(?)", [(id,) for id in issue_ids])
+    cur.execute("INSERT INTO daily_snapshot(project_id, version_id, type_id, status_id, day, created, resolved) "
+                "Select project_id, version_id, type_id, status_id, day, ? * created, ? * resolved from (" + DAILY_SNAPSHOT_SELECT + ") where true "
+                "ON CONFLICT(project_id, version_id, type_id, status_id, day) DO UPDATE SET created=daily_snapshot.created + excluded.created, "
+                "resolved=daily_snapshot.resolved + excluded.resolved", (sign, sign))
+    instrumentation.count("db.rows.daily_snapshot", cur.rowcount)
 
 
-def store_issue_fix_version(id_sprint, version_csv):
+def rebuild_daily_snapshot(connection=None):
     """
-        Description: Store issue-fixversion relation data into the database
+        Description: Build the daily_snapshot table again from all issues of the database (of every shard with sharded storage), or of the given connection
+        (a database being migrated): a failed rebuild is raised so that the migration is not recorded as applied, main.py --rebuild-snapshot only logs it
     """
 
-    if (DB_CONNECTION is not None):
-        log.info("ready to store in database issue_fix_version, issue id:{0} and sprint list: {1}".format(id_sprint, version_csv))
-        if version_csv != "":
-            for item in version_csv.split(','):
-                cur = DB_CONNECTION.cursor()
-                cur.execute("Select id from version where name = ?", (item,))
-                rows = cur.fetchall()
-                if (len(rows) > 0):
-                    version_id = rows[0][0]
-                    cur = DB_CONNECTION.cursor()
-                    cur.execute("Select * from issue_fix_version where issue_id = ? and version_id=?", (id_sprint,version_id))
-                    rows = cur.fetchall()
-                    if (len(rows) == 0 ):
-                        #create issue_fix_version
-                        cur.execute("INSERT INTO issue_fix_version (issue_id, version_id) values(?,?)", (id_sprint,version_id))
-                        DB_CONNECTION.commit()
-                        id_value = cur.lastrowid
-                        log.info("A new record created for issue_fix_version with id{0} for issue id: {1} and version id: {2}".format(id_value, id_sprint, version_id))
-                    else:
-                        log.info("Already existins issue_fix_version record with issue id: {0} and version id: {1}".format(id_sprint, version_id))
-                else:
-                    log.error("unable to locate version name: {0} for sprint: {1}".format(item, id_sprint))
-        else:
-            log.info("Unable to add issue_fix_version record with issue id: {0} and versio name(s): {1}".format(id_sprint, version_csv))
-    else:
-        log.error("unable to add issue_fix_version record with issue id: {0} and versio name(s): {1}".format(id_sprint, version_csv))
+    if (connection is None and DB_CONNECTION is None):
+        log.error("unable to rebuild the daily snapshot, no connection")
+        return
 
+    for data_connection in (data_connections() if connection is None else [connection]):
+        try:
+            data_connection.execute("BEGIN IMMEDIATE")
+            cur = data_connection.cursor()
+            cur.execute("DELETE FROM daily_snapshot")
+            update_daily_snapshot(cur, [row[0] for row in cur.execute("Select id from issue").fetchall()], 1)
+            data_connection.commit()
+            log.info("Daily snapshot rebuilt with {0} rows".format(data_connection.execute("Select count(*) from daily_snapshot").fetchone()[0]))
+        except Error as er:
+            data_connection.rollback()
+            log.error("Unable to rebuild the daily snapshot, error received: {0}".format(er))
+            if (connection is not None):
+                raise
+
+
+def select_ids_by(cur, table, column, values, id_column="id"):
+    """
+        Description: Return a dictionary {column value: db id} (or id_column value) for all values, the values are queried in chunks to stay below the sqlite variable limit
+    """
 
-def store_issue_affects_version(id_sprint, version_csv):
+    ids = {}
+    for index in range(0, len(values), SQL_CHUNK_SIZE):
+        chunk = values[index:index + SQL_CHUNK_SIZE]
+        cur.execute("Select " + column + ", " + id_column + " from " + table + " where " + column + " in (" + ",".join(["?"] * len(chunk)) + ")", chunk)
+        for row in cur.fetchall():
+            ids[str(row[0])] = row[1]
+    return ids
+
+
+def split_csv(value):
     """
-        Description: Store issue-affectsversion relation data into the database
+        Description: Split a comma separated value as produced by map_issue, an empty string returns an empty list
     """
 
-    if (DB_CONNECTION is not None):
-        log.info("ready to store in database issue_affects_version, issue id:{0} and sprint list: {1}".format(id_sprint, version_csv))
-        if version_csv != "":
-            for item in version_csv.split(','):
-                cur = DB_CONNECTION.cursor()
-                cur.execute("Select id from version where name = ?", (item,))
-                rows = cur.fetchall()
-                if (len(rows) > 0):
-                    version_id = rows[0][0]                    
-                    cur = DB_CONNECTION.cursor()
-                    cur.execute("Select * from issue_affects_version where issue_id = ? and version_id=?", (id_sprint,version_id))
-                    rows = cur.fetchall()
-                    if (len(rows) == 0 ):
-                        #create issue_affects_version
-                        cur.execute("INSERT INTO issue_affects_version (issue_id, version_id) values(?,?)", (id_sprint,version_id))
-                        DB_CONNECTION.commit()
-                        id_value = cur.lastrowid
-                        log.info("A new record created for issue_affects_version with id{0} for issue id: {1} and version id: {2}".format(id_value, id_sprint, version_id))
-                    else:
-                        log.info("Already existins issue_affects_version record with issue id: {0} and version id: {1}".format(id_sprint, version_id))
-                else:
-                    log.error("unable to locate version name: {0} for sprint: {1}".format(item, id_sprint))
-        else:
-            log.info("Unable to add issue_affects_version record with issue id: {0} and versio name(s): {1}".format(id_sprint, version_csv))
-    else:
-        log.error("unable to add issue_affects_version record with issue id: {0} and versio name(s): {1}".format(id_sprint, version_csv))
+    if value == "" or value is None:
+        return []
+    return value.split(',')
 
 
-def store_project(value):
+def warm_dimension_cache():
     """
-        Description: Store project data into the database
+        Description: Load the project, resolution, status, type and version {name: db id} values from the database into the dimension cache
     """
 
-    if (DB_CONNECTION is not None):
-        log.info("ready to store in database project, code :{0}".format(value))
+    if (DB_CONNECTION is None):
+        log.error("unable to warm the dimension cache, no database connection")
+        return
+
+    cur = DB_CONNECTION.cursor()
+    for table, column in DIMENSION_COLUMNS.items():
+        cur.execute("Select " + column + ", id from " + table)
+        DIMENSION_CACHE[table] = {row[0]: row[1] for row in cur.fetchall()}
+        log.info("Dimension cache for {0} loaded with {1} values".format(table, len(DIMENSION_CACHE[table])))
+
+
+def store_dimension(table, value):
+    """
+        Description: Return the db id of a project, resolution, status or type value, the value is created if it does not exist yet
+        Known values are served from the dimension cache, only cache misses reach the database
+    """
+
+    cache = DIMENSION_CACHE.setdefault(table, {})
+    stats = DIMENSION_CACHE_STATS.setdefault(table, {"hits": 0, "misses": 0})
+    if value in cache:
+        stats["hits"] += 1
+        return cache[value]
+    stats["misses"] += 1
+
+    id_value = None
+    if (DB_CONNECTION is not None and REGISTRY_CONNECTION is not None):
+        # sharded storage: the id is created (or found) in the registry and the value copied with this id into the shard
+        id_value = shards.registry_ids(REGISTRY_CONNECTION, table, DIMENSION_COLUMNS[table], [value], DB_CONNECTION.cursor(), chunk_size=SQL_CHUNK_SIZE).get(str(value))
+        cache[value] = id_value
+    elif (DB_CONNECTION is not None):
+        column = DIMENSION_COLUMNS[table]
+        log.debug("ready to store in database %s, value: %s", table, value)
         cur = DB_CONNECTION.cursor()
-        cur.execute("Select id from project where project_id = ?", (value,))
+        cur.execute("Select id from " + table + " where " + column + " = ?", (value,))
         rows = cur.fetchall()
         if (len(rows) == 0 ):
-            #create project
-            cur.execute("INSERT INTO project (project_id) values(?)", (value,))
-            DB_CONNECTION.commit()
+            cur.execute("INSERT INTO " + table + " (" + column + ") values(?)", (value,))
             id_value = cur.lastrowid
-            log.info("A new project was successfully created with db id: {0}, project code: {1}".format(id_value, value))
+            log.info("A new %s was successfully created with db id: %s, value: %s", table, id_value, value)
         else:
             id_value = rows[0][0]
+        cache[value] = id_value
     else:
-        log.error("unable to store project with code: {0}".format(value))
+        log.error("unable to store {0} with value: {1}".format(table, value))
 
     return id_value
 
 
-def store_resolution(value):
+def lookup_version_ids(cur, names):
     """
-        Description: Store resolution data into the database
+        Description: Return a dictionary {version name: db id} for the version names, served from the dimension cache and completed from the database
+        Versions are only created by the version discovery, unknown names are missing from the result
     """
 
-    if (DB_CONNECTION is not None):
-        log.info("ready to store in database resolution, value :{0}".format(value))
-        cur = DB_CONNECTION.cursor()
-        cur.execute("Select id from resolution where name = ?", (value,))
-        rows = cur.fetchall()
-        if (len(rows) == 0 ):
-            #create resolution
-            cur.execute("INSERT INTO resolution (name) values(?)", (value,))
-            DB_CONNECTION.commit()
-            id_value = cur.lastrowid
-            log.info("A new resolution was successfully created with db id: {0}, project code: {1}".format(id_value, value))
+    cache = DIMENSION_CACHE.setdefault("version", {})
+    stats = DIMENSION_CACHE_STATS.setdefault("version", {"hits": 0, "misses": 0})
+    version_ids = {}
+    missing = []
+    for name in names:
+        if name in cache:
+            version_ids[name] = cache[name]
         else:
-            id_value = rows[0][0]
-    else:
-        log.error("unable to store resolution with name: {0}".format(value))
+            missing.append(name)
+    stats["hits"] += len(version_ids)
+    stats["misses"] += len(missing)
+
+    if len(missing) > 0:
+        found = select_ids_by(cur, "version", "name", missing)
+        if (REGISTRY_CONNECTION is not None and len(found) < len(missing)):
+            # sharded storage: versions discovered for the registry (versions of other projects too) are copied into the shard when first used
+            found.update(shards.registry_ids(REGISTRY_CONNECTION, "version", "name", [name for name in missing if name not in found], cur, create=False,
+                                             chunk_size=SQL_CHUNK_SIZE))
+        for name, id_value in found.items():
+            cache[name] = id_value
+            version_ids[name] = id_value
+    return version_ids
+
+
+def registry_ids(table, column, values):
+    """
+        Description: Sharded storage: return {value: registry id} of the values, served from the dimension cache, the unknown values are created in the registry
+    """
 
-    return id_value
+    cache = DIMENSION_CACHE.setdefault(table, {})
+    missing = [value for value in values if value not in cache]
+    if len(missing) > 0:
+        cache.update(shards.registry_ids(REGISTRY_CONNECTION, table, column, missing, chunk_size=SQL_CHUNK_SIZE))
+    return {value: cache[value] for value in values}
+
+
+def store_project(value):
+    """
+        Description: Store project data into the database
+    """
+
+    return store_dimension("project", value)
+
+
+def store_resolution(value):
+    """
+        Description: Store resolution data into the database
+    """
+
+    return store_dimension("resolution", value)
 
 
 def store_status(value):
@@ -377,23 +1437,7 @@ def store_status(value):
         Description: Store status data into the database
     """
 
-    if (DB_CONNECTION is not None):
-        log.info("ready to store in database status, value :{0}".format(value))
-        cur = DB_CONNECTION.cursor()
-        cur.execute("Select id from status where name = ?", (value,))
-        rows = cur.fetchall()
-        if (len(rows) == 0 ):
-            #create status
-            cur.execute("INSERT INTO status (name) values(?)", (value,))
-            DB_CONNECTION.commit()
-            id_value = cur.lastrowid
-            log.info("A new status was successfully created with db id: {0}, project code: {1}".format(id_value, value))
-        else:
-            id_value = rows[0][0]
-    else:
-        log.error("unable to store status with name: {0}".format(value))
-
-    return id_value
+    return store_dimension("status", value)
 
 
 def store_type(value):
@@ -401,214 +1445,665 @@ def store_type(value):
         Description: Store type data into the database
     """
 
-    if (DB_CONNECTION is not None):
-        log.info("ready to store in database type, value :{0}".format(value))
-        cur = DB_CONNECTION.cursor()
-        cur.execute("Select id from type where name = ?", (value,))
-        rows = cur.fetchall()
-        if (len(rows) == 0 ):
-            #create type
-            cur.execute("INSERT INTO type (name) values(?)", (value,))
-            DB_CONNECTION.commit()
-            id_value = cur.lastrowid
-            log.info("A new type was successfully created with db id: {0}, project code: {1}".format(id_value, value))
-        else:
-            id_value = rows[0][0]
-    else:
-        log.error("unable to store type with name: {0}".format(value))
-
-    return id_value
+    return store_dimension("type", value)
 
 
-def getJiraValue(jira_connector, dict, element_list, key):
+def compile_field_mapper(fields_dict):
     """
-        Description: Get the necessary issue fields data from the Jira issue output
+        Description: Compile the fields JSON mapper once into a list of (key, path, list field, kind) extractors used by map_issue
+        "fields.components.name[]" -> ("components", ("fields", "components"), "name", MAP_LIST), "fields.status.name" -> ("status", ("fields", "status", "name"), None, MAP_VALUE)
     """
-    
-    value = None
-    temp_dict = {}
-    sprint_regex = r"id=([\d*]*)"
 
-    try:
-        if (len(element_list) == 1):
-            value = dict[element_list[0]]
+    mapper = []
+    for key, value in fields_dict.items():
+        element_list = value.split(".")
+        if (len(element_list) > 1 and element_list[-1][-2:] == "[]"):
+            mapper.append((key, tuple(element_list[:-1]), element_list[-1][:-2], MAP_LIST))
+        elif (key == "sprints"):
+            mapper.append((key, tuple(element_list), None, MAP_SPRINTS))
         else:
-            temp_dict = dict[element_list[0]]
-            for item in element_list[1:-1]:
-                temp_dict = temp_dict[item]
-
-            #extract comma separated string from array input, see fields.json additiona_comments
-            if (element_list[-1][-2:] == "[]"):
-                value_array = []
-                for item in temp_dict:
-                    value_array.append(item[element_list[-1][:-2]])
-                value = ",".join(value_array)
-            else:
-                #populate Sprint table and return int array with sprint db ids
-                value = temp_dict[element_list[-1]]
-                if key == "sprints" and value is not None:
-                    sprint_ids = re.findall(sprint_regex, "|".join(value))
-                    log.info("The following sprints were identified {0}, from string {1}, with regex {2}".format(sprint_ids, value, sprint_regex))
-                    value = store_sprint_data(jira_connector, sprint_ids)
-                
-    except KeyError as ke:
-        value = ""
-        log.warning("KeyError unable to extract value for Key: {0}, error recived: {1}".format(key, ke))
-    except Exception as e:
-        value = ""
-        log.error("Exception unable to extract value for Key: {0}, error recived: {1}".format(key, e))
-    finally:
-        if (isinstance(value, str)):
-            return value
-        else:
-            if (value is None):
-                return ""
-            else:
-                return ",".join(value)
+            mapper.append((key, tuple(element_list), None, MAP_VALUE))
+    return mapper
 
 
-def store_sprint_data(jira_connector, sprint_ids):
+def map_issue(issue_dict):
     """
-        Description: Extract sprint data from jira (based on sprint_id) and store it into the database
-        Jira returned json: {'id': 1, 'sequence': 1, 'name': 'Sprint 1', 'state': 'CLOSED', 'linkedPagesCount': 0, 'goal': '....', 'startDate': '1/Jan/01 1:01 AM', 'endDate': '15/Jan/01 1:01 AM', 'isoStartDate': '2001-01-01T01:01:00+0000', 'isoEndDate': '2001-01-15T01:01:00+0000', 'completeDate': '16/Jan/01 1:01 AM', 'isoCompleteDate': '2001-01-16T01:01:07+0000', 'canUpdateSprint': True, 'remoteLinks': [], 'daysRemaining': 0}
+        Description: Get the necessary issue fields data from the Jira issue output, using the compiled mapper
+        Missing or empty values are returned as "", arrays as comma separated strings and sprints as the comma separated jira sprint ids
     """
 
-    sprint_dict = {}
-    sprint_db_ids = []
-
-    for id in sprint_ids:
-        sprint_dict = jira_connector.sprint_info(None, id)
-        log.info("Following sprint data was identified {0} for sprint id:{1}".format(sprint_dict, id))
+    populated_dict = {}
+    for key, path, list_field, kind in COMPILED_MAPPER:
+        value = issue_dict
         try:
-            if (DB_CONNECTION is not None):
-                log.info("ready to store in database sprint id :{0}".format(id))
-                cur = DB_CONNECTION.cursor()
-                cur.execute("Select * from sprint where sprint_id = ?", (id,))
-                rows = cur.fetchall()
-                if (len(rows) == 0 ):
-                    #create sprint
-                    cur.execute("INSERT INTO sprint(sprint_id, name, sequence, state, goal, start_date, end_date, complete_date) values(?,?,?,?,?,?,?,?)",
-                    (sprint_dict["id"],sprint_dict["name"], sprint_dict["sequence"], sprint_dict["state"], sprint_dict["goal"],sprint_dict["startDate"],sprint_dict["endDate"], sprint_dict["completeDate"],))
-                    DB_CONNECTION.commit()
-                    id_value = cur.lastrowid
-                    log.info("A new sprint successfully created with db id: {0}, sprint sprint id: {1}".format(id_value, id))
+            for element in path:
+                value = value[element]
+                if value is None:
+                    break
+
+            if value is None:
+                value = ""
+            elif kind == MAP_LIST:
+                value = ",".join(item[list_field] for item in value)
+            elif kind == MAP_SPRINTS:
+                # server returns greenhopper strings ('...Sprint@1[id=1,...]'), cloud returns sprint objects
+                if len(value) > 0 and isinstance(value[0], dict):
+                    value = ",".join(str(item["id"]) for item in value)
                 else:
-                    #TODO refactor this
-                    cur.execute("UPDATE sprint  set name=?, sequence=?, state=?, goal=?, start_date=?, end_date=?, complete_date=? WHERE sprint_id=?",
-                    (sprint_dict["name"], sprint_dict["sequence"], sprint_dict["state"], sprint_dict["goal"],sprint_dict["startDate"],sprint_dict["endDate"], sprint_dict["completeDate"],sprint_dict["id"],))
-                    DB_CONNECTION.commit()
-                                        
-                    cur.execute("Select id from sprint where sprint_id = ?", (sprint_dict["id"],))
-                    rows = cur.fetchall()
-                    id_value = rows[0][0]
-                    log.info("An updated sprint successfully for sprint db id: {0} with sprintid: {1}".format(id_value,sprint_dict["id"], ))
-            else:
-                log.error("unable to store sprint :{0}".format(sprint_dict))
-                id_value = ""
-            sprint_db_ids.append(str(id_value))
+                    value = ",".join(SPRINT_ID_REGEX.findall("|".join(value)))
+            elif isinstance(value, list):
+                value = ",".join(value)
+            elif not isinstance(value, str):
+                value = str(value)
+        except KeyError as ke:
+            value = ""
+            log.warning("KeyError unable to extract value for Key: %s, error recived: %s", key, ke)
+        except Exception as e:
+            value = ""
+            log.error("Exception unable to extract value for Key: %s, error recived: %s", key, e)
+        populated_dict[key] = value
+
+    return populated_dict
+
+
+def fetch_sprint_data(jira_connector, sprint_csv):
+    """
+        Description: Extract sprint data from jira (based on the sprint_id comma separated values) to be stored by the writer process
+        Sprints are served from the run wide sprint cache, only unknown sprints are requested from jira and added to the cache (failed lookups included)
+        sprint_info (agile API /rest/agile/1.0/sprint/{id}) returned json: {'id': 1, 'self': 'link.....', 'state': 'closed', 'name': 'Sprint 1', 'startDate': '2001-01-01T01:01:00.000Z', 'endDate': '2001-01-15T01:01:00.000Z', 'completeDate': '2001-01-16T01:01:07.000Z', 'originBoardId': 1, 'goal': '....'}
+    """
+
+    sprint_list = []
+
+    if sprint_csv == "":
+        return sprint_list
+
+    for id in sprint_csv.split(','):
+        sprint_dict = local_sprint_cache.get(id)
+        if sprint_dict is None and SPRINT_CACHE is not None:
+            sprint_dict = SPRINT_CACHE.get(id)
+        if sprint_dict is not None:
+            sprint_cache_stats["hits"] += 1
+            local_sprint_cache[id] = sprint_dict
+            if sprint_dict != SPRINT_LOOKUP_FAILED:
+                sprint_list.append(sprint_dict)
+            continue
+
+        try:
+            sprint_cache_stats["misses"] += 1
+            request_started = time.monotonic()
+            try:
+                sprint_dict = compact_sprint(jira_connector.sprint_info(None, id))
+            except Exception:
+                record_request(request_started, True, "sprint_info")
+                raise
+            record_request(request_started, endpoint="sprint_info")
+            log.debug("Following sprint data was identified %s for sprint id: %s", LogPayload(sprint_dict), id)
+            local_sprint_cache[id] = sprint_dict
+            if SPRINT_CACHE is not None:
+                SPRINT_CACHE[id] = sprint_dict
+            sprint_list.append(sprint_dict)
         except Exception as e:
-            log.error("Exception unable to store sprint data{0} error received: {1}".format(sprint_dict, e))
+            log.error("Exception unable to extract sprint data for sprint id: %s error received: %s", id, e)
+            local_sprint_cache[id] = SPRINT_LOOKUP_FAILED
+            if SPRINT_CACHE is not None:
+                SPRINT_CACHE[id] = SPRINT_LOOKUP_FAILED
 
-    return sprint_db_ids
+    return sprint_list
+
+
+def compact_sprint(sprint_dict):
+    """
+        Description: Keep only the sprint fields stored in the sprint table, from a sprint of the agile API (sprint_info, board sprints and the async engine)
+        The agile API has no sequence and uses lower case states: the sequence is the sprint id and the state is stored in upper case
+    """
+
+    compact_dict = {}
+    for field in ("id", "name", "sequence", "state", "goal", "startDate", "endDate", "completeDate"):
+        compact_dict[field] = sprint_dict.get(field)
+    if (compact_dict["sequence"] is None):
+        compact_dict["sequence"] = compact_dict["id"]
+    compact_dict["state"] = str(compact_dict["state"] or "").upper()
+    return compact_dict
+
+
+def load_sprint_cache(sprint_cache):
+    """
+        Description: Add the closed sprints already stored in the database to the sprint cache, closed sprints do not change and are never requested again
+    """
+
+    if (DB_CONNECTION is None):
+        log.error("unable to load the stored sprints, no database connection")
+        return
+
+    rows = []
+    for connection in data_connections():
+        rows += connection.execute("Select sprint_id, name, sequence, state, goal, start_date, end_date, complete_date from sprint where upper(state) = 'CLOSED'").fetchall()
+    for row in rows:
+        sprint_cache[str(row[0])] = {"id": row[0], "name": row[1], "sequence": row[2], "state": row[3], "goal": row[4], "startDate": row[5], "endDate": row[6], "completeDate": row[7]}
+    log.info("Sprint cache loaded with {0} closed sprints from the database".format(len(rows)))
+
+
+def prefetch_board_sprints(jira_connector, board_ids, sprint_cache):
+    """
+        Description: Add all sprints of the boards to the sprint cache with one paginated request per board, instead of one sprint_info request per sprint
+        Agile board sprint output: {'id': 1, 'self': 'link.....', 'state': 'closed', 'name': 'Sprint 1', 'startDate': '2001-01-01T01:01:00.000Z', 'endDate': '2001-01-15T01:01:00.000Z', 'completeDate': '2001-01-16T01:01:07.000Z', 'originBoardId': 1, 'goal': '....'}
+    """
+
+    for board_id in board_ids:
+        request_started = time.monotonic()
+        try:
+            sprints = jira_connector.sprints(board_id, maxResults=False)
+            record_request(request_started, endpoint="board_sprints")
+            for sprint in sprints:
+                sprint_cache[str(sprint.raw["id"])] = compact_sprint(sprint.raw)
+            log.info("Sprint cache loaded with {0} sprints of board: {1}".format(len(sprints), board_id))
+        except JIRAError as je:
+            record_request(request_started, True, "board_sprints")
+            log.error("unable to collect the sprints of board: {0}, error received: {1}".format(board_id, je))
+
+
+def write_batch(batch):
+    """
+        Description: Store a batch of issue records (as prepared by store_issue_in_db), transition records (collect_changelogs), watermark and checkpoint records
+        inside one transaction: a task checkpoint is never committed without the issues extracted before it
+    """
+
+    issue_batch = [record for record in batch if "populated" in record]
+    transition_list = [record["transitions"] for record in batch if "transitions" in record]
+    watermark_list = complete_watermarks([record for record in batch if "watermark" in record])
+    checkpoint_list = [record["checkpoint"] for record in batch if "checkpoint" in record and record["checkpoint"][:2] not in dropped_tasks]
+    batch_started = time.perf_counter()
+    try:
+        DB_CONNECTION.execute("BEGIN IMMEDIATE")
+        store_issues_bulk(issue_batch)
+        store_transitions(transition_list)
+        store_watermarks(watermark_list)
+        store_checkpoints(checkpoint_list)
+        with instrumentation.timed("db.commit"):
+            DB_CONNECTION.commit()
+        log.info("Batch of {0} issues successfully committed".format(len(batch)))
+    except Error as er:
+        DB_CONNECTION.rollback()
+        instrumentation.count("db.rollbacks")
+        log.error("Unable to commit batch of {0} issues, error received: {1}".format(len(batch), er))
+        fail_dropped_tasks(checkpoint_list, er)
+    instrumentation.observe("db.write_batch", time.perf_counter() - batch_started)
+
+
+def fail_dropped_tasks(checkpoint_list, error):
+    """
+        Description: A batch could not be committed and its records are lost. Any task of the run that may have records in it is recorded as failed at its
+        last committed checkpoint: the tasks with a checkpoint in the batch and the tasks in progress (their next records always follow a checkpoint).
+        Their later checkpoints and the watermarks of their versions are ignored for the rest of the run, main.py --resume extracts the lost pages again
+    """
+
+    # a task without committed checkpoint is stored from its earliest state in the batch
+    earliest = {}
+    for checkpoint in checkpoint_list:
+        if checkpoint[:2] not in earliest or checkpoint[5] < earliest[checkpoint[:2]][5]:
+            earliest[checkpoint[:2]] = checkpoint
+    now = datetime.now().isoformat(timespec="seconds")
+    try:
+        in_progress = DB_CONNECTION.execute("Select run_id, task_key from run_task where run_id = ? and status = 'in_progress'", (RUN_ID,)).fetchall()
+        DB_CONNECTION.executemany("INSERT INTO run_task(run_id, task_key, task, status, attempts, next_start_at, max_updated, error, updated_at) values(?,?,?,'failed',0,?,?,?,?) "
+                                  "ON CONFLICT(run_id, task_key) DO UPDATE SET status='failed', error=excluded.error, updated_at=excluded.updated_at",
+                                  [checkpoint[:3] + checkpoint[5:7] + (str(error), now) for checkpoint in earliest.values()])
+        DB_CONNECTION.executemany("UPDATE run_task set status='failed', error=?, updated_at=? where run_id=? and task_key=?",
+                                  [(str(error), now) + tuple(task) for task in in_progress])
+        DB_CONNECTION.commit()
+    except Error as er:
+        DB_CONNECTION.rollback()
+        log.error("Unable to record the tasks of the lost batch as failed, error received: {0}".format(er))
+        in_progress = []
+    for run_id, key in list(earliest) + [tuple(task) for task in in_progress]:
+        dropped_tasks.add((run_id, key))
+        task = json.loads(key)
+        blocked_versions.add((task[0], task[1]))
+        pending_watermarks.pop((task[0], task[1]), None)
+    instrumentation.count("task.failed", len(set(earliest) | set(tuple(task) for task in in_progress)))
+    log.error("Tasks failed with the lost batch: {0}, versions without watermark until main.py --resume: {1}".format(len(dropped_tasks), blocked_versions))
+
+
+def record_request(request_started, error=False, endpoint="search"):
+    """
+        Description: Add a jira request (started at request_started, time.monotonic) to the run instrumentation of its endpoint
+        and to the auto tune statistics of the worker processes
+    """
+
+    instrumentation.record_http(endpoint, time.monotonic() - request_started, error)
+    if (tune_stats is None):
+        return
+    with tune_stats.get_lock():
+        tune_stats[0] += 1
+        tune_stats[1] += 1 if error else 0
+        tune_stats[2] += time.monotonic() - request_started
+
+
+def next_concurrency_level(level, max_level, requests, errors, latency, best_latency):
+    """
+        Description: Auto tune controller, additive increase / multiplicative decrease of the concurrency level based on the requests of the last interval
+        latency is the average request latency of the interval, best_latency the lowest average seen so far
+    """
+
+    if (requests == 0):
+        return level
+    if (errors / requests > AUTO_TUNE_MAX_ERROR_RATE or (best_latency is not None and latency > best_latency * AUTO_TUNE_MAX_LATENCY_FACTOR)):
+        return max(1, level // 2)
+    return min(max_level, level + 1)
+
+
+def start_worker(processes):
+    p = Process(target=multithread_process_data,args=(current_process().name, workQueue, writeQueue, SPRINT_CACHE, len(processes), tune_stats, tune_level, RUN_STATS,
+                                                      task_counts, WRITE_QUEUES),
+                name="worker-{0}".format(len(processes)))
+    processes.append(p)
+    p.start()
+    print("Process: {0} is being created with id: {1}".format(p.name, p.pid))
+    log.debug("Process: %s is being created with id: %s", p.name, p.pid)
+
+
+def auto_tune_workers(processes):
+    """
+        Description: Run the worker processes with auto tune: every AUTO_TUNE_INTERVAL_SECONDS the allowed number of workers is changed by next_concurrency_level,
+        new workers are started when needed and the workers above the allowed level pause before their next task
+        The first tune_level workers are started by multithread_collect_data before the version discovery
+    """
+
+    global tune_stats
+    global tune_level
+
+    best_latency = None
+    while any(p.is_alive() for p in processes):
+        time.sleep(AUTO_TUNE_INTERVAL_SECONDS)
+        with tune_stats.get_lock():
+            requests, errors, latency = int(tune_stats[0]), int(tune_stats[1]), tune_stats[2]
+            tune_stats[0] = tune_stats[1] = tune_stats[2] = 0
+        latency = latency / requests if requests > 0 else 0
+
+        level = next_concurrency_level(tune_level.value, NUMBER_OF_THREADS, requests, errors, latency, best_latency)
+        if (requests > 0 and errors == 0 and (best_latency is None or latency < best_latency)):
+            best_latency = latency
+        while (len(processes) < level and not workQueue.empty()):
+            start_worker(processes)
+        tune_level.value = level
+        log.info("Auto tune: {0} requests, {1} errors, {2:.3f}s average latency (best {3}) -> {4} workers".format(requests, errors, latency, best_latency, level))
+        print("Auto tune: {0} workers ({1} requests, {2} errors, {3:.3f}s average latency)".format(level, requests, errors, latency))
+
+
+def timed_discovery(watermarks, sprint_cache):
+    """
+        Description: discover_versions, with the time until the last project is discovered reported as stage.version_discovery
+    """
+
+    discovery_started = time.perf_counter()
+    for project, version_tasks in discover_versions(watermarks, sprint_cache):
+        yield project, version_tasks
+    instrumentation.observe("stage.version_discovery", time.perf_counter() - discovery_started)
 
 
 def multithread_collect_data():
     """
         Description: prepare multithread queues based on extracted versions and limited by number of threads specified on top of the file
+        Returns the instrumentation snapshots of the worker and writer processes
     """
 
     global workQueue
+    global writeQueue
+    global SPRINT_CACHE
+    global tune_stats
+    global tune_level
+    global CHANGELOG_STATE
+    global RUN_STATS
+    global task_counts
+    global WRITE_QUEUES
     
     TH_JIRA_CONNECTION = connect_to_jira()
     number_of_threads = NUMBER_OF_THREADS
     workQueue = Queue()
+    # bounded, workers wait for the writer instead of piling up extracted issues in memory
+    writeQueue = Queue(maxsize=WRITE_QUEUE_SIZE)
     processes = []
-    
-    #create jobs and add them to the queue (for selected versions)
-    if (TH_JIRA_CONNECTION != None):
-        # populate a dictionary with all versions of the projects defined in the manifest.json file
-        for project in MANIFEST_JSON["extract_for"]:
-            # get project code and special filter, used
-            _project_code = MANIFEST_JSON["extract_for"][project]["settings"]["project_code"]
-            _special_filters = MANIFEST_JSON["extract_for"][project]["settings"]["special_filters"]
-
-
-            # populate an dictonary with versions for all each project, and assign it to project version dicte
-            version_dict[project] = get_project_versions(TH_JIRA_CONNECTION,
-                                        _project_code[0],
-                                        MANIFEST_JSON["extract_for"][project]["settings"]["regex_version"])
-            log.info("Finish collecting versions for project: {0}".format(project))
-            print("### Finish Versions for project: {0} ###".format(project))
-            
-            #create a new queue for each version so that each project and each version is analyzed by a different thread
-            for version_name in version_dict[project]["version_name"]:
-                version = {}
-                version["version_name"] = version_name
-                version["project_code"] = _project_code
-                version["manifest_project_name"] = project
-                version["special_filters"] = _special_filters
-                workQueue.put(version)
-                log.info("Finish adding version data to work queue: {0}".format(version))
-                # version output: {'version_id': '1', 'project_code': ['project_code'], 'manifest_project_name': 'Project name', 'special_filters': ['issuetype in standardIssueTypes()']}
-
-        log.debug("version dict:{0}".format(version_dict))
+    manager = Manager()
+    SPRINT_CACHE = manager.dict()
+    RUN_STATS = manager.list()
+    load_sprint_cache(SPRINT_CACHE)
+    watermarks = {} if FULL_RESYNC else load_watermarks()
+    # inherited by the worker processes, a full resync requests all changelogs again
+    if (CHANGELOG and not FULL_RESYNC):
+        CHANGELOG_STATE = load_changelog_state()
+    task_counts = (Value("i", -1), Value("i", 0))
+    # a resumed run continues its unfinished tasks, its other versions are not extracted again
+    resumed_tasks, run_versions = load_run_tasks(RUN_ID) if start_run() else ([], set())
+    resume_run = RUN_ID if len(run_versions) > 0 else None
+
+    # a single writer process owns all issue writes (one per shard with sharded storage), workers only extract and map data
+    if (STORAGE == "sharded"):
+        WRITE_QUEUES = {project: Queue(maxsize=WRITE_QUEUE_SIZE) for project in SHARDS}
+        writers = [Process(target=multithread_write_data, args=(WRITE_QUEUES[project], WRITER_BATCH_SIZE, WRITER_BATCH_TIMEOUT_MS, RUN_STATS, shard_file,
+                                                                       resume_run),
+                           name="writer-{0}".format(project)) for project, shard_file in SHARDS.items()]
     else:
+        WRITE_QUEUES = {}
+        writers = [Process(target=multithread_write_data, args=(writeQueue, WRITER_BATCH_SIZE, WRITER_BATCH_TIMEOUT_MS, RUN_STATS, None, resume_run),
+                           name="writer")]
+    for writer in writers:
+        writer.start()
+        log.debug("Writer process: %s is being created with id: %s", writer.name, writer.pid)
+
+    if (TH_JIRA_CONNECTION is None):
         log.error("TH_JIRA_CONNECTION is None !!! in multithread_collect_data")
-
-    for w in range(number_of_threads):
-        p = Process(target=multithread_process_data,args=(current_process().name, workQueue))
-        processes.append(p)
-        p.start()
-        print("Process: {0} is being created with id: {1}".format(p.name, p.pid))
-        log.debug("Process: {0} is being created with id: {1}".format(p.name, p.pid))
-        
-
-    for p in processes:
-        p.join()
-        log.debug("join thread: {0}".format(p))
+    extraction_started = time.perf_counter()
+    if (TH_JIRA_CONNECTION is not None and ENGINE == "async"):
+        # single process, many concurrent requests over a pooled http session (see src/async_engine.py)
+        # the async engine extracts the versions of a project as soon as the discovery yields them
+        from src import async_engine
+        async_sprint_cache = dict(SPRINT_CACHE)
+        version_tasks = itertools.chain(resumed_tasks, (register_task(task) for project, tasks in timed_discovery(watermarks, async_sprint_cache) for task in tasks
+                                                        if (project, task["version_name"]) not in run_versions))
+        arguments = (version_tasks, writeQueue, async_sprint_cache, MANIFEST_JSON.get("async_engine", {}))
+        if (PROFILE_WORKER is not None):
+            instrumentation.run_profiled(PROFILE_WORKER, "async_extraction", async_engine.run_async_extraction, *arguments)
+        else:
+            async_engine.run_async_extraction(*arguments)
+    elif (TH_JIRA_CONNECTION is not None):
+        # the workers are started (forked) before the discovery threads, they wait for the tasks of the first discovered project
+        if (AUTO_TUNE):
+            tune_stats = Array("d", 3)
+            tune_level = Value("i", min(AUTO_TUNE_START_WORKERS, NUMBER_OF_THREADS))
+        for w in range(tune_level.value if AUTO_TUNE else number_of_threads):
+            start_worker(processes)
+
+        for task in resumed_tasks:
+            workQueue.put(task)
+        queued = len(resumed_tasks)
+        try:
+            for project, version_tasks in timed_discovery(watermarks, SPRINT_CACHE):
+                version_tasks = [task for task in version_tasks if (project, task["version_name"]) not in run_versions]
+                with instrumentation.timed("stage.task_sizing"):
+                    tasks = split_version_tasks(TH_JIRA_CONNECTION, version_tasks)
+                for task in tasks:
+                    workQueue.put(register_task(task))
+                queued += len(tasks)
+        finally:
+            # no more tasks will come, the workers stop once they took them all
+            task_counts[0].value = queued
+
+        if (AUTO_TUNE):
+            auto_tune_workers(processes)
+        for p in processes:
+            p.join()
+            log.debug("join thread: %s", p)
+            if (p.exitcode != 0):
+                log.error("Worker {0} exited with code {1}, its task is left to main.py --resume".format(p.name, p.exitcode))
+    instrumentation.observe("stage.extraction", time.perf_counter() - extraction_started)
+
+    # all workers are done, let the writers flush the last batch and exit
+    with instrumentation.timed("stage.writer_drain"):
+        for _write_queue in list(WRITE_QUEUES.values()) or [writeQueue]:
+            _write_queue.put(None)
+        for writer in writers:
+            writer.join()
+            log.debug("join writer: %s", writer)
+    finish_run()
+    snapshots = list(RUN_STATS)
+    manager.shutdown()
     
     log.info("EXIT MAIN THREAD")
+    return snapshots
 
 
-def multithread_process_data(mainThread, _work_queue):
+def multithread_process_data(mainThread, _work_queue, _write_queue, _sprint_cache, worker_index=0, _tune_stats=None, _tune_level=None, _run_stats=None,
+                             _task_counts=None, _write_queues=None):
     """
-        Description: each thread will extract and process the data for the version added in the queue
+        Description: each thread will extract and process the data for the version added in the queue, the processed issues are pushed to the write queue
+        With auto tune, the worker pauses before its next task while its worker_index is above the allowed level
+        The instrumentation snapshot of the worker is added to _run_stats at the end, the first worker runs under the profiler when PROFILE_WORKER is set
     """
     
+    global writeQueue
+    global SPRINT_CACHE
+    global tune_stats
+    global WRITE_QUEUES
+
+    writeQueue = _write_queue
+    SPRINT_CACHE = _sprint_cache
+    tune_stats = _tune_stats
+    WRITE_QUEUES = _write_queues or {}
+    # the instrumentation state of the main process is inherited by the fork
+    instrumentation.reset()
     TH_JIRA_CONNECTION = connect_to_jira()
     
     # extract issues under populated versions
     if (TH_JIRA_CONNECTION is not None):
-        while True:
-            try:
-                data = _work_queue.get_nowait()
-                project_code = data["manifest_project_name"]
-                collect_version_issues(TH_JIRA_CONNECTION, data["project_code"], data["special_filters"], data['version_name'])
-                
-            except queue.Empty:
-                break
+        if (PROFILE_WORKER is not None and worker_index == 0):
+            instrumentation.run_profiled(PROFILE_WORKER, current_process().name, process_tasks, TH_JIRA_CONNECTION, _work_queue, worker_index, _tune_level,
+                                         _task_counts)
+        else:
+            process_tasks(TH_JIRA_CONNECTION, _work_queue, worker_index, _tune_level, _task_counts)
 
+        log.info("Sprint cache for {0}: {1} hits, {2} requests to jira".format(current_process().name, sprint_cache_stats["hits"], sprint_cache_stats["misses"]))
+        instrumentation.count("sprint_cache.hits", sprint_cache_stats["hits"])
+        instrumentation.count("sprint_cache.misses", sprint_cache_stats["misses"])
+        if (_run_stats is not None):
+            _run_stats.append(instrumentation.snapshot(current_process().name))
         return True
 
 
-def populate_db():
+def process_tasks(jira_connector, _work_queue, worker_index, _tune_level, _task_counts=None):
+    """
+        Description: Worker loop, extract the version tasks of the work queue until all tasks queued by the version discovery are taken (see task_counts)
+        Without _task_counts all tasks are queued up front and the loop ends when the queue is empty
+    """
+
+    global writeQueue
+
+    default_write_queue = writeQueue
+    def finished():
+        if (_task_counts is None):
+            return _work_queue.empty()
+        return _task_counts[0].value >= 0 and _task_counts[1].value >= _task_counts[0].value
+
+    while True:
+        if (_tune_level is not None and worker_index >= _tune_level.value):
+            if finished():
+                break
+            time.sleep(1)
+            continue
+        try:
+            data = _work_queue.get(timeout=WORK_QUEUE_POLL_SECONDS)
+            if (_task_counts is not None):
+                with _task_counts[1].get_lock():
+                    _task_counts[1].value += 1
+            instrumentation.gauge("queue.work_depth", instrumentation.queue_size(_work_queue))
+            writeQueue = task_write_queue(data, default_write_queue)
+            with instrumentation.timed("task"):
+                extract_task(jira_connector, data)
+            
+        except queue.Empty:
+            if finished():
+                break
+
+
+def extract_task(jira_connector, data):
+    """
+        Description: Extract a version task of the run, an attempt that fails (jira error, dropped connection...) is retried after
+        task_retry_delay(attempt) seconds from the first issue not extracted yet. After TASK_MAX_ATTEMPTS the task is recorded as failed
+        and left to main.py --resume. Returns True when the task is done
+    """
+
+    error = None
+    for attempt in range(1, TASK_MAX_ATTEMPTS + 1):
+        if (attempt > 1):
+            instrumentation.count("task.retries")
+            time.sleep(task_retry_delay(attempt))
+        writeQueue.put(checkpoint_record(data, "in_progress", 1))
+        try:
+            collect_version_issues(jira_connector, data["project_code"], data["special_filters"], data['version_name'], data["manifest_project_name"],
+                                   data["watermark"], data["start_at"], data["end_at"], data["chunk"], data)
+            return True
+        except Exception as e:
+            error = e
+            log.error("Attempt {0} of {1} failed for version: {2} of project: {3} at issue {4}, error received: {5}".format(
+                attempt, TASK_MAX_ATTEMPTS, data["version_name"], data["manifest_project_name"], data["start_at"], e))
+    instrumentation.count("task.failed")
+    writeQueue.put(checkpoint_record(data, "failed", error=str(error)))
+    return False
+
+
+def task_retry_delay(attempt):
+    # the first retry (attempt 2) waits TASK_RETRY_BACKOFF_SECONDS, doubled for each later attempt. Used by both engines
+    return TASK_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 2)
+
+
+def task_write_queue(data, default_queue):
+    # sharded storage: the records of a version task go to the writer of the shard of its manifest project
+    return WRITE_QUEUES.get(data["manifest_project_name"], default_queue)
+
+
+def multithread_write_data(_write_queue, batch_size, batch_timeout_ms, _run_stats=None, shard_file=None, resume_run=None):
     """
-        Description: main function
+        Description: single writer process, drains the write queue and commits the issues in batches of batch_size issues or every batch_timeout_ms, until None is received
+        With sharded storage the writer writes to shard_file and takes the dimension and sprint ids from the registry (the manifest database)
+        resume_run is the run continued by main.py --resume, the chunks it already extracted count for the watermarks of their versions
+        The instrumentation snapshot of the writer is added to _run_stats at the end
+    """
+
+    global DB_FILE
+    global REGISTRY_CONNECTION
+
+    instrumentation.reset()
+    if (shard_file is not None):
+        REGISTRY_CONNECTION = shards.connect_registry(DB_FILE)
+        DB_FILE = shard_file
+    # the connection inherited from the main process is not reused, the writer opens its own
+    connect_to_db()
+    DB_CONNECTION.execute("PRAGMA wal_autocheckpoint={0}".format(WRITER_WAL_AUTOCHECKPOINT))
+    warm_dimension_cache()
+    if (resume_run is not None):
+        complete_watermarks(done_chunk_records(resume_run))
+
+    batch = []
+    batch_started = time.monotonic()
+    finished = False
+    while not finished:
+        try:
+            record = _write_queue.get(timeout=batch_timeout_ms / 1000.0)
+            if record is None:
+                finished = True
+            else:
+                if len(batch) == 0:
+                    batch_started = time.monotonic()
+                batch.append(record)
+        except queue.Empty:
+            pass
+
+        if (len(batch) > 0) and (finished or len(batch) >= batch_size or (time.monotonic() - batch_started) * 1000 >= batch_timeout_ms):
+            instrumentation.gauge("queue.write_depth", instrumentation.queue_size(_write_queue))
+            write_batch(batch)
+            batch = []
+
+    disconnect_from_db()
+    if (REGISTRY_CONNECTION is not None):
+        REGISTRY_CONNECTION.close()
+    for table, stats in DIMENSION_CACHE_STATS.items():
+        log.info("Dimension cache for {0}: {1} hits, {2} misses".format(table, stats["hits"], stats["misses"]))
+        print("Dimension cache for {0}: {1} hits, {2} misses".format(table, stats["hits"], stats["misses"]))
+    log.info("Issues inserted: {0}, updated: {1}, unchanged: {2}".format(ISSUE_WRITE_STATS["inserted"], ISSUE_WRITE_STATS["updated"], ISSUE_WRITE_STATS["unchanged"]))
+    print("Issues inserted: {0}, updated: {1}, unchanged: {2}".format(ISSUE_WRITE_STATS["inserted"], ISSUE_WRITE_STATS["updated"], ISSUE_WRITE_STATS["unchanged"]))
+    for name, value in ISSUE_WRITE_STATS.items():
+        instrumentation.count("db.issues." + name, value)
+    if (_run_stats is not None):
+        _run_stats.append(instrumentation.snapshot(current_process().name))
+    log.info("EXIT WRITER PROCESS")
+
+
+def populate_db(full_resync=False, settings=None, rebuild_snapshot=False, resume=False):
+    """
+        Description: main function, full_resync extracts all issues instead of the ones updated since the last run
+        resume continues the last extraction run that did not complete: its done tasks are skipped and the others continue from their checkpoint
+        settings overrides the manifest "extraction" settings (see EXTRACTION_SETTINGS), rebuild_snapshot builds the daily_snapshot table again before the extraction
+        At the end the run report (instrumentation of all processes) is written to instrumentation.REPORT_DIR and summarized
+        Returns True when all tasks of the run are done
     """
 
     global log
+    global FULL_RESYNC
+    global RESUME
 
-    log = logging.getLogger(__name__)
-    
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
+    FULL_RESYNC = full_resync
+    RESUME = resume
+    run_started = datetime.now()
+    instrumentation.reset()
 
-    logging.basicConfig(filename='logs/log_data.log',level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    log = logging.getLogger(__name__)
 
+    # the logging settings come from the manifest and the main.py arguments
     get_credentials()
+    if (settings is not None):
+        apply_extraction_settings(settings)
+    configure_logging()
+    for warning in setting_warnings:
+        log.warning(warning)
+    setting_warnings.clear()
+    log.info("Extraction settings: engine={0}, workers={1}, page size={2}, writer batch size={3}, writer batch timeout={4}ms, task chunk size={5}, auto tune={6}, changelog={7}, storage={8}".format(
+        ENGINE, NUMBER_OF_THREADS, ISSUE_PAGE_SIZE, WRITER_BATCH_SIZE, WRITER_BATCH_TIMEOUT_MS, TASK_CHUNK_SIZE, AUTO_TUNE, CHANGELOG, STORAGE))
     connect_to_db()
-    multithread_collect_data()
+    with instrumentation.timed("stage.migrate"):
+        migrate_db()
+        if (STORAGE == "sharded"):
+            prepare_shards()
+    if (rebuild_snapshot):
+        with instrumentation.timed("stage.rebuild_snapshot"):
+            rebuild_daily_snapshot()
+    snapshots = multithread_collect_data()
+    if (EXPORT):
+        with instrumentation.timed("stage.export"):
+            export_dataset()
+    completed = DB_CONNECTION.execute("Select status from extraction_run where id = ?", (RUN_ID,)).fetchone()[0] == "completed"
     disconnect_from_db()
+    write_run_report(run_started, snapshots)
+    log_listener.stop()
+    return completed
+
+
+def export_dataset():
+    """
+        Description: Export stage, bring the columnar export of EXPORT_DIR up to date with the database (all shards with sharded storage)
+        pyarrow is an optional dependency, without it the stage is skipped
+    """
+
+    try:
+        from src import export
+    except ImportError as e:
+        log.error("Unable to export the dataset, pyarrow and numpy are required: {0}".format(e))
+        return
+
+    connection = shards.connect(DB_FILE, STORAGE == "sharded")
+    try:
+        written, unchanged, removed = export.export_dataset(connection, EXPORT_DIR)
+    finally:
+        connection.close()
+    instrumentation.count("export.partitions_written", written)
+    instrumentation.count("export.partitions_unchanged", unchanged)
+    print("Export to {0}: {1} partitions written, {2} unchanged, {3} removed".format(EXPORT_DIR, written, unchanged, removed))
+
+
+def write_run_report(run_started, snapshots):
+    """
+        Description: Merge the instrumentation snapshots of the worker and writer processes with the main process one, write the JSON run report and print its summary
+    """
+
+    run_settings = {key: globals()[name] for key, name in EXTRACTION_SETTINGS.items()}
+    run_settings["full_resync"] = FULL_RESYNC
+    run_settings["resume"] = RESUME
+    run_settings["run_id"] = RUN_ID
+    report = instrumentation.build_report(snapshots + [instrumentation.snapshot(current_process().name)], run_started, run_settings)
+    path = instrumentation.write_report(report)
+    log.info("Run report written to {0}".format(path))
+    for line in instrumentation.summary_lines(report):
+        log.info(line)
+        print(line)
 
 
 if __name__ == "__main__":
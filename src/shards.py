@@ -0,0 +1,237 @@
+"""
+    Description: Sharded storage (manifest extraction "storage": "sharded"): every manifest project is extracted into its own SQLite file, with the
+    db/jira_schema.sql schema, by its own writer process. The main database (manifest "database") is the registry of the global ids: the project, type,
+    status, resolution, version and sprint ids are created there and copied with the same id into the shards, the issue ids of every shard start at
+    its shard id * SHARD_ID_SPAN so that they never overlap
+    Queries see one logical dataset through connect() (the shards are attached to the main database and temp views named after the shard tables
+    union them) or through a single database built by merge_shards(), needed above the sqlite limit of attached databases (10 by default)
+    Run from the repository root: python3 -m src.shards [--merge target.db]
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+
+log = logging.getLogger(__name__)
+
+SCHEMA_FILE = "db/jira_schema.sql"
+# directory of the shard files, relative to the directory of the main database
+SHARD_DIR = "shards"
+SHARD_ID_SPAN = 2 ** 40
+# tables filled by the writers of the shards, the dimension tables are read from the registry
+SHARD_TABLES = ["issue", "issue_raw", "issue_sprints", "issue_fix_version", "issue_affects_version", "issue_transition", "sync_watermark", "sprint",
+                "daily_snapshot"]
+REGISTRY_TABLES = ["project", "type", "status", "resolution", "version", "version_catalogue"]
+# a sprint is stored by every shard with issues in it: one row per id, the daily_snapshot rows of the shards are summed
+SPRINT_KEY = ["id"]
+SNAPSHOT_KEY = ["project_id", "version_id", "type_id", "status_id", "day"]
+SNAPSHOT_SUMMED = ["created", "resolved"]
+
+
+def shard_name(shard_id, project):
+    return "{0}_{1}.db".format(shard_id, re.sub(r"[^\w.-]+", "_", project))
+
+
+def shard_path(database, shard_file):
+    return os.path.join(os.path.dirname(database), shard_file)
+
+
+def registered_shards(connection, database):
+    """
+        Description: Return the [(shard id, manifest project, shard path)] registered in the main database
+    """
+
+    return [(shard_id, project, shard_path(database, shard_file)) for shard_id, project, shard_file in
+            connection.execute("Select id, project, file from main.shard order by id")]
+
+
+def register_shard(connection, database, project):
+    """
+        Description: Return the path of the shard of a manifest project, the shard is registered in the main database and its file created when missing
+        A new shard file is created from SCHEMA_FILE, its issue ids start after shard id * SHARD_ID_SPAN
+    """
+
+    with connection:
+        connection.execute("INSERT INTO shard(project, file) values(?, '') ON CONFLICT(project) DO NOTHING", (project,))
+        shard_id, shard_file = connection.execute("Select id, file from shard where project = ?", (project,)).fetchone()
+        if (shard_file == ""):
+            shard_file = os.path.join(SHARD_DIR, shard_name(shard_id, project))
+            connection.execute("UPDATE shard set file=? where id=?", (shard_file, shard_id))
+
+    path = shard_path(database, shard_file)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shard = sqlite3.Connection(path)
+        try:
+            with open(SCHEMA_FILE) as _file:
+                shard.executescript(_file.read())
+            shard.execute("INSERT INTO sqlite_sequence(name, seq) values('issue', ?)", (shard_id * SHARD_ID_SPAN,))
+            shard.commit()
+        finally:
+            shard.close()
+        log.info("Shard {0} of project {1} created: {2}".format(shard_id, project, path))
+    return path
+
+
+def connect_registry(database):
+    """
+        Description: Connection of a shard writer to the registry, in autocommit mode: a new id is committed at once and never holds the registry lock
+    """
+
+    connection = sqlite3.Connection(database, timeout=30, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    return connection
+
+
+def table_columns(connection, table, schema="main"):
+    return [row[1] for row in connection.execute("PRAGMA " + schema + ".table_info(" + table + ")")]
+
+
+def registry_ids(registry, table, column, values, shard_cursor=None, create=True, chunk_size=500):
+    """
+        Description: Return {value: global id} of the values of a registry table column, missing values are created in the registry when create is True
+        With a shard_cursor the registry rows are also copied (same id) into the table of the shard
+    """
+
+    if (create):
+        registry.executemany("INSERT INTO " + table + "(" + column + ") values(?) ON CONFLICT(" + column + ") DO NOTHING", [(value,) for value in values])
+    columns = table_columns(registry, table)
+    position = columns.index(column)
+    ids = {}
+    for index in range(0, len(values), chunk_size):
+        chunk = values[index:index + chunk_size]
+        rows = registry.execute("Select " + ", ".join(columns) + " from " + table + " where " + column + " in (" + ",".join(["?"] * len(chunk)) + ")",
+                                chunk).fetchall()
+        if (shard_cursor is not None):
+            shard_cursor.executemany("INSERT OR REPLACE INTO " + table + "(" + ", ".join(columns) + ") values(" + ",".join(["?"] * len(columns)) + ")", rows)
+        for row in rows:
+            ids[str(row[position])] = row[0]
+    return ids
+
+
+def shard_select(table, columns, schemas):
+    """
+        Description: Select of the rows of a table in all attached shards, sprints are unique by id and the daily_snapshot rows of the shards are summed
+    """
+
+    union = " union all ".join("Select " + ", ".join(columns) + " from " + schema + "." + table for schema in schemas)
+    if (table == "sprint"):
+        return "Select " + ", ".join(columns) + " from (" + union + ") group by " + ", ".join(SPRINT_KEY)
+    if (table == "daily_snapshot"):
+        return ("Select " + ", ".join(SNAPSHOT_KEY + ["sum(" + column + ") as " + column for column in SNAPSHOT_SUMMED]) + " from (" + union + ") "
+                "group by " + ", ".join(SNAPSHOT_KEY))
+    return union
+
+
+def attach_shards(connection, database):
+    """
+        Description: Attach the registered shards to a connection of the main database and create a temp view for every shard table: queries of the
+        issue, sprint... tables see the rows of all shards, the dimension tables are the ones of the main database (registry)
+        Returns the number of attached shards
+    """
+
+    shards = registered_shards(connection, database)
+    if len(shards) == 0:
+        return 0
+    schemas = []
+    for shard_id, project, path in shards:
+        schema = "shard_{0}".format(shard_id)
+        try:
+            connection.execute("ATTACH DATABASE ? AS " + schema, (path,))
+        except sqlite3.OperationalError as er:
+            log.error("Unable to attach shard {0} ({1}), above the attached databases limit use: python3 -m src.shards --merge target.db".format(path, er))
+            raise
+        schemas.append(schema)
+    for table in SHARD_TABLES:
+        connection.execute("CREATE TEMP VIEW " + table + " AS " + shard_select(table, table_columns(connection, table), schemas))
+    log.info("Attached {0} shards".format(len(schemas)))
+    return len(schemas)
+
+
+def connect(database, sharded=False):
+    """
+        Description: Connection to the dataset of the manifest: the main database, with its shards attached with sharded storage
+    """
+
+    connection = sqlite3.Connection(database)
+    if (sharded):
+        attach_shards(connection, database)
+    return connection
+
+
+def merge_shards(database, target):
+    """
+        Description: Build a single database (same schema, usable as manifest "database" with single storage) from the registry and all shards,
+        one shard attached at a time with one INSERT ... SELECT per table. Returns the number of merged shards
+        Shards of manifest projects sharing project codes hold the same issues, the merge stops at the first duplicate and the target is removed
+    """
+
+    if os.path.exists(target):
+        raise FileExistsError("{0} already exists".format(target))
+    connection = sqlite3.Connection(target)
+    try:
+        with open(SCHEMA_FILE) as _file:
+            connection.executescript(_file.read())
+        connection.execute("ATTACH DATABASE ? AS registry", (database,))
+        with connection:
+            for table in REGISTRY_TABLES:
+                columns = ", ".join(table_columns(connection, table))
+                connection.execute("INSERT INTO main." + table + "(" + columns + ") Select " + columns + " from registry." + table)
+        shards = connection.execute("Select id, project, file from registry.shard order by id").fetchall()
+        connection.execute("DETACH DATABASE registry")
+
+        for shard_id, project, shard_file in shards:
+            connection.execute("ATTACH DATABASE ? AS shard", (shard_path(database, shard_file),))
+            with connection:
+                for table in SHARD_TABLES:
+                    columns = table_columns(connection, table)
+                    select = "Select " + ", ".join(columns) + " from shard." + table
+                    if (table == "sprint"):
+                        connection.execute("INSERT OR IGNORE INTO main.sprint(" + ", ".join(columns) + ") " + select)
+                    elif (table == "daily_snapshot"):
+                        connection.execute("INSERT INTO main.daily_snapshot(" + ", ".join(columns) + ") " + select + " where true "
+                                           "ON CONFLICT(" + ", ".join(SNAPSHOT_KEY) + ") DO UPDATE SET " +
+                                           ", ".join(column + "=daily_snapshot." + column + " + excluded." + column for column in SNAPSHOT_SUMMED))
+                    else:
+                        connection.execute("INSERT INTO main." + table + "(" + ", ".join(columns) + ") " + select)
+            connection.execute("DETACH DATABASE shard")
+            log.info("Shard {0} of project {1} merged into {2}".format(shard_id, project, target))
+    except sqlite3.IntegrityError as er:
+        connection.close()
+        os.remove(target)
+        raise ValueError("shard {0} of project {1} holds issues of another shard ({2}), manifest projects must not share project codes".format(shard_id, project, er))
+    finally:
+        connection.close()
+    return len(shards)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the shards of the manifest database, or merge them into a single database")
+    parser.add_argument("--merge", metavar="TARGET", help="new database file with the registry and the data of all shards")
+    args = parser.parse_args()
+
+    with open("manifest.json") as _file:
+        manifest = json.load(_file)
+    database = manifest["database"]
+    if (args.merge is not None):
+        print("{0} shards merged into {1}".format(merge_shards(database, args.merge), args.merge))
+        return
+
+    connection = sqlite3.Connection(database)
+    try:
+        for shard_id, project, path in registered_shards(connection, database):
+            issues = None
+            if os.path.exists(path):
+                shard = sqlite3.Connection(path)
+                issues = shard.execute("Select count(*) from issue").fetchone()[0]
+                shard.close()
+            print("{0:>4} {1:<30} {2:<40} {3} issues".format(shard_id, project, path, issues))
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
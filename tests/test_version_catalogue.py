@@ -0,0 +1,77 @@
+"""
+    Description: Version catalogue cache of the version discovery (multi_thread.fetch_project_versions and store_versions)
+"""
+
+import logging
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from src import multi_thread as mt
+
+PROJECT_CODE = "ABC"
+VERSIONS = [{"id": "1", "name": "ABC 2021.1", "archived": False, "released": True, "startDate": "2021-01-01", "releaseDate": "2021-02-01"}]
+
+
+class NotModifiedResponse:
+    status_code = 304
+    headers = {"ETag": '"catalogue"'}
+
+
+class CountingSession:
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append(headers)
+        return NotModifiedResponse()
+
+
+class FakeJira:
+    def __init__(self):
+        self._session = CountingSession()
+
+    def _get_url(self, path):
+        return "http://jira/rest/api/2/" + path
+
+
+class LaterDatetime(datetime):
+    # the next extraction, 30 minutes later
+    @classmethod
+    def now(cls, tz=None):
+        return datetime.now(tz) + timedelta(minutes=30)
+
+
+def stored_fetched_at(connection):
+    return connection.execute("Select fetched_at from version_catalogue where project_code = ?", (PROJECT_CODE,)).fetchone()[0]
+
+
+def test_fresh_catalogue_is_revalidated_after_the_ttl(monkeypatch):
+    connection = sqlite3.connect(":memory:")
+    with open("db/jira_schema.sql") as _file:
+        connection.executescript(_file.read())
+    jira = FakeJira()
+    # the module logger is created by populate_db
+    monkeypatch.setattr(mt, "log", logging.getLogger(mt.__name__))
+    monkeypatch.setattr(mt, "DB_CONNECTION", connection)
+    monkeypatch.setattr(mt, "VERSION_CACHE_TTL_MINUTES", 60)
+    monkeypatch.setattr(mt, "discovery_connection", lambda: jira)
+
+    mt.store_versions(PROJECT_CODE, "fetched", VERSIONS, '"catalogue"')
+    fetched_at = (datetime.now(timezone.utc) - timedelta(minutes=50)).strftime(mt.WATERMARK_FORMAT)
+    connection.execute("UPDATE version_catalogue set fetched_at = ?", (fetched_at,))
+
+    # within the ttl the stored catalogue is served without request and keeps its fetch date
+    status, versions, etag = mt.fetch_project_versions(PROJECT_CODE, mt.load_version_catalogue()[PROJECT_CODE], [], {})
+    mt.store_versions(PROJECT_CODE, status, versions, etag)
+    assert status == "fresh"
+    assert jira._session.requests == []
+    assert stored_fetched_at(connection) == fetched_at
+
+    # the next run is past the ttl: the catalogue is revalidated with its etag
+    monkeypatch.setattr(mt, "datetime", LaterDatetime)
+    status, versions, etag = mt.fetch_project_versions(PROJECT_CODE, mt.load_version_catalogue()[PROJECT_CODE], [], {})
+    mt.store_versions(PROJECT_CODE, status, versions, etag)
+    assert status == "not_modified"
+    assert jira._session.requests == [{"If-None-Match": '"catalogue"'}]
+    assert versions == VERSIONS
+    assert stored_fetched_at(connection) > fetched_at